@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+输入联想: 进程内有序索引（vocabulary_autocomplete）vs 全文检索（vocabulary_search）
+
+流程:
+1. 临时 SQLite 库里插入 --words 个随机单词
+2. 测索引的首次构建耗时
+3. 对 1~4 个字符的随机前缀各查 --lookups 次，分别统计两种方式的 p50 / p99 延迟
+   （索引查询不碰数据库，版本号检查间隔设为很大，只测查找本身；另外单独测一次带版本号检查的查询）
+
+用法:
+    python benchmarks/bench_autocomplete.py --words 50000 --lookups 2000
+"""
+
+import os
+import sys
+import time
+import random
+import string
+import argparse
+import tempfile
+import statistics
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+from flask import Flask  # noqa: E402
+from sqlalchemy import text  # noqa: E402
+
+from src.models import db  # noqa: E402
+from src.database import run_migrations  # noqa: E402
+from src.services.vocabulary_autocomplete import VocabularyAutocomplete  # noqa: E402
+from src.services.vocabulary_search import vocabulary_search  # noqa: E402
+
+
+def seed(count):
+    rng = random.Random(42)
+    words = set()
+    while len(words) < count:
+        words.add(''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 12))))
+    db.session.execute(text('INSERT INTO vocabulary_items (word, definition) VALUES (:w, :d)'),
+                       [{'w': w, 'd': f'definition of {w}'} for w in words])
+    db.session.commit()
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return statistics.median(samples), samples[int(len(samples) * 0.99) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--words', type=int, default=50000)
+    parser.add_argument('--lookups', type=int, default=2000)
+    parser.add_argument('--limit', type=int, default=10)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='bench_ac_'), 'b.db')
+    db.init_app(app)
+    rng = random.Random(7)
+
+    with app.app_context():
+        run_migrations(db.engine)
+        seed(args.words)
+
+        index = VocabularyAutocomplete(check_interval=3600)
+        started = time.perf_counter()
+        index.suggest('a', args.limit)
+        print(f"{args.words} words, first build {(time.perf_counter() - started) * 1000:.1f}ms")
+
+        print(f"\n{'prefix len':>10}{'index p50':>14}{'index p99':>14}{'search p50':>14}{'search p99':>14}")
+        for length in (1, 2, 3, 4):
+            prefixes = [''.join(rng.choice(string.ascii_lowercase) for _ in range(length))
+                        for _ in range(args.lookups)]
+            index_times, search_times = [], []
+            for prefix in prefixes:
+                started = time.perf_counter()
+                index.suggest(prefix, args.limit)
+                index_times.append(time.perf_counter() - started)
+            for prefix in prefixes[:max(args.lookups // 10, 1)]:
+                started = time.perf_counter()
+                vocabulary_search.search(prefix, limit=args.limit)
+                search_times.append(time.perf_counter() - started)
+            i50, i99 = percentiles(index_times)
+            s50, s99 = percentiles(search_times)
+            print(f"{length:>10}{i50 * 1e6:>12.1f}us{i99 * 1e6:>12.1f}us{s50 * 1e3:>12.2f}ms{s99 * 1e3:>12.2f}ms")
+
+        # 每 AUTOCOMPLETE_VERSION_CHECK_SECONDS 秒才有一次的版本号检查（一条主键查询）
+        index.check_interval = 0
+        started = time.perf_counter()
+        index.suggest('abc', args.limit)
+        print(f"\nlookup including the version check: {(time.perf_counter() - started) * 1e6:.0f}us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+热点查询在加索引前后的执行计划与延迟对比
+
+流程:
+1. 在一个空库上执行迁移 0001（只有表，没有二级索引）
+2. 灌入测试数据（默认 20 万单词 + 2 万会话 + 100 万消息）
+3. 对 add_vocabulary 查重、单词/会话列表、按会话取消息这几条查询，打印执行计划并测量延迟
+4. 执行迁移 0002（建索引），再测一遍
+
+用法:
+    python benchmarks/bench_db_indexes.py                                   # 临时 SQLite 文件
+    python benchmarks/bench_db_indexes.py --database-url postgresql://...   # 必须是一个空库
+    python benchmarks/bench_db_indexes.py --vocabulary 20000 --messages 100000 --sessions 2000
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, text
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+from src.database.migrations import run_migrations  # noqa: E402
+
+BATCH = 10000
+
+QUERIES = {
+    'add_vocabulary duplicate check': (
+        'SELECT id FROM vocabulary_items WHERE word = :word LIMIT 1',
+        lambda a: {'word': f'word{random.randrange(a.vocabulary)}'}),
+    'vocabulary list page': (
+        'SELECT * FROM vocabulary_items ORDER BY created_at DESC LIMIT 20',
+        lambda a: {}),
+    'sessions list page': (
+        'SELECT * FROM conversation_sessions ORDER BY created_at DESC LIMIT 20',
+        lambda a: {}),
+    'session messages': (
+        'SELECT * FROM conversation_messages WHERE session_id = :session_id ORDER BY timestamp ASC',
+        lambda a: {'session_id': f'session-{random.randrange(a.sessions)}'}),
+}
+
+
+def seed(engine, args):
+    start_time = datetime(2024, 1, 1)
+    print(f"Seeding {args.vocabulary} vocabulary items, {args.sessions} sessions, {args.messages} messages ...")
+    started = time.perf_counter()
+    with engine.begin() as conn:
+        for lo in range(0, args.vocabulary, BATCH):
+            conn.execute(text(
+                'INSERT INTO vocabulary_items (word, definition, example_sentence, created_at, updated_at) '
+                'VALUES (:word, :definition, :example, :ts, :ts)'),
+                [{'word': f'word{i}', 'definition': f'Definition of word {i}.', 'example': f'I see word{i}.',
+                  'ts': start_time + timedelta(seconds=i * 30)} for i in range(lo, min(lo + BATCH, args.vocabulary))])
+        for lo in range(0, args.sessions, BATCH):
+            conn.execute(text(
+                'INSERT INTO conversation_sessions (session_id, theme, role, created_at) '
+                'VALUES (:session_id, :theme, :role, :ts)'),
+                [{'session_id': f'session-{i}', 'theme': 'Kitchen Cooking Assistant', 'role': 'Chef',
+                  'ts': start_time + timedelta(seconds=i * 300)} for i in range(lo, min(lo + BATCH, args.sessions))])
+        for lo in range(0, args.messages, BATCH):
+            conn.execute(text(
+                'INSERT INTO conversation_messages (session_id, sender, message, timestamp) '
+                'VALUES (:session_id, :sender, :message, :ts)'),
+                [{'session_id': f'session-{random.randrange(args.sessions)}', 'sender': 'user' if i % 2 else 'assistant',
+                  'message': f'Message number {i} about cooking vocabulary.',
+                  'ts': start_time + timedelta(seconds=i * 5)} for i in range(lo, min(lo + BATCH, args.messages))])
+    print(f"Seeded in {time.perf_counter() - started:.1f}s")
+    if engine.dialect.name == 'postgresql':
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.execute(text('ANALYZE'))
+
+
+def explain(conn, sql, params):
+    if conn.dialect.name == 'postgresql':
+        rows = conn.execute(text('EXPLAIN (ANALYZE, BUFFERS) ' + sql), params).fetchall()
+        return [r[0] for r in rows]
+    rows = conn.execute(text('EXPLAIN QUERY PLAN ' + sql), params).fetchall()
+    return [r[-1] for r in rows]
+
+
+def measure(engine, args, label):
+    print(f"\n=== {label} ===")
+    results = {}
+    with engine.connect() as conn:
+        for name, (sql, make_params) in QUERIES.items():
+            print(f"\n-- {name}")
+            for line in explain(conn, sql, make_params(args)):
+                print(f"   {line}")
+            timings = []
+            for _ in range(args.iterations):
+                params = make_params(args)
+                start = time.perf_counter()
+                conn.execute(text(sql), params).fetchall()
+                timings.append(time.perf_counter() - start)
+            timings.sort()
+            results[name] = (timings[len(timings) // 2] * 1000, timings[int(len(timings) * 0.95) - 1] * 1000)
+            print(f"   p50 {results[name][0]:.2f} ms   p95 {results[name][1]:.2f} ms")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query plans and latency before/after the hot path indexes')
+    parser.add_argument('--database-url', default=None, help='默认使用临时 SQLite 文件；Postgres 必须是空库')
+    parser.add_argument('--vocabulary', type=int, default=200000)
+    parser.add_argument('--sessions', type=int, default=20000)
+    parser.add_argument('--messages', type=int, default=1000000)
+    parser.add_argument('--iterations', type=int, default=50)
+    args = parser.parse_args()
+
+    tmpdir = None
+    url = args.database_url
+    if not url:
+        tmpdir = tempfile.mkdtemp(prefix='bench-db-')
+        url = f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    engine = create_engine(url)
+    print(f"Database: {engine.url.render_as_string(hide_password=True)}")
+
+    run_migrations(engine, target=1)
+    with engine.connect() as conn:
+        if conn.execute(text('SELECT COUNT(*) FROM vocabulary_items')).scalar():
+            print("ERROR: vocabulary_items is not empty; run the benchmark against an empty database")
+            sys.exit(1)
+    seed(engine, args)
+
+    before = measure(engine, args, 'before: migration 0001 only (no secondary indexes)')
+    started = time.perf_counter()
+    run_migrations(engine)
+    print(f"\nIndex migration took {time.perf_counter() - started:.1f}s")
+    after = measure(engine, args, 'after: migration 0002 (hot path indexes)')
+
+    print(f"\n{'query':<34}{'p50 before':>12}{'p50 after':>12}{'speedup':>10}")
+    for name in QUERIES:
+        b, a = before[name][0], after[name][0]
+        print(f"{name:<34}{b:>10.2f}ms{a:>10.2f}ms{b / a if a else float('inf'):>9.0f}x")
+
+    if tmpdir:
+        os.remove(os.path.join(tmpdir, 'bench.db'))
+        os.rmdir(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
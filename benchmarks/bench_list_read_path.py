@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+列表接口的读路径: ORM 对象 + to_dict() + jsonify vs Core 列元组 + fast_json（rows/sec）
+
+流程:
+1. 临时 SQLite 库里插入 --rows 个单词和会话
+2. 每种页大小（--page-sizes）下分别跑两种写法各 --repeat 次，取中位数耗时，换算成每秒行数:
+   - orm:  VocabularyItem.query ... .all() -> [item.to_dict()] -> jsonify（改动前的写法）
+   - core: select(*VOCABULARY_COLUMNS) -> rows_to_dicts -> fast_json.dumps（现在的写法）
+   会话列表同理（ConversationSession + session_to_dict vs select(*SESSION_COLUMNS)）
+3. 两种写法的输出先解析成对象比较一次，确保字段和值完全一致
+
+用法:
+    python benchmarks/bench_list_read_path.py --rows 5000 --page-sizes 20,100,500,2000
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+from datetime import datetime, timedelta
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+from flask import Flask, jsonify  # noqa: E402
+from sqlalchemy import select, text  # noqa: E402
+
+from src.models import db  # noqa: E402
+from src.models.vocabulary import VocabularyItem, ConversationSession  # noqa: E402
+from src.models.serializers import (VOCABULARY_COLUMNS, SESSION_COLUMNS, session_list_options,  # noqa: E402
+                                    session_to_dict)
+from src.database import run_migrations  # noqa: E402
+from src.services import fast_json  # noqa: E402
+
+
+def seed(rows):
+    now = datetime(2024, 1, 1, 12, 0, 0, 250000)
+    db.session.execute(text(
+        'INSERT INTO vocabulary_items (word, definition, example_sentence, created_at, updated_at) '
+        'VALUES (:w, :d, :e, :t, :t)'),
+        [{'w': f'word{i}', 'd': f'Definition of word {i}, a reasonably long sentence.',
+          'e': f'This is an example sentence using word{i}.', 't': now + timedelta(seconds=i)}
+         for i in range(rows)])
+    db.session.execute(text(
+        'INSERT INTO conversation_sessions (session_id, theme, role, created_at, message_count, '
+        'last_message_at, last_message_preview) VALUES (:s, :theme, :r, :t, 4, :t, :p)'),
+        [{'s': f'session-{i}', 'theme': 'Kitchen', 'r': 'Chef', 't': now + timedelta(minutes=i),
+          'p': 'What would you like to cook today?'} for i in range(rows)])
+    db.session.commit()
+
+
+def cases(limit):
+    def orm_vocabulary():
+        items = VocabularyItem.query.order_by(VocabularyItem.created_at.desc(), VocabularyItem.id.desc()) \
+            .limit(limit).all()
+        return jsonify({'vocabulary': [item.to_dict() for item in items]}).get_data()
+
+    def core_vocabulary():
+        rows = db.session.execute(select(*VOCABULARY_COLUMNS)
+                                  .order_by(VocabularyItem.created_at.desc(), VocabularyItem.id.desc())
+                                  .limit(limit)).all()
+        return fast_json.dumps({'vocabulary': fast_json.rows_to_dicts(rows)})
+
+    def orm_sessions():
+        sessions = ConversationSession.query.options(*session_list_options()) \
+            .order_by(ConversationSession.created_at.desc(), ConversationSession.id.desc()).limit(limit).all()
+        return jsonify({'sessions': [session_to_dict(s) for s in sessions]}).get_data()
+
+    def core_sessions():
+        rows = db.session.execute(select(*SESSION_COLUMNS)
+                                  .order_by(ConversationSession.created_at.desc(), ConversationSession.id.desc())
+                                  .limit(limit)).all()
+        return fast_json.dumps({'sessions': fast_json.rows_to_dicts(rows)})
+
+    return {'vocabulary': (orm_vocabulary, core_vocabulary), 'sessions': (orm_sessions, core_sessions)}
+
+
+def measure(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+        # 每次都是新的 session（和一个请求一样），identity map 不跨次复用
+        db.session.remove()
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--page-sizes', default='20,100,500,2000')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    page_sizes = [int(size) for size in args.page_sizes.split(',')]
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='bench_list_'), 'b.db')
+    db.init_app(app)
+
+    print(f"encoder: {'orjson' if fast_json.orjson is not None else 'json (orjson not installed)'}")
+    with app.app_context():
+        run_migrations(db.engine)
+        seed(args.rows)
+
+        for name, (orm, core) in cases(max(page_sizes)).items():
+            if json.loads(orm()) != json.loads(core()):
+                print(f"{name}: ORM and Core outputs differ")
+                sys.exit(1)
+            db.session.remove()
+
+        print(f"\n{'list':<12}{'page size':>10}{'orm rows/s':>14}{'core rows/s':>14}{'speedup':>10}")
+        for limit in page_sizes:
+            for name, (orm, core) in cases(limit).items():
+                rows = min(limit, args.rows)
+                orm_rate = rows / measure(orm, args.repeat)
+                core_rate = rows / measure(core, args.repeat)
+                print(f"{name:<12}{limit:>10}{orm_rate:>14,.0f}{core_rate:>14,.0f}{core_rate / orm_rate:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
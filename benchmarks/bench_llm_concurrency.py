@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+LLM 路由并发基准测试: sync worker vs gevent worker
+
+流程:
+1. 启动本地智普 stub 服务器（固定延迟，模拟慢的上游 LLM）
+2. 分别用 GUNICORN_WORKER_CLASS=sync 和 gevent 启动 1 个 gunicorn worker，
+   worker 内运行一个只包含对话回复接口的小 Flask 应用（真实的 conversation_ai_service + llm_client）
+3. 用 N 个并发客户端打满接口，比较吞吐量、延迟和同时在途的请求数
+
+用法:
+    python benchmarks/bench_llm_concurrency.py --concurrency 200 --requests 400 --latency 1.0
+"""
+
+import os
+import sys
+import time
+import socket
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+
+def create_app():
+    """gunicorn 入口: benchmarks.bench_llm_concurrency:create_app()"""
+    from flask import Flask, request, jsonify
+    from src.services.conversation_ai import conversation_ai_service
+
+    app = Flask(__name__)
+
+    @app.route('/bench/reply', methods=['POST'])
+    def reply():
+        data = request.get_json()
+        text = conversation_ai_service.generate_ai_response(data['message'], {
+            'session_id': data.get('session_id'), 'role': 'Teacher', 'theme': 'Benchmark', 'background': ''})
+        return jsonify({'success': True, 'reply': text})
+
+    return app
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _wait_for_port(port: int, timeout: float = 30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"port {port} did not open in {timeout}s")
+
+
+def run_load(port: int, concurrency: int, total: int):
+    import requests
+
+    def one(i):
+        start = time.perf_counter()
+        r = requests.post(f'http://127.0.0.1:{port}/bench/reply', json={'message': f'hello {i}', 'session_id': f'bench-{i}'},
+                   timeout=300)
+        return r.status_code, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as ex:
+        results = list(ex.map(one, range(total)))
+    elapsed = time.perf_counter() - start
+    latencies = sorted(d for code, d in results if code == 200)
+    return {
+        'ok': len(latencies),
+        'failed': total - len(latencies),
+        'elapsed_s': round(elapsed, 2),
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000) if latencies else None,
+        'p95_ms': round(latencies[int(len(latencies) * 0.95) - 1] * 1000) if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark sync vs gevent gunicorn workers on an LLM-bound route')
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--latency', type=float, default=1.0, help='stub 上游的固定延迟（秒）')
+    parser.add_argument('--profiles', default='sync,gevent')
+    args = parser.parse_args()
+
+    stub_port = _free_port()
+    stub = subprocess.Popen([sys.executable, os.path.join(PROJECT_ROOT, 'tools', 'zhipu_stub_server.py'),
+                             '--port', str(stub_port), '--latency', f'fixed:{args.latency}'],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        _wait_for_port(stub_port)
+        print(f"Stub upstream on :{stub_port} with {args.latency}s latency; "
+              f"{args.requests} requests at concurrency {args.concurrency}\n")
+        for profile in args.profiles.split(','):
+            port = _free_port()
+            env = dict(os.environ,
+                       GUNICORN_WORKER_CLASS=profile,
+                       WEB_CONCURRENCY='1',
+                       GUNICORN_WORKER_CONNECTIONS=str(args.concurrency),  # 这个小应用不连数据库，不按连接池限制
+                       PORT=str(port),
+                       GUNICORN_ACCESS_LOG='',
+                       ZHIPU_BASE_URL=f'http://127.0.0.1:{stub_port}/api/paas/v4',
+                       ZHIPU_API_KEY='stub.key',  # stub 不校验，只是让 llm_client 创建客户端
+                       LLM_RATE_LIMIT_RPS='100000',
+                       LLM_RATE_LIMIT_BURST='100000',
+                       LLM_MAX_RETRIES='0')
+            server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', os.path.join(PROJECT_ROOT, 'gunicorn.conf.py'),
+                                       'benchmarks.bench_llm_concurrency:create_app()'],
+                                      cwd=PROJECT_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                _wait_for_port(port)
+                result = run_load(port, args.concurrency, args.requests)
+                print(f"{profile:>7}: {result}")
+            finally:
+                server.terminate()
+                server.wait(timeout=30)
+    finally:
+        stub.terminate()
+        stub.wait(timeout=10)
+
+
+if __name__ == '__main__':
+    main()
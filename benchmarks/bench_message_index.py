@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+单词使用统计: 消息倒排索引（message_index）vs 对每个单词 LIKE 扫描 conversation_messages
+
+流程:
+1. 临时 SQLite 库里建 --sessions 个会话，每个 --messages 条学习者消息（从 --vocabulary 个词里随机组句）
+   和同样多的 AI 回复；消息逐条通过 index_messages 写索引（和 send_message 一样），统计写入耗时
+2. 单词本放入其中 --words 个词，分别用两种方式算每个词出现在多少条学习者消息里:
+   - like:  每个词一条 SELECT COUNT(*) ... WHERE sender = 'user' AND message LIKE '%word%'（子串匹配，结果偏多）
+   - index: term_counts 一条 GROUP BY 查询读计数列
+3. 打印耗时和索引大小（postings 字节数 vs 消息文本字节数）
+
+用法:
+    python benchmarks/bench_message_index.py --sessions 200 --messages 50 --words 500
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+from flask import Flask  # noqa: E402
+from sqlalchemy import text  # noqa: E402
+
+from src.models import db  # noqa: E402
+from src.database import run_migrations  # noqa: E402
+from src.services.message_index import index_messages, term_counts  # noqa: E402
+
+
+def make_vocabulary(rng, size):
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(letters) for _ in range(rng.randint(3, 9))))
+    return sorted(words)
+
+
+def seed(rng, vocabulary, sessions, messages):
+    """逐条插入并写索引，返回写索引的总耗时"""
+    now = datetime(2024, 1, 1)
+    db.session.execute(text('INSERT INTO conversation_sessions (session_id, theme, role, created_at) '
+                            'VALUES (:s, :theme, :r, :t)'),
+                       [{'s': f'session-{i}', 'theme': 'Travel', 'r': 'Guide', 't': now} for i in range(sessions)])
+    db.session.commit()
+    index_seconds = 0.0
+    insert = text('INSERT INTO conversation_messages (session_id, sender, message, timestamp) '
+                  'VALUES (:session_id, :sender, :message, :timestamp) RETURNING id')
+    for n in range(messages):
+        for i in range(sessions):
+            for sender in ('user', 'assistant'):
+                row = {'session_id': f'session-{i}', 'sender': sender, 'timestamp': now + timedelta(seconds=n),
+                       'message': ' '.join(rng.choice(vocabulary) for _ in range(rng.randint(5, 15))) + '.'}
+                row['id'] = db.session.execute(insert, row).scalar()
+                started = time.perf_counter()
+                index_messages(db.session, [row])
+                index_seconds += time.perf_counter() - started
+        db.session.commit()
+    return index_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sessions', type=int, default=200)
+    parser.add_argument('--messages', type=int, default=50)
+    parser.add_argument('--vocabulary', type=int, default=3000, help='组句用的词表大小')
+    parser.add_argument('--words', type=int, default=500, help='单词本里的词数')
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='bench_idx_'), 'b.db')
+    db.init_app(app)
+    rng = random.Random(42)
+    vocabulary = make_vocabulary(rng, args.vocabulary)
+    words = rng.sample(vocabulary, args.words)
+
+    with app.app_context():
+        run_migrations(db.engine)
+        index_seconds = seed(rng, vocabulary, args.sessions, args.messages)
+        user_messages = args.sessions * args.messages
+        print(f"{user_messages} learner messages indexed, "
+              f"{index_seconds / user_messages * 1e6:.0f}us per message (inside the insert transaction)")
+
+        text_bytes = db.session.execute(text("SELECT SUM(LENGTH(message)) FROM conversation_messages "
+                                             "WHERE sender = 'user'")).scalar()
+        posting_bytes, posting_rows = db.session.execute(
+            text('SELECT SUM(LENGTH(postings)), COUNT(*) FROM message_postings')).one()
+        print(f"learner message text {text_bytes / 1024:.0f} KiB, "
+              f"postings {posting_bytes / 1024:.0f} KiB in {posting_rows} (term, session) rows")
+
+        started = time.perf_counter()
+        like = {w: db.session.execute(text("SELECT COUNT(*) FROM conversation_messages "
+                                           "WHERE sender = 'user' AND message LIKE :p"), {'p': f'%{w}%'}).scalar()
+                for w in words}
+        like_ms = (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        counts = term_counts(db.session, words)
+        index_ms = (time.perf_counter() - started) * 1000
+
+        overcounted = sum(1 for w in words if like[w] != counts.get(w, (0, 0))[0])
+        print(f"\nusage counts for {args.words} words")
+        print(f"  like  (one scan per word)   {like_ms:9.1f}ms  ({overcounted} words overcounted by substring matches)")
+        print(f"  index (term_counts)         {index_ms:9.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
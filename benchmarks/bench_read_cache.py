@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+热点读接口在读缓存前后的延迟
+
+流程:
+1. 建一个临时 SQLite 文件库，灌入单词、会话和消息
+2. 每条 SQL 执行前 sleep --rtt-ms 毫秒，模拟到 us-east-2 Neon 的跨区域往返（--database-url 指向真实的库时设为 0）
+3. 对 GET /api/vocabulary/<id>、/api/sessions、/api/sessions/<id>/messages 各请求 --requests 次（热点 id 轮流访问），
+   分别在 不缓存 / 进程内缓存 / 只命中 SQLite 镜像 三种配置下测 p50 / p95
+
+用法:
+    python benchmarks/bench_read_cache.py
+    python benchmarks/bench_read_cache.py --rtt-ms 0 --database-url postgresql://...
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+from flask import Flask  # noqa: E402
+from sqlalchemy import event, text  # noqa: E402
+
+from src.models import db  # noqa: E402
+from src.database.migrations import run_migrations  # noqa: E402
+from src.services import read_cache as read_cache_module  # noqa: E402
+from src.services.read_cache import ReadCache  # noqa: E402
+from src.routes.vocabulary import vocabulary_bp  # noqa: E402
+from src.routes.conversation import conversation_bp  # noqa: E402
+
+HOT_ITEMS = 20
+
+
+def create_app(database_url):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    db.init_app(app)
+    app.register_blueprint(vocabulary_bp, url_prefix='/api')
+    app.register_blueprint(conversation_bp, url_prefix='/api')
+    return app
+
+
+def seed(app):
+    now = datetime(2024, 1, 1)
+    with app.app_context():
+        run_migrations(db.engine)
+        db.session.execute(text(
+            'INSERT INTO vocabulary_items (word, definition, created_at, updated_at) VALUES (:w, :d, :t, :t)'),
+            [{'w': f'word{i}', 'd': f'Definition of word {i}.', 't': now} for i in range(1000)])
+        db.session.execute(text(
+            'INSERT INTO conversation_sessions (session_id, theme, role, created_at) VALUES (:s, :theme, :r, :t)'),
+            [{'s': f'session-{i}', 'theme': 'Kitchen', 'r': 'Chef', 't': now + timedelta(minutes=i)}
+             for i in range(200)])
+        db.session.execute(text(
+            'INSERT INTO conversation_messages (session_id, sender, message, timestamp) VALUES (:s, :sender, :m, :t)'),
+            [{'s': f'session-{i % HOT_ITEMS}', 'sender': 'user' if i % 2 else 'assistant',
+              'm': f'Message {i} about cooking.', 't': now + timedelta(seconds=i)} for i in range(2000)])
+        db.session.commit()
+
+
+def measure(client, paths, requests):
+    timings = []
+    for n in range(requests):
+        started = time.perf_counter()
+        r = client.get(paths[n % len(paths)])
+        timings.append(time.perf_counter() - started)
+        assert r.status_code == 200, (paths[n % len(paths)], r.status_code, r.data[:200])
+    # 去掉每个路径的第一次（缓存冷启动），只看稳态
+    timings = sorted(timings[len(paths):])
+    return timings[len(timings) // 2] * 1000, timings[int(len(timings) * 0.95)] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', help='默认使用临时 SQLite 文件并灌入数据（指定时库里必须已有数据）')
+    parser.add_argument('--rtt-ms', type=float, default=25, help='每条 SQL 额外的往返延迟')
+    parser.add_argument('--requests', type=int, default=400)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_read_cache_')
+    database_url = args.database_url or 'sqlite:///' + os.path.join(workdir, 'bench.db')
+    app = create_app(database_url)
+    if not args.database_url:
+        seed(app)
+
+    if args.rtt_ms:
+        with app.app_context():
+            @event.listens_for(db.engine, 'before_cursor_execute')
+            def _simulated_round_trip(conn, cursor, statement, parameters, context, executemany):
+                time.sleep(args.rtt_ms / 1000)
+
+    endpoints = {
+        'GET /api/vocabulary/<id>': [f'/api/vocabulary/{i}' for i in range(1, HOT_ITEMS + 1)],
+        'GET /api/sessions': ['/api/sessions', '/api/sessions?limit=20'],
+        'GET /api/sessions/<id>/messages': [f'/api/sessions/session-{i}/messages' for i in range(HOT_ITEMS)],
+    }
+    configs = {
+        'no cache': ReadCache(enabled=False),
+        'in-process': ReadCache(enabled=True, ttl_seconds=300),
+        # 进程内一级几乎立刻过期，每次都落到 SQLite 镜像上（模拟另一个 worker 刚写入的数据）
+        'sqlite mirror': ReadCache(enabled=True, ttl_seconds=300, local_ttl_seconds=1e-9,
+                                   sqlite_path=os.path.join(workdir, 'read_cache.db')),
+    }
+
+    print(f"simulated round trip per SQL statement: {args.rtt_ms}ms, {args.requests} requests per endpoint")
+    client = app.test_client()
+    for label, paths in endpoints.items():
+        print(f"\n== {label} ==")
+        for name, cache in configs.items():
+            # 路由模块通过名字引用全局实例，替换模块属性即可切换配置
+            for module in ('src.routes.vocabulary', 'src.routes.conversation'):
+                sys.modules[module].read_cache = cache
+            read_cache_module.read_cache = cache
+            p50, p95 = measure(client, paths, args.requests)
+            print(f"  {name:<14} p50 {p50:8.3f}ms   p95 {p95:8.3f}ms")
+
+
+if __name__ == '__main__':
+    main()
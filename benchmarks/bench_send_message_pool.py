@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+send_message 的连接池占用: 旧写法（LLM 调用期间持有连接）vs 短事务 vs 批量延迟写入
+
+流程:
+1. 建一个临时 SQLite 文件库（或 --database-url 指定的空库），连接池固定为 --pool-size 个连接、不允许溢出
+2. 把 conversation_ai_service.generate_ai_response 换成固定延迟的函数，模拟慢的上游 LLM
+3. 每种写法用 N 个并发客户端各发若干条消息，后台线程每 5ms 采样一次 pool.checkedout()
+4. 打印吞吐量、延迟、连接池等待超时的请求数，以及连接池占用（峰值 / 平均）
+
+"旧写法" 是改动前 send_message 的原样复制: 查会话 -> add 用户消息 -> 等 LLM -> add AI 回复 -> commit，
+查会话时取到的连接一直到 commit 才归还。
+
+用法:
+    python benchmarks/bench_send_message_pool.py
+    python benchmarks/bench_send_message_pool.py --concurrency 40 --pool-size 5 --latency 1.0 --requests 4
+"""
+
+import os
+import sys
+import time
+import uuid
+import argparse
+import tempfile
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+from flask import Flask, request, jsonify  # noqa: E402
+
+from src.models import db  # noqa: E402
+from src.models.vocabulary import ConversationSession, ConversationMessage  # noqa: E402
+from src.database.migrations import run_migrations  # noqa: E402
+from src.services.conversation_ai import conversation_ai_service  # noqa: E402
+from src.services.message_writer import message_writer  # noqa: E402
+from src.routes.conversation import conversation_bp  # noqa: E402
+
+
+def legacy_send_message(session_id):
+    """改动前的 send_message（去掉了无关的响应字段）"""
+    try:
+        user_message = request.get_json().get('message')
+        session = ConversationSession.query.filter_by(session_id=session_id).first()
+        if not session:
+            return jsonify({'success': False, 'error': 'Session not found'}), 404
+        user_msg = ConversationMessage(session_id=session_id, sender='user', message=user_message,
+                                       timestamp=datetime.utcnow())
+        db.session.add(user_msg)
+        ai_response = conversation_ai_service.generate_ai_response(user_message, {
+            'session_id': session_id, 'role': session.role, 'theme': session.theme,
+            'background': session.background})
+        ai_msg = ConversationMessage(session_id=session_id, sender='assistant', message=ai_response,
+                                     timestamp=datetime.utcnow())
+        db.session.add(ai_msg)
+        db.session.commit()
+        return jsonify({'success': True, 'user_message': {'id': user_msg.id}, 'ai_message': {'id': ai_msg.id}})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+def create_app(database_url, pool_size, pool_timeout):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_size': pool_size, 'max_overflow': 0,
+                                               'pool_timeout': pool_timeout}
+    db.init_app(app)
+    app.register_blueprint(conversation_bp, url_prefix='/api')
+    app.add_url_rule('/legacy/sessions/<session_id>/messages', 'legacy_send_message',
+                     legacy_send_message, methods=['POST'])
+    message_writer.init_app(app)
+    return app
+
+
+class PoolSampler(threading.Thread):
+    def __init__(self, pool, interval=0.005):
+        super().__init__(daemon=True)
+        self.pool = pool
+        self.interval = interval
+        self.samples = []
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.samples.append(self.pool.checkedout())
+            time.sleep(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def run_case(app, name, path_template, session_ids, args):
+    client = app.test_client()
+    with app.app_context():
+        pool = db.engine.pool
+        # 预热连接池
+        db.session.execute(db.select(ConversationSession.id).limit(1)).all()
+        db.session.remove()
+
+    def one_client(i):
+        session_id = session_ids[i % len(session_ids)]
+        results = []
+        for n in range(args.requests):
+            started = time.perf_counter()
+            r = client.post(path_template.format(session_id=session_id), json={'message': f'hello {i}-{n}'})
+            results.append((r.status_code, time.perf_counter() - started, (r.get_json() or {}).get('error')))
+        return results
+
+    sampler = PoolSampler(pool)
+    sampler.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = [r for batch in executor.map(one_client, range(args.concurrency)) for r in batch]
+    elapsed = time.perf_counter() - started
+    sampler.stop()
+    if message_writer.enabled:
+        message_writer.flush()
+
+    ok = sorted(t for status, t, _ in results if status == 200)
+    timeouts = sum(1 for _, _, error in results if error and 'QueuePool limit' in error)
+    others = len(results) - len(ok) - timeouts
+    samples = sampler.samples or [0]
+    print(f"\n== {name} ==")
+    print(f"  requests: {len(results)}   ok {len(ok)}   pool timeouts {timeouts}   other errors {others}")
+    print(f"  throughput: {len(ok) / elapsed:.1f} req/s   elapsed {elapsed:.1f}s")
+    if ok:
+        print(f"  latency: p50 {ok[len(ok) // 2] * 1000:.0f}ms   p95 {ok[int(len(ok) * 0.95)] * 1000:.0f}ms")
+    print(f"  pool checked out: peak {max(samples)}/{args.pool_size}   "
+          f"mean {sum(samples) / len(samples):.2f}   "
+          f"time at 100% {sum(1 for s in samples if s >= args.pool_size) / len(samples) * 100:.0f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', help='默认使用临时 SQLite 文件')
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=3, help='每个客户端发送的消息数')
+    parser.add_argument('--latency', type=float, default=1.0, help='模拟的 LLM 延迟（秒）')
+    parser.add_argument('--pool-size', type=int, default=5)
+    parser.add_argument('--pool-timeout', type=float, default=2.0)
+    args = parser.parse_args()
+
+    database_url = args.database_url
+    if not database_url:
+        database_url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='bench_pool_'), 'bench.db')
+
+    def fake_llm(user_message, session_context):
+        time.sleep(args.latency)
+        return f"Reply to '{user_message}'"
+    conversation_ai_service.generate_ai_response = fake_llm
+
+    app = create_app(database_url, args.pool_size, args.pool_timeout)
+    with app.app_context():
+        run_migrations(db.engine)
+        session_ids = [str(uuid.uuid4()) for _ in range(args.concurrency)]
+        db.session.add_all([ConversationSession(session_id=s, theme='Benchmark', role='Teacher')
+                            for s in session_ids])
+        db.session.commit()
+
+    print(f"{args.concurrency} clients x {args.requests} messages, LLM latency {args.latency}s, "
+          f"pool_size {args.pool_size} (no overflow), pool_timeout {args.pool_timeout}s")
+    run_case(app, 'before: transaction held across the LLM call',
+             '/legacy/sessions/{session_id}/messages', session_ids, args)
+    message_writer.enabled = False
+    run_case(app, 'after: short transactions', '/api/sessions/{session_id}/messages', session_ids, args)
+    message_writer.enabled = True
+    run_case(app, 'after: write-behind queue', '/api/sessions/{session_id}/messages', session_ids, args)
+    print(f"\nwrite-behind: {message_writer.get_stats()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+会话列表的查询数: ConversationSession.to_dict()（逐个会话懒加载消息）vs serializers.py 的加载策略
+
+流程:
+1. 临时 SQLite 库里建 --sessions 个会话，每个 --messages 条消息
+2. 用 count_queries 统计每种写法执行的 SQL 条数，并测耗时:
+   - to_dict():                      查会话 + 每个会话一条查消息（N+1）
+   - GET /api/sessions:              只取会话的列，messages 被 raiseload 挡住
+   - GET /api/sessions?include=messages&messages_limit=N: 会话 + 一条窗口函数查询
+3. 会话数翻倍再测一遍，新写法的查询数应保持不变；查询数不是常数时以非零状态退出
+
+用法:
+    python benchmarks/bench_session_serialization.py --sessions 50 --messages 40
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+from flask import Flask  # noqa: E402
+from sqlalchemy import text  # noqa: E402
+
+from src.models import db  # noqa: E402
+from src.models.vocabulary import ConversationSession  # noqa: E402
+from src.database import run_migrations, count_queries  # noqa: E402
+from src.services.read_cache import read_cache  # noqa: E402
+from src.routes.conversation import conversation_bp  # noqa: E402
+
+
+def seed(sessions, messages, offset=0):
+    now = datetime(2024, 1, 1)
+    db.session.execute(text(
+        'INSERT INTO conversation_sessions (session_id, theme, role, created_at) VALUES (:s, :theme, :r, :t)'),
+        [{'s': f'session-{i}', 'theme': 'Kitchen', 'r': 'Chef', 't': now + timedelta(minutes=i)}
+         for i in range(offset, offset + sessions)])
+    db.session.execute(text(
+        'INSERT INTO conversation_messages (session_id, sender, message, timestamp) VALUES (:s, :sender, :m, :t)'),
+        [{'s': f'session-{i}', 'sender': 'user' if n % 2 else 'assistant', 'm': f'Message {n} in session {i}.',
+          't': now + timedelta(minutes=i, seconds=n)}
+         for i in range(offset, offset + sessions) for n in range(messages)])
+    db.session.commit()
+
+
+def measure(fn):
+    with count_queries(db.engine) as queries:
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+    db.session.remove()
+    return queries.count, elapsed * 1000
+
+
+def run(app, client, total, limit):
+    def legacy():
+        [s.to_dict() for s in ConversationSession.query.order_by(ConversationSession.created_at.desc())
+         .limit(total).all()]
+
+    def get(path):
+        def request():
+            read_cache.clear()
+            r = client.get(path)
+            assert r.status_code == 200, r.data[:200]
+        return request
+
+    cases = {
+        'to_dict() (lazy messages)': legacy,
+        'GET /api/sessions': get(f'/api/sessions?limit={total}'),
+        f'GET /api/sessions?include=messages&messages_limit={limit}':
+            get(f'/api/sessions?limit={total}&include=messages&messages_limit={limit}'),
+    }
+    results = {}
+    print(f"\n{total} sessions per page")
+    for name, fn in cases.items():
+        with app.app_context():
+            count, ms = measure(fn)
+        results[name] = count
+        print(f"  {name:<55} {count:5d} queries  {ms:8.1f}ms")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sessions', type=int, default=50)
+    parser.add_argument('--messages', type=int, default=40)
+    parser.add_argument('--messages-limit', type=int, default=5)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='bench_ser_'), 'b.db')
+    db.init_app(app)
+    app.register_blueprint(conversation_bp, url_prefix='/api')
+    client = app.test_client()
+
+    with app.app_context():
+        run_migrations(db.engine)
+        seed(args.sessions, args.messages)
+    first = run(app, client, args.sessions, args.messages_limit)
+    with app.app_context():
+        seed(args.sessions, args.messages, offset=args.sessions)
+    second = run(app, client, args.sessions * 2, args.messages_limit)
+
+    not_constant = [name for name in first if not name.startswith('to_dict') and first[name] != second[name]]
+    if not_constant:
+        print(f"\nquery count grows with the number of sessions: {not_constant}")
+        sys.exit(1)
+    print("\nquery count is constant for the serializer paths")
+
+
+if __name__ == '__main__':
+    main()
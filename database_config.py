@@ -1,57 +1,54 @@
-import psycopg2
 import os
+import sys
 from dotenv import load_dotenv
+from sqlalchemy import inspect
 
 load_dotenv()
 
-# PostgreSQL 数据库连接配置
-DATABASE_CONFIG = {
-    'host': "ep-fancy-tooth-a5zb31u4-pooler.us-east-2.aws.neon.tech",
-    'database': "neondb",
-    'user': "fang",
-    'password': "Fang_strong_pass123",
-    'port': "5432",
-    'sslmode': "require"
-}
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from src.database.config import database_config, pool_status
+
+# 连接参数统一由 src/database/config.py 从环境变量读取（DATABASE_URL / DB_BACKEND=sqlite / DB_POOL_* ...），
+# 这里不再单独写死 Neon 的连接信息、也不再每次新建不经过连接池的 psycopg2 连接
+_engine = None
+
+
+def get_engine():
+    """进程内共享的、带连接池的 engine"""
+    global _engine
+    if _engine is None:
+        _engine = database_config.create_engine()
+    return _engine
+
 
 def get_database_connection():
-    """获取数据库连接"""
+    """从连接池借一个 DB-API 连接，用完调用 close() 会归还到连接池"""
     try:
-        conn = psycopg2.connect(**DATABASE_CONFIG)
-        return conn
-    except (Exception, psycopg2.Error) as error:
+        return get_engine().raw_connection()
+    except Exception as error:
         print(f"连接数据库时出错: {error}")
         return None
 
+
 def test_database_connection():
     """测试数据库连接"""
     try:
-        conn = get_database_connection()
-        if conn:
-            cur = conn.cursor()
+        engine = get_engine()
+        with engine.connect():
             print("成功连接到数据库！")
-            
-            # 查询 public 模式下的所有表
-            cur.execute("""
-                SELECT table_name
-                FROM information_schema.tables
-                WHERE table_schema = 'public'
-                  AND table_type = 'BASE TABLE'
-                ORDER BY table_name;
-            """)
-            
-            tables = cur.fetchall()
-            print("数据库中的表 (public schema):")
-            for table in tables:
-                print(table[0])
-            
-            cur.close()
-            conn.close()
-            return True
-    except (Exception, psycopg2.Error) as error:
+            print(f"连接配置: {database_config.describe()}")
+
+        # 查询所有表
+        tables = inspect(engine).get_table_names()
+        print("数据库中的表:")
+        for table in sorted(tables):
+            print(table)
+        print(f"连接池状态: {pool_status(engine)}")
+        return True
+    except Exception as error:
         print(f"操作数据库时出错: {error}")
         return False
 
 if __name__ == "__main__":
     test_database_connection()
-
@@ -0,0 +1,67 @@
+"""
+Gunicorn 配置（gunicorn 启动时会自动加载当前目录下的 gunicorn.conf.py）
+
+两种部署模式，用环境变量 GUNICORN_WORKER_CLASS 切换:
+- sync   (默认): 每个 worker 同一时间只处理一个请求，LLM 调用期间整个 worker 被占住
+- gevent:        协程 worker，socket 被 monkey-patch 成非阻塞，一个 worker 可以同时挂起数百个等待 LLM 的请求
+                 psycopg2 也会通过 psycogreen 打补丁，数据库查询不会阻塞整个 worker
+
+sync worker 下消息长轮询（GET /api/sessions/<id>/messages?since_id=...&wait=N）不会等待，wait 按 0 处理:
+等待的请求会占住整个 worker。需要长轮询时用 gevent，或者 GUNICORN_THREADS > 1（gunicorn 自动改用 gthread worker）。
+
+gevent 需要显式开启（render.yaml 里默认不开）:
+- 图片识别（src/routes/image_processing.py 里的 YOLO/torch 推理）是 CPU 密集的，不会让出协程，
+  一次识别期间同一 worker 里的所有请求都停住。只在图片识别不和对话接口跑在同一个服务里时使用 gevent
+- 每个 worker 的数据库连接池只有 DB_POOL_SIZE + DB_MAX_OVERFLOW 个连接。请求只在执行 SQL 时借用连接，
+  等待 LLM 时不占，所以 worker_connections 可以比连接数大几倍，但不能大太多: 超出的协程排队等连接，
+  DB_POOL_TIMEOUT 秒后报错。GUNICORN_WORKER_CONNECTIONS 默认是每个 worker 连接数的
+  GUNICORN_CONNECTIONS_PER_DB_CONNECTION（默认 5）倍，即 50；调大它时同时调大连接池
+
+Render 上的启动命令保持不变: python -m gunicorn run:app
+"""
+
+import os
+
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'sync')
+workers = int(os.getenv('WEB_CONCURRENCY', 1))
+bind = f"0.0.0.0:{os.getenv('PORT', 5000)}"
+
+# 每个 worker 的数据库连接数（src/database/config.py 的连接池）
+db_connections_per_worker = int(os.getenv('DB_POOL_SIZE', 5)) + int(os.getenv('DB_MAX_OVERFLOW', 5))
+
+# gevent 模式下每个 worker 同时处理的最大连接数，默认按连接池大小推算（见上面的说明）
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS') or
+                         db_connections_per_worker * int(os.getenv('GUNICORN_CONNECTIONS_PER_DB_CONNECTION', 5)))
+threads = int(os.getenv('GUNICORN_THREADS', 1))
+
+# 超时必须大于 LLM 调用的截止时间（含重试），否则 worker 会在等待上游时被杀掉
+timeout = int(os.getenv('GUNICORN_TIMEOUT', int(float(os.getenv('LLM_TIMEOUT_SECONDS', 30))) + 30))
+graceful_timeout = 30
+keepalive = 5
+
+# 设为空字符串可关闭访问日志（压测时）
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-') or None
+
+
+def post_fork(server, worker):
+    if worker_class == 'gevent':
+        try:
+            from psycogreen.gevent import patch_psycopg
+            patch_psycopg()
+            server.log.info("psycopg2 patched for gevent (worker %s)", worker.pid)
+        except ImportError:
+            server.log.warning("psycogreen not installed; database calls will block the gevent worker")
+
+
+def when_ready(server):
+    server.log.info("Gunicorn ready: worker_class=%s workers=%s worker_connections=%s timeout=%ss",
+                    worker_class, workers, worker_connections, timeout)
+    if worker_class == 'sync' and threads <= 1:
+        server.log.info("Message long-poll disabled (sync worker): wait=N is treated as 0")
+    # 每个 worker 有自己的连接池（src/database/config.py），数据库看到的连接数是 workers 倍
+    server.log.info("Database connections: up to %s per worker, %s total",
+                    db_connections_per_worker, db_connections_per_worker * workers)
+    if worker_class == 'gevent' and worker_connections > db_connections_per_worker * 10:
+        server.log.warning("worker_connections=%s is more than 10x the %s database connections per worker; "
+                           "requests will queue on the pool (DB_POOL_TIMEOUT)",
+                           worker_connections, db_connections_per_worker)
@@ -0,0 +1,4 @@
+# 数据库基础设施：连接配置、版本化迁移等（app.db 是本地开发用的 SQLite 文件，DB_BACKEND=sqlite 时使用）
+from .migrations import run_migrations, migration_status, MigrationError
+from .config import DatabaseConfig, database_config, pool_status, init_app as init_database
+from .query_counter import count_queries, init_app as init_query_counter
@@ -0,0 +1,58 @@
+# python -m src.database upgrade|status|repair-session-summaries|rebuild-message-index|purge
+
+import sys
+import argparse
+
+from dotenv import load_dotenv
+
+from .config import DatabaseConfig
+from .migrations import run_migrations, migration_status, MigrationError
+from ..services.session_summary import repair_session_summaries
+from ..services.message_index import rebuild_message_index
+from ..services.maintenance import maintenance
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Versioned schema migrations and data repair')
+    parser.add_argument('command', choices=['upgrade', 'status', 'repair-session-summaries',
+                                            'rebuild-message-index', 'purge'])
+    parser.add_argument('--target', type=int, default=None, help='只执行到这个版本')
+    parser.add_argument('--session-id', action='append', default=None,
+                        help='repair-session-summaries / rebuild-message-index 只处理这些会话（可重复），默认全部')
+    parser.add_argument('--dry-run', action='store_true', help='purge 只统计会删除多少，不删除')
+    parser.add_argument('--database-url', default=None, help='默认读取 DATABASE_URL / DB_BACKEND')
+    args = parser.parse_args()
+
+    load_dotenv()
+    # 连接串和 SQLite 模式与应用使用同一套配置（DATABASE_URL / DB_BACKEND=sqlite）
+    engine = DatabaseConfig(args.database_url).create_engine()
+    if args.command == 'upgrade':
+        try:
+            executed = run_migrations(engine, target=args.target)
+        except MigrationError as e:
+            print(f"Migration failed: {e}")
+            sys.exit(1)
+        print(f"Done, {len(executed)} migration(s) applied.")
+    elif args.command == 'repair-session-summaries':
+        # 从 conversation_messages 重新计算会话的 message_count / last_message_at / last_message_preview
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            count = repair_session_summaries(conn, session_ids=args.session_id)
+        print(f"Repaired summaries for {count} session(s).")
+    elif args.command == 'rebuild-message-index':
+        # 从 conversation_messages 重建消息的倒排索引（message_postings）
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            count = rebuild_message_index(conn, session_ids=args.session_id)
+        print(f"Rebuilt the message index for {count} session(s).")
+    elif args.command == 'purge':
+        # 按 RETENTION_* 保留策略清理一次数据库和上传目录（进程内的历史和缓存由应用里的后台任务清理）
+        stats = maintenance.run_once(engine, dry_run=args.dry_run, in_process=False)
+        if stats['errors']:
+            sys.exit(1)
+    else:
+        for row in migration_status(engine):
+            state = f"applied {row['applied_at']} ({row['duration_ms']} ms)" if row['applied'] else 'pending'
+            print(f"{row['version']:04d}_{row['name']:<30} {state}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+# config.py
+
+import os
+from typing import Dict, Any, Optional
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.pool import QueuePool
+
+'''
+数据库连接配置。
+以前 main.py 里写死了 Neon 的连接串，连接池用 SQLAlchemy 默认值: 没有 pre-ping（Neon 会关掉空闲连接，
+第一次用到失效连接的请求直接报错）、不回收、没有语句超时，连接数也不随 gunicorn worker 数调整。
+
+所有参数从环境变量读取:
+    DATABASE_URL                 连接串（postgres:// 会改写成 postgresql://）
+    DB_BACKEND=sqlite            本地 SQLite 模式，忽略 DATABASE_URL，使用 DB_SQLITE_PATH（默认 src/database/app.db）；
+                                 两个都没有设置时也使用本地 SQLite，并打印警告（部署时必须设置 DATABASE_URL）
+    DB_POOL_SIZE                 每个 worker 常驻的连接数，默认 5
+    DB_MAX_OVERFLOW              高峰时额外允许的连接数，默认 5
+    DB_POOL_TIMEOUT              等待空闲连接的秒数，超时报错而不是无限排队，默认 10
+    DB_POOL_RECYCLE              连接最长使用秒数，超过后重建，默认 300（早于服务端/代理关闭空闲连接）
+    DB_POOL_PRE_PING             取连接时先探活，默认 true
+    DB_STATEMENT_TIMEOUT_MS      Postgres 单条语句的超时，默认 15000，0 表示不限制
+    DB_SQLITE_BUSY_TIMEOUT_MS    SQLite 等待写锁的毫秒数，默认 5000
+
+每个进程最多占用 DB_POOL_SIZE + DB_MAX_OVERFLOW 个连接，总连接数 = WEB_CONCURRENCY x 这个数，
+要小于数据库（或 Neon pooler）的连接上限。gevent worker 同时处理的请求远多于连接数，
+请求只在真正执行 SQL 时借用连接（见 send_message），等待 LLM 时不占连接。
+
+SQLite 模式打开 WAL（读写不互斥）和 synchronous=NORMAL，用于本地开发和基准测试。
+'''
+
+_DEFAULT_SQLITE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.db')
+
+# 每个 SQLite 连接建立时执行的 PRAGMA
+_SQLITE_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),     # WAL 下只在 checkpoint 时 fsync，崩溃不损坏数据库，最多丢最后几个事务
+    ('foreign_keys', 'ON'),
+    ('temp_store', 'MEMORY'),
+    ('cache_size', -64000),        # 负数单位是 KiB，即 64MB 页缓存
+    ('mmap_size', 268435456),
+)
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.lower() in ('1', 'true', 'yes')
+
+
+class DatabaseConfig:
+    """从环境变量读取的连接参数；engine_options() 的结果直接作为 SQLALCHEMY_ENGINE_OPTIONS"""
+
+    def __init__(self, url: Optional[str] = None):
+        if url is None and os.getenv('DB_BACKEND', '').lower() != 'sqlite':
+            url = os.getenv('DATABASE_URL')
+            if not url:
+                print("Warning: DATABASE_URL is not set, falling back to the local SQLite database")
+        if not url:
+            url = 'sqlite:///' + os.path.abspath(os.getenv('DB_SQLITE_PATH', _DEFAULT_SQLITE_PATH))
+        # Render / Heroku 给出的是 postgres://，SQLAlchemy 2.0 只认 postgresql://
+        if url.startswith('postgres://'):
+            url = 'postgresql://' + url[len('postgres://'):]
+        self.url = url
+        self.backend = make_url(url).get_backend_name()
+        self.pool_size = int(os.getenv('DB_POOL_SIZE', 5))
+        self.max_overflow = int(os.getenv('DB_MAX_OVERFLOW', 5))
+        self.pool_timeout = float(os.getenv('DB_POOL_TIMEOUT', 10))
+        self.pool_recycle = int(os.getenv('DB_POOL_RECYCLE', 300))
+        self.pool_pre_ping = _env_bool('DB_POOL_PRE_PING', True)
+        self.statement_timeout_ms = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 15000))
+        self.sqlite_busy_timeout_ms = int(os.getenv('DB_SQLITE_BUSY_TIMEOUT_MS', 5000))
+
+    @property
+    def is_sqlite(self) -> bool:
+        return self.backend == 'sqlite'
+
+    @property
+    def is_memory(self) -> bool:
+        return self.is_sqlite and make_url(self.url).database in (None, '', ':memory:')
+
+    def engine_options(self) -> Dict[str, Any]:
+        options: Dict[str, Any] = {'pool_pre_ping': self.pool_pre_ping}
+        if self.is_memory:
+            # 内存库只有一个连接（Flask-SQLAlchemy 使用 StaticPool），连接池参数不适用
+            return options
+        options.update({
+            'pool_size': self.pool_size,
+            'max_overflow': self.max_overflow,
+            'pool_timeout': self.pool_timeout,
+            'pool_recycle': self.pool_recycle,
+        })
+        if self.is_sqlite:
+            options['connect_args'] = {'timeout': self.sqlite_busy_timeout_ms / 1000}
+        return options
+
+    def configure_engine(self, engine: Engine):
+        """在 engine 上注册连接建立时的初始化（SQLite PRAGMA / Postgres 语句超时）"""
+        if engine.dialect.name == 'sqlite':
+            event.listen(engine, 'connect', self._on_sqlite_connect)
+        elif engine.dialect.name == 'postgresql' and self.statement_timeout_ms > 0:
+            # 用 SET 而不是 options=-c statement_timeout=...，Neon 的 pgbouncer 不接受 options 启动参数
+            event.listen(engine, 'connect', self._on_postgres_connect)
+
+    def create_engine(self) -> Engine:
+        """Flask 应用之外（命令行、基准测试）使用同样的配置创建 engine"""
+        engine = create_engine(self.url, **self.engine_options())
+        self.configure_engine(engine)
+        return engine
+
+    def _on_sqlite_connect(self, dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if not self.is_memory:
+            for name, value in _SQLITE_PRAGMAS:
+                cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.execute(f'PRAGMA busy_timeout = {self.sqlite_busy_timeout_ms}')
+        cursor.close()
+
+    def _on_postgres_connect(self, dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f'SET statement_timeout = {self.statement_timeout_ms}')
+        cursor.close()
+        # psycopg2 在第一条语句前隐式开启事务，提交掉，SET 才不会随连接池的 rollback 一起撤销
+        dbapi_connection.commit()
+
+    def describe(self) -> str:
+        """用于启动日志，不含密码"""
+        url = make_url(self.url).render_as_string(hide_password=True)
+        if self.is_memory:
+            return f"{url} (in-memory)"
+        return (f"{url} pool_size={self.pool_size} max_overflow={self.max_overflow} "
+                f"pool_timeout={self.pool_timeout:g}s pool_recycle={self.pool_recycle}s "
+                f"pre_ping={self.pool_pre_ping} "
+                + (f"busy_timeout={self.sqlite_busy_timeout_ms}ms journal_mode=WAL" if self.is_sqlite
+                   else f"statement_timeout={self.statement_timeout_ms}ms"))
+
+
+def pool_status(engine: Engine) -> Dict[str, Any]:
+    """连接池当前状态；QueuePool 之外的连接池只返回类型"""
+    pool = engine.pool
+    status: Dict[str, Any] = {'pool': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': max(pool.overflow(), 0),
+            'max_connections': pool.size() + pool._max_overflow,
+        })
+    return status
+
+
+def init_app(app, db, config: Optional['DatabaseConfig'] = None) -> 'DatabaseConfig':
+    """设置 Flask-SQLAlchemy 的连接配置并初始化 db，打印连接池参数和状态"""
+    config = config or database_config
+    app.config['SQLALCHEMY_DATABASE_URI'] = config.url
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = config.engine_options()
+    db.init_app(app)
+    with app.app_context():
+        engine = db.engine
+        config.configure_engine(engine)
+        print(f"Database: {config.describe()}")
+        print(f"Database pool: {pool_status(engine)}")
+    return config
+
+
+# 创建全局实例
+database_config = DatabaseConfig()
@@ -0,0 +1,358 @@
+# migrations.py
+
+import time
+from datetime import datetime
+from typing import List, Dict, Any, Callable, Optional
+
+from sqlalchemy import text, inspect, MetaData, Table, Column, Integer, String, Text, DateTime, ForeignKey, LargeBinary
+from sqlalchemy.engine import Engine, Connection
+from sqlalchemy.schema import CreateTable
+
+'''
+带版本号的数据库迁移。
+以前表结构靠 main.py 里被注释掉的 db.create_all() 手动创建，已有的库无法增量加索引。
+现在每个迁移有一个递增的版本号，执行过的版本记录在 schema_migrations 表里，启动或手动执行时只跑没执行过的。
+
+- Postgres 上建索引用 CREATE INDEX CONCURRENTLY，不锁表，线上可以直接执行（这类迁移不能放在事务里）
+- 多个 worker 同时启动时用 advisory lock 保证只有一个在执行迁移
+- SQLite（本地开发、基准测试）使用同样的迁移，只是没有 CONCURRENTLY
+
+用法:
+    python -m src.database status
+    python -m src.database upgrade [--target 2]
+    DB_AUTO_MIGRATE=true python run.py   # 启动时自动执行
+'''
+
+# pg_advisory_lock 的键，任意固定的 64 位整数
+_ADVISORY_LOCK_KEY = 724180035
+
+
+class MigrationError(Exception):
+    pass
+
+
+class Migration:
+    def __init__(self, version: int, name: str, upgrade: Callable[['MigrationContext'], None],
+                 transactional: bool = True):
+        self.version = version
+        self.name = name
+        self.upgrade = upgrade
+        # Postgres 的 CONCURRENTLY 不能在事务里执行，这类迁移逐条自动提交
+        self.transactional = transactional
+
+
+class MigrationContext:
+    """传给每个迁移的执行环境，封装不同数据库之间的差异"""
+
+    def __init__(self, conn: Connection):
+        self.conn = conn
+        self.dialect = conn.dialect.name
+        self.is_postgres = self.dialect == 'postgresql'
+
+    def execute(self, sql: str, **params):
+        return self.conn.execute(text(sql), params)
+
+    def create_table(self, table):
+        """建表（已存在时跳过）。只建表和列上的约束，二级索引由后续迁移创建"""
+        self.conn.execute(CreateTable(table, if_not_exists=True))
+
+    def create_index(self, name: str, table: str, columns: List[str], unique: bool = False,
+                     using: Optional[str] = None):
+        """columns 可以是列名也可以是表达式；using 为 Postgres 的索引方法（gin 等）"""
+        unique_sql = 'UNIQUE ' if unique else ''
+        column_sql = ', '.join(columns)
+        column_sql = f'USING {using} ({column_sql})' if using and self.is_postgres else f'({column_sql})'
+        if self.is_postgres:
+            # 上次 CONCURRENTLY 中途失败会留下无效索引，IF NOT EXISTS 会把它当成已存在，先删掉重建
+            invalid = self.execute(
+                "SELECT 1 FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid "
+                "WHERE c.relname = :name AND NOT i.indisvalid", name=name).first()
+            if invalid:
+                print(f"  dropping invalid index {name} left by an interrupted build")
+                self.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+            self.execute(f'CREATE {unique_sql}INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} {column_sql}')
+        else:
+            self.execute(f'CREATE {unique_sql}INDEX IF NOT EXISTS {name} ON {table} {column_sql}')
+
+    def add_column(self, table: str, column: str, ddl: str):
+        """加列（已存在时跳过，迁移中途失败后可以重新执行）；ddl 为类型和约束，如 'INTEGER NOT NULL DEFAULT 0'"""
+        existing = {c['name'] for c in inspect(self.conn).get_columns(table)}
+        if column in existing:
+            return
+        self.execute(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}')
+
+    def has_fts5(self) -> bool:
+        try:
+            self.execute("CREATE VIRTUAL TABLE IF NOT EXISTS temp._fts5_probe USING fts5(x)")
+            self.execute("DROP TABLE temp._fts5_probe")
+            return True
+        except Exception:
+            return False
+
+    def assert_no_duplicates(self, table: str, column: str):
+        """建唯一索引前检查重复值，给出可读的错误而不是数据库的约束报错"""
+        rows = self.execute(f'SELECT {column}, COUNT(*) FROM {table} GROUP BY {column} '
+                            f'HAVING COUNT(*) > 1 LIMIT 5').fetchall()
+        if rows:
+            examples = ', '.join(f'{r[0]!r} x{r[1]}' for r in rows)
+            raise MigrationError(f'{table}.{column} has duplicate values ({examples}); '
+                                 f'merge or delete them before creating the unique index')
+
+
+MIGRATIONS: List[Migration] = []
+
+
+def migration(version: int, name: str, transactional: bool = True):
+    """注册一个迁移。版本号一旦发布就不能再改，新的变更总是追加新的版本"""
+    def decorator(fn):
+        MIGRATIONS.append(Migration(version, name, fn, transactional))
+        return fn
+    return decorator
+
+
+# ==============================================================================
+#  迁移列表
+# ==============================================================================
+
+def _baseline_tables() -> List[Table]:
+    """
+    迁移系统之前 db.create_all() 建出的表结构（当时的模型），固定在这里，不跟着 src/models 变:
+    模型以后再加列、加索引，都由新的迁移完成，0001 在新库上建出的永远是同一个起点
+    """
+    metadata = MetaData()
+    return [
+        Table('user', metadata,
+              Column('id', Integer, primary_key=True),
+              Column('username', String(80), unique=True, nullable=False),
+              Column('email', String(120), unique=True, nullable=False)),
+        Table('vocabulary_items', metadata,
+              Column('id', Integer, primary_key=True),
+              Column('word', String(100), nullable=False),
+              Column('definition', Text, nullable=False),
+              Column('example_sentence', Text),
+              Column('image_path', String(255)),
+              Column('segmented_image_path', String(255)),
+              Column('created_at', DateTime),
+              Column('updated_at', DateTime)),
+        Table('conversation_sessions', metadata,
+              Column('id', Integer, primary_key=True),
+              Column('session_id', String(100), unique=True, nullable=False),
+              Column('theme', String(200), nullable=False),
+              Column('background', Text),
+              Column('role', String(100)),
+              Column('image_path', String(255)),
+              Column('created_at', DateTime)),
+        Table('conversation_messages', metadata,
+              Column('id', Integer, primary_key=True),
+              Column('session_id', String(100), ForeignKey('conversation_sessions.session_id'), nullable=False),
+              Column('sender', String(20), nullable=False),
+              Column('message', Text, nullable=False),
+              Column('timestamp', DateTime)),
+    ]
+
+
+@migration(1, 'baseline_schema')
+def _baseline_schema(ctx: MigrationContext):
+    """原来由 db.create_all() 创建的表；已经存在的库上是空操作"""
+    for table in _baseline_tables():
+        ctx.create_table(table)
+
+
+@migration(2, 'hot_path_indexes', transactional=False)
+def _hot_path_indexes(ctx: MigrationContext):
+    """add_vocabulary 查重、列表按创建时间排序、按会话取消息这几条热点查询的索引"""
+    ctx.assert_no_duplicates('vocabulary_items', 'word')
+    ctx.create_index('ux_vocabulary_items_word', 'vocabulary_items', ['word'], unique=True)
+    ctx.create_index('ix_vocabulary_items_created_at_id', 'vocabulary_items', ['created_at', 'id'])
+    ctx.create_index('ix_conversation_sessions_created_at_id', 'conversation_sessions', ['created_at', 'id'])
+    ctx.create_index('ix_conversation_messages_session_ts_id', 'conversation_messages',
+                     ['session_id', 'timestamp', 'id'])
+
+
+# 单词的全文检索向量（单词权重 A，释义权重 B）。
+# vocabulary_search.py 的查询必须使用完全相同的表达式，Postgres 才会用上表达式索引
+VOCABULARY_TSVECTOR_SQL = ("(setweight(to_tsvector('english', coalesce(word, '')), 'A') || "
+                           "setweight(to_tsvector('english', coalesce(definition, '')), 'B'))")
+
+
+@migration(3, 'vocabulary_full_text_search', transactional=False)
+def _vocabulary_full_text_search(ctx: MigrationContext):
+    """/api/vocabulary/search 的全文检索: Postgres 用 tsvector + pg_trgm，SQLite 用 FTS5 外部内容表"""
+    if ctx.is_postgres:
+        ctx.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        ctx.create_index('ix_vocabulary_items_fts', 'vocabulary_items', [VOCABULARY_TSVECTOR_SQL], using='gin')
+        ctx.create_index('ix_vocabulary_items_word_trgm', 'vocabulary_items', ['word gin_trgm_ops'], using='gin')
+        return
+    if ctx.dialect != 'sqlite' or not ctx.has_fts5():
+        print("  full-text search index skipped (no FTS5); search falls back to LIKE")
+        return
+    ctx.execute("CREATE VIRTUAL TABLE IF NOT EXISTS vocabulary_fts USING fts5("
+                "word, definition, content='vocabulary_items', content_rowid='id', "
+                "tokenize='porter unicode61 remove_diacritics 2', prefix='2 3')")
+    # 外部内容表不会自动同步，用触发器跟随 vocabulary_items 的增删改
+    ctx.execute("CREATE TRIGGER IF NOT EXISTS vocabulary_fts_ai AFTER INSERT ON vocabulary_items BEGIN "
+                "INSERT INTO vocabulary_fts(rowid, word, definition) VALUES (new.id, new.word, new.definition); END")
+    ctx.execute("CREATE TRIGGER IF NOT EXISTS vocabulary_fts_ad AFTER DELETE ON vocabulary_items BEGIN "
+                "INSERT INTO vocabulary_fts(vocabulary_fts, rowid, word, definition) "
+                "VALUES ('delete', old.id, old.word, old.definition); END")
+    ctx.execute("CREATE TRIGGER IF NOT EXISTS vocabulary_fts_au AFTER UPDATE OF word, definition ON vocabulary_items BEGIN "
+                "INSERT INTO vocabulary_fts(vocabulary_fts, rowid, word, definition) "
+                "VALUES ('delete', old.id, old.word, old.definition); "
+                "INSERT INTO vocabulary_fts(rowid, word, definition) VALUES (new.id, new.word, new.definition); END")
+    ctx.execute("INSERT INTO vocabulary_fts(vocabulary_fts) VALUES ('rebuild')")
+
+
+@migration(4, 'session_summary_columns', transactional=False)
+def _session_summary_columns(ctx: MigrationContext):
+    """会话列表用的消息摘要冗余列，并从 conversation_messages 回填（分批提交，可重复执行）"""
+    from ..services.session_summary import repair_session_summaries
+    # Postgres 11+ 上带常量默认值的 ADD COLUMN 只改元数据，不重写表
+    ctx.add_column('conversation_sessions', 'message_count', 'INTEGER NOT NULL DEFAULT 0')
+    ctx.add_column('conversation_sessions', 'last_message_at', 'TIMESTAMP')
+    ctx.add_column('conversation_sessions', 'last_message_preview', 'VARCHAR(200)')
+    count = repair_session_summaries(ctx.conn)
+    print(f"  backfilled summaries for {count} sessions")
+
+
+
+# 由触发器维护版本号的表（条件 GET 的 ETag / Last-Modified，见 src/services/conditional.py）
+VERSIONED_TABLES = ('vocabulary_items',)
+
+
+@migration(5, 'table_versions')
+def _table_versions(ctx: MigrationContext):
+    """每张表一行 (version, changed_at)，表上的任何增删改都由触发器在同一事务里累加版本号"""
+    ctx.execute("CREATE TABLE IF NOT EXISTS table_versions ("
+                "table_name VARCHAR(64) PRIMARY KEY, version BIGINT NOT NULL DEFAULT 0, changed_at TIMESTAMP NOT NULL)")
+    if ctx.is_postgres:
+        # 语句级触发器: 批量导入一条 INSERT 只累加一次；changed_at 用 UTC 的墙上时间而不是事务开始时间
+        ctx.execute("""
+            CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+            BEGIN
+                UPDATE table_versions SET version = version + 1, changed_at = clock_timestamp() AT TIME ZONE 'UTC'
+                WHERE table_name = TG_TABLE_NAME;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql""")
+    for table in VERSIONED_TABLES:
+        ctx.execute("INSERT INTO table_versions (table_name, version, changed_at) "
+                    "SELECT :t, 1, :now WHERE NOT EXISTS "
+                    "(SELECT 1 FROM table_versions WHERE table_name = :t)", t=table, now=datetime.utcnow())
+        if ctx.is_postgres:
+            ctx.execute(f"DROP TRIGGER IF EXISTS {table}_version ON {table}")
+            ctx.execute(f"CREATE TRIGGER {table}_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table} "
+                        f"FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version()")
+            continue
+        # SQLite 只有行级触发器；changed_at 写成和 SQLAlchemy 的 DateTime 相同的格式（%f 只到毫秒，补齐 6 位）
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            ctx.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()} AFTER {event} ON {table} BEGIN "
+                        f"UPDATE table_versions SET version = version + 1, "
+                        f"changed_at = strftime('%Y-%m-%d %H:%M:%f', 'now') || '000' WHERE table_name = '{table}'; END")
+
+
+@migration(6, 'message_postings', transactional=False)
+def _message_postings(ctx: MigrationContext):
+    """对话消息的倒排索引（见 src/services/message_index.py），并从 conversation_messages 回填（按会话分批，可重复执行）"""
+    from ..services.message_index import rebuild_message_index
+    # 表结构固定在迁移里（和 0001 一样），模型 MessagePosting 以后的变更由新的迁移完成
+    ctx.create_table(Table('message_postings', MetaData(),
+                           Column('term', String(64), primary_key=True),
+                           Column('session_id', String(100), primary_key=True),
+                           Column('last_message_id', Integer, nullable=False),
+                           Column('message_count', Integer, nullable=False),
+                           Column('occurrences', Integer, nullable=False),
+                           Column('postings', LargeBinary, nullable=False)))
+    ctx.create_index('ix_message_postings_session_id', 'message_postings', ['session_id'])
+    count = rebuild_message_index(ctx.conn)
+    print(f"  indexed messages of {count} sessions")
+
+# ==============================================================================
+#  执行器
+# ==============================================================================
+
+def _ensure_version_table(engine: Engine):
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            " version INTEGER PRIMARY KEY,"
+            " name VARCHAR(200) NOT NULL,"
+            " applied_at TIMESTAMP NOT NULL,"
+            " duration_ms INTEGER)"))
+
+
+def applied_versions(engine: Engine) -> Dict[int, Dict[str, Any]]:
+    _ensure_version_table(engine)
+    with engine.connect() as conn:
+        rows = conn.execute(text('SELECT version, name, applied_at, duration_ms FROM schema_migrations')).fetchall()
+    return {r[0]: {'version': r[0], 'name': r[1], 'applied_at': r[2], 'duration_ms': r[3]} for r in rows}
+
+
+def migration_status(engine: Engine) -> List[Dict[str, Any]]:
+    applied = applied_versions(engine)
+    result = []
+    for m in sorted(MIGRATIONS, key=lambda m: m.version):
+        row = applied.get(m.version)
+        result.append({
+            'version': m.version,
+            'name': m.name,
+            'applied': row is not None,
+            'applied_at': str(row['applied_at']) if row else None,
+            'duration_ms': row['duration_ms'] if row else None,
+        })
+    return result
+
+
+def _disable_statement_timeout(conn: Connection, local: bool = False):
+    """建索引、等 advisory lock 都可能超过连接上配置的 statement_timeout（见 config.py）"""
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text('SET LOCAL statement_timeout = 0' if local else 'SET statement_timeout = 0'))
+
+
+def _apply(engine: Engine, m: Migration):
+    start = time.monotonic()
+    if m.transactional:
+        with engine.begin() as conn:
+            _disable_statement_timeout(conn, local=True)
+            m.upgrade(MigrationContext(conn))
+            _record(conn, m, start)
+    else:
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            _disable_statement_timeout(conn)
+            m.upgrade(MigrationContext(conn))
+            _record(conn, m, start)
+            # 会话级的 SET 会跟着连接回到连接池，直接丢弃这个连接
+            conn.invalidate()
+
+
+def _record(conn: Connection, m: Migration, start: float):
+    conn.execute(text('INSERT INTO schema_migrations (version, name, applied_at, duration_ms) '
+                      'VALUES (:version, :name, :applied_at, :duration_ms)'),
+                 {'version': m.version, 'name': m.name, 'applied_at': datetime.utcnow(),
+                  'duration_ms': int((time.monotonic() - start) * 1000)})
+
+
+def run_migrations(engine: Engine, target: Optional[int] = None) -> List[int]:
+    """执行所有未执行的迁移（或执行到 target 版本），返回本次执行的版本号"""
+    lock_conn = None
+    if engine.dialect.name == 'postgresql':
+        lock_conn = engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+        _disable_statement_timeout(lock_conn)
+        lock_conn.execute(text('SELECT pg_advisory_lock(:key)'), {'key': _ADVISORY_LOCK_KEY})
+    try:
+        # 拿到锁之后再读已执行的版本，其它 worker 刚执行完的迁移不会重复执行
+        applied = applied_versions(engine)
+        executed = []
+        for m in sorted(MIGRATIONS, key=lambda m: m.version):
+            if m.version in applied or (target is not None and m.version > target):
+                continue
+            print(f"Applying migration {m.version:04d}_{m.name} ...")
+            start = time.monotonic()
+            _apply(engine, m)
+            print(f"Applied migration {m.version:04d}_{m.name} in {time.monotonic() - start:.2f}s")
+            executed.append(m.version)
+        return executed
+    finally:
+        if lock_conn is not None:
+            lock_conn.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': _ADVISORY_LOCK_KEY})
+            lock_conn.invalidate()
+            lock_conn.close()
@@ -0,0 +1,86 @@
+# pagination.py
+
+import json
+import base64
+import binascii
+from datetime import datetime
+from typing import List, Tuple, Optional, Any
+
+from sqlalchemy import tuple_, text, DateTime
+
+'''
+键集 (keyset / cursor) 分页。
+OFFSET 分页翻到第 N 页时数据库要先扫过前面 N*per_page 行，.paginate() 每页还要多跑一次 COUNT(*)。
+键集分页记住上一页最后一行的排序键（如 created_at, id），下一页直接从索引上的这个位置继续:
+    WHERE (created_at, id) < (:last_created_at, :last_id) ORDER BY created_at DESC, id DESC LIMIT :limit
+不管翻到第几页，代价都和第一页一样。
+
+游标对客户端是不透明的字符串（base64 编码的 JSON），里面带上 scope，防止把一个列表的游标用在另一个列表上。
+排序键的最后一列必须唯一（通常是 id），排序列不能为 NULL。
+'''
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(scope: str, values: List[Any]) -> str:
+    payload = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps({'s': scope, 'v': payload}, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str, scope: str, columns: List[Any]) -> List[Any]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        data = json.loads(raw)
+        values = data['v']
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise InvalidCursor('Invalid cursor')
+    if data.get('s') != scope or len(values) != len(columns):
+        raise InvalidCursor('Cursor does not belong to this list')
+    result = []
+    for column, value in zip(columns, values):
+        if isinstance(column.type, DateTime) and value is not None:
+            try:
+                value = datetime.fromisoformat(value)
+            except (TypeError, ValueError):
+                raise InvalidCursor('Invalid cursor')
+        result.append(value)
+    return result
+
+
+def keyset_paginate(query, columns: List[Any], limit: int, cursor: Optional[str] = None,
+                    descending: bool = False, scope: str = '', session=None) -> Tuple[list, Optional[str]]:
+    """
+    对 ORM 查询做键集分页，返回 (本页的行, 下一页的游标)，没有下一页时游标为 None。
+    columns 是排序键（例如 [VocabularyItem.created_at, VocabularyItem.id]），所有列按同一方向排序。
+    query 也可以是 Core 的 select()（需要传 session），此时返回 Row 元组，select 里必须包含排序键的列。
+    """
+    if cursor:
+        last = decode_cursor(cursor, scope, columns)
+        key = tuple_(*columns)
+        query = query.filter(key < tuple_(*last) if descending else key > tuple_(*last))
+    query = query.order_by(*[c.desc() if descending else c.asc() for c in columns])
+
+    # 多取一行，判断后面还有没有数据
+    query = query.limit(limit + 1)
+    rows = session.execute(query).all() if session is not None else query.all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last_row = rows[-1]
+    return rows, encode_cursor(scope, [getattr(last_row, c.key) for c in columns])
+
+
+def approximate_count(session, table: str) -> Optional[int]:
+    """
+    整张表的行数估计。Postgres 读统计信息 (pg_class.reltuples)，不扫描表；
+    表还没被 ANALYZE 过或者是其它数据库时退回精确的 COUNT(*)。
+    """
+    if session.get_bind().dialect.name == 'postgresql':
+        estimate = session.execute(text('SELECT reltuples::bigint FROM pg_class WHERE relname = :t'),
+                                   {'t': table}).scalar()
+        if estimate is not None and estimate >= 0:
+            return int(estimate)
+    return session.execute(text(f'SELECT COUNT(*) FROM {table}')).scalar()
@@ -0,0 +1,67 @@
+# query_counter.py
+
+import os
+import threading
+from contextlib import contextmanager
+from typing import List, Optional
+
+from flask import g, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+'''
+SQL 语句计数，用来确认一个请求的查询数是常数（没有 N+1）。
+
+- count_queries(engine): 上下文管理器，记录块内执行的所有语句，脚本和基准测试里用:
+      with count_queries(db.engine) as queries:
+          client.get('/api/sessions?include=messages')
+      assert queries.count == 2, queries.statements
+- DB_QUERY_COUNT_HEADER=true 时每个响应带上 X-DB-Queries 头（本请求执行的语句数），开发时打开
+'''
+
+
+class QueryLog:
+    def __init__(self):
+        self.statements: List[str] = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+
+@contextmanager
+def count_queries(engine: Engine):
+    """只统计当前线程执行的语句（其它线程的后台任务不算）"""
+    log = QueryLog()
+    thread_id = threading.get_ident()
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == thread_id:
+            log.statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield log
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def init_app(app, db, enabled: Optional[bool] = None):
+    """注册 X-DB-Queries 响应头（默认关闭）"""
+    if enabled is None:
+        enabled = os.getenv('DB_QUERY_COUNT_HEADER', 'false').lower() in ('1', 'true', 'yes')
+    if not enabled:
+        return
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        # 应用上下文（g）是每个请求 / 线程独立的
+        if has_app_context():
+            g.db_query_count = g.get('db_query_count', 0) + 1
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+    @app.after_request
+    def add_query_count_header(response):
+        response.headers['X-DB-Queries'] = str(g.get('db_query_count', 0))
+        return response
@@ -0,0 +1,110 @@
+from typing import List, Dict, Any, Iterable, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import load_only, raiseload, selectinload
+
+from . import db
+from .vocabulary import VocabularyItem, ConversationSession, ConversationMessage
+from .user import User
+
+'''
+会话 / 消息的序列化和加载策略。
+ConversationSession.messages 是 lazy=True，ConversationSession.to_dict() 会序列化全部消息:
+列表里每个会话都会再发一条 SELECT（N+1），会话越多越慢。这里把"取哪些列、消息怎么加载"和"怎么转成 dict"放在一起:
+
+- GET /api/sessions 用 Core 只取 SESSION_COLUMNS；需要会话 ORM 对象的列表用 session_list_options()（load_only），
+  并对 messages 加 raiseload，谁不小心访问了它会直接报错而不是悄悄多查 N 次
+- 需要消息时（?include=messages），用一条窗口函数查询取出本页所有会话各自最新的 N 条消息，
+  每个请求的查询数固定为 2 条，和会话数无关
+- 需要单个会话的全部消息时用 with_all_messages()（selectinload，一条 IN 查询）
+
+列表接口的快速路径: *_COLUMNS 是各个 to_dict() 输出的列，select(*XXX_COLUMNS) 得到的 Row 用
+fast_json.rows_to_dicts 转成同样字段的 dict，不构造 ORM 对象（见 src/services/fast_json.py）。
+'''
+
+VOCABULARY_COLUMNS = (VocabularyItem.id, VocabularyItem.word, VocabularyItem.definition,
+                      VocabularyItem.example_sentence, VocabularyItem.image_path,
+                      VocabularyItem.segmented_image_path, VocabularyItem.created_at, VocabularyItem.updated_at)
+
+USER_COLUMNS = (User.id, User.username, User.email)
+
+MESSAGE_COLUMNS = (ConversationMessage.id, ConversationMessage.session_id, ConversationMessage.sender,
+                   ConversationMessage.message, ConversationMessage.timestamp)
+
+SESSION_COLUMNS = (ConversationSession.id, ConversationSession.session_id, ConversationSession.theme,
+                   ConversationSession.background, ConversationSession.role, ConversationSession.image_path,
+                   ConversationSession.created_at, ConversationSession.message_count,
+                   ConversationSession.last_message_at, ConversationSession.last_message_preview)
+
+# ?include=messages 时每个会话默认 / 最多带的消息数
+DEFAULT_MESSAGES_LIMIT = 20
+MAX_MESSAGES_LIMIT = 100
+
+
+def session_list_options() -> list:
+    """会话列表的加载策略: 只取会话的列，禁止懒加载 messages"""
+    return [load_only(*SESSION_COLUMNS), raiseload(ConversationSession.messages)]
+
+
+def with_all_messages() -> list:
+    """需要会话全部消息时的加载策略（所有会话的消息一次 IN 查询取回）"""
+    return [selectinload(ConversationSession.messages)]
+
+
+def message_to_dict(msg, include_is_user: bool = False) -> Dict[str, Any]:
+    result = {
+        'id': msg.id,
+        'session_id': msg.session_id,
+        'sender': msg.sender,
+        'message': msg.message,
+        'timestamp': msg.timestamp.isoformat() if msg.timestamp else None
+    }
+    if include_is_user:
+        result['is_user'] = msg.sender == 'user'
+    return result
+
+
+def session_to_dict(session, messages: Optional[Iterable[Any]] = None) -> Dict[str, Any]:
+    """messages 为 None 时不输出 messages 字段（不会触发懒加载）"""
+    result = {
+        'id': session.id,
+        'session_id': session.session_id,
+        'theme': session.theme,
+        'background': session.background,
+        'role': session.role,
+        'image_path': session.image_path,
+        'created_at': session.created_at.isoformat() if session.created_at else None,
+        # 冗余的消息摘要，列表不需要聚合 conversation_messages
+        'message_count': session.message_count,
+        'last_message_at': session.last_message_at.isoformat() if session.last_message_at else None,
+        'last_message_preview': session.last_message_preview
+    }
+    if messages is not None:
+        result['messages'] = [message_to_dict(msg) for msg in messages]
+    return result
+
+
+def load_recent_messages(session_ids: List[str], limit: int) -> Dict[str, List[Any]]:
+    """
+    一条查询取出每个会话最新的 limit 条消息（按时间正序返回），走 (session_id, timestamp, id) 索引。
+    返回 {session_id: [Row(MESSAGE_COLUMNS)...]}，没有消息的会话对应空列表。
+    """
+    result: Dict[str, List[Any]] = {sid: [] for sid in session_ids}
+    if not session_ids:
+        return result
+    ranked = select(
+        ConversationMessage.id,
+        func.row_number().over(
+            partition_by=ConversationMessage.session_id,
+            order_by=(ConversationMessage.timestamp.desc(), ConversationMessage.id.desc())
+        ).label('rn')
+    ).where(ConversationMessage.session_id.in_(session_ids)).subquery()
+    rows = db.session.execute(
+        select(*MESSAGE_COLUMNS)
+        .join(ranked, ranked.c.id == ConversationMessage.id)
+        .where(ranked.c.rn <= limit)
+        .order_by(ConversationMessage.session_id, ConversationMessage.timestamp, ConversationMessage.id)
+    )
+    for msg in rows:
+        result[msg.session_id].append(msg)
+    return result
@@ -5,8 +5,13 @@ from . import db  # <-- 添加这行，从 models/__init__.py 导入共享的 db
 #定义了三个 SQLAlchemy 数据模型，它们将映射到你 PostgreSQL 数据库中的表
 #db = SQLAlchemy()
 
+# 二级索引与 src/database/migrations.py 中的迁移同名，db.create_all() 与迁移建出的结构一致
 class VocabularyItem(db.Model):
     __tablename__ = 'vocabulary_items'
+    __table_args__ = (
+        db.Index('ux_vocabulary_items_word', 'word', unique=True),          # add_vocabulary 查重
+        db.Index('ix_vocabulary_items_created_at_id', 'created_at', 'id'),  # 列表按创建时间排序
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     word = db.Column(db.String(100), nullable=False)
@@ -31,6 +36,9 @@ class VocabularyItem(db.Model):
 
 class ConversationSession(db.Model):
     __tablename__ = 'conversation_sessions'
+    __table_args__ = (
+        db.Index('ix_conversation_sessions_created_at_id', 'created_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     session_id = db.Column(db.String(100), unique=True, nullable=False)
@@ -39,8 +47,12 @@ class ConversationSession(db.Model):
     role = db.Column(db.String(100), nullable=True)
     image_path = db.Column(db.String(255), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # 消息摘要（冗余字段，写消息时在同一事务里维护，见 services/session_summary.py；迁移 0004 添加并回填）
+    message_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    last_message_at = db.Column(db.DateTime, nullable=True)
+    last_message_preview = db.Column(db.String(200), nullable=True)
     
-    # 关联对话消息
+    # 关联对话消息（懒加载；列表接口的加载策略和序列化见 serializers.py，避免逐个会话查询消息）
     messages = db.relationship('ConversationMessage', backref='session', lazy=True, cascade='all, delete-orphan')
     
     def to_dict(self):
@@ -52,11 +64,18 @@ class ConversationSession(db.Model):
             'role': self.role,
             'image_path': self.image_path,
             'created_at': self.created_at.isoformat() if self.created_at else None,
+            'message_count': self.message_count,
+            'last_message_at': self.last_message_at.isoformat() if self.last_message_at else None,
+            'last_message_preview': self.last_message_preview,
             'messages': [msg.to_dict() for msg in self.messages]
         }
 
 class ConversationMessage(db.Model):
     __tablename__ = 'conversation_messages'
+    __table_args__ = (
+        # get_messages: WHERE session_id = ? ORDER BY timestamp, id
+        db.Index('ix_conversation_messages_session_ts_id', 'session_id', 'timestamp', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     session_id = db.Column(db.String(100), db.ForeignKey('conversation_sessions.session_id'), nullable=False)
@@ -73,3 +92,18 @@ class ConversationMessage(db.Model):
             'timestamp': self.timestamp.isoformat() if self.timestamp else None
         }
 
+
+class MessagePosting(db.Model):
+    """对话消息的倒排索引，每个 (词, 会话) 一行；读写见 src/services/message_index.py"""
+    __tablename__ = 'message_postings'
+    __table_args__ = (
+        db.Index('ix_message_postings_session_id', 'session_id'),
+    )
+    
+    term = db.Column(db.String(64), primary_key=True)
+    session_id = db.Column(db.String(100), primary_key=True)
+    last_message_id = db.Column(db.Integer, nullable=False)
+    message_count = db.Column(db.Integer, nullable=False)
+    occurrences = db.Column(db.Integer, nullable=False)
+    # varint 编码的 [消息 id 差值, 位置个数, 位置差值...]
+    postings = db.Column(db.LargeBinary, nullable=False)
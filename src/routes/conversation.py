@@ -1,9 +1,24 @@
 from flask import Blueprint, request, jsonify
-from datetime import datetime
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+import json
+import time
 import uuid
+from sqlalchemy import tuple_, select
 from ..models.vocabulary import ConversationSession, ConversationMessage
+from ..models.serializers import (session_to_dict, message_to_dict, load_recent_messages, SESSION_COLUMNS,
+                                  DEFAULT_MESSAGES_LIMIT, MAX_MESSAGES_LIMIT)
 from src.models import db             # <-- 从中央位置导入 db
 from ..services.conversation_ai import conversation_ai_service
+from ..services.rate_limiter import RateLimitExceeded, rate_limited_response
+from ..services.message_writer import message_writer
+from ..services.message_notifier import message_notifier
+from ..services.session_summary import record_messages, repair_session_summaries, preview
+from ..services.message_index import index_messages, rebuild_message_index, delete_session_index
+from ..services.read_cache import read_cache, json_body_response, SESSIONS_CACHE_PREFIX, messages_cache_prefix
+from ..services.fast_json import rows_to_dicts
+from ..services.conditional import conditional_get
+from ..database.pagination import keyset_paginate, approximate_count, InvalidCursor
 
 '''
 这是一个写得非常好的 API 蓝图，它清晰地定义了与对话会话（Session）相关的所有 CRUD 操作（创建、读取、更新/在这里是发送消息、删除）。
@@ -13,6 +28,15 @@ from ..services.conversation_ai import conversation_ai_service
 
 conversation_bp = Blueprint('conversation', __name__)
 
+# 长轮询 (wait=N) 的最长等待秒数，要小于 gunicorn 的 timeout
+LONG_POLL_MAX_SECONDS = 25
+# 长轮询期间即使没收到本进程的通知也定期重查一次（其它 worker 写入的消息）
+LONG_POLL_RECHECK_SECONDS = 2
+
+# 读缓存的键: 会话列表 / 某个会话的消息列表的前缀，后面拼上规范化的查询参数
+def _args_cache_key():
+    return urlencode(sorted(request.args.items(multi=True)))
+
 @conversation_bp.route('/sessions', methods=['POST'])
 def create_session():
     """创建对话会话"""
@@ -35,19 +59,31 @@ def create_session():
         )
         
         db.session.add(session)
+        
+        # 如果主题生成时已经预取了开场白，直接作为第一条AI消息
+        opening_msg = None
+        opening = conversation_ai_service.take_opening(theme_data)
+        if opening:
+            opening_msg = ConversationMessage(
+                session_id=session.session_id,
+                sender='assistant',
+                message=opening,
+                timestamp=datetime.utcnow()
+            )
+            db.session.add(opening_msg)
+            session.message_count = 1
+            session.last_message_at = opening_msg.timestamp
+            session.last_message_preview = preview(opening)
+        
         db.session.commit()
+        read_cache.invalidate_prefix(SESSIONS_CACHE_PREFIX)
+        # 提交成功后才记入内存里的对话历史，提交失败时不会留下数据库里没有的会话
+        conversation_ai_service.start_session(session.session_id, opening)
         
         return jsonify({
             'success': True,
-            'session': {
-                'id': session.id,
-                'session_id': session.session_id,
-                'theme': session.theme,
-                'background': session.background,
-                'role': session.role,
-                'image_path': session.image_path,
-                'created_at': session.created_at.isoformat() if session.created_at else None
-            }
+            'session': session_to_dict(session),
+            'opening_message': message_to_dict(opening_msg) if opening_msg else None
         }),201
         
     except Exception as e:
@@ -56,7 +92,13 @@ def create_session():
 
 @conversation_bp.route('/sessions/<session_id>/messages', methods=['POST'])
 def send_message(session_id):
-    """发送消息"""
+    """发送消息
+
+    等待LLM的几秒内不持有数据库连接: 查会话、写用户消息、写AI回复各是一个短事务，
+    LLM 调用前先提交，把连接还给连接池。
+    LLM 调用失败（如被限流）时删掉刚写入的用户消息，数据库和内存里的对话历史保持一致，客户端可以直接重发。
+    开启 CONVERSATION_WRITE_BEHIND 时两条消息在LLM返回后一起进入批量写入队列（见 message_writer.py）。
+    """
     try:
         data = request.get_json()
         user_message = data.get('message')
@@ -69,16 +111,7 @@ def send_message(session_id):
         if not session:
             return jsonify({'success': False, 'error': 'Session not found'}), 404
         
-        # 保存用户消息
-        user_msg = ConversationMessage(
-            session_id=session_id,
-            sender='user',
-            message=user_message,
-            timestamp=datetime.utcnow()
-        )
-        db.session.add(user_msg)
-        
-        # 生成AI回复
+        # 提交后 ORM 对象会过期、再访问会重新查库，所以先把要用的字段取出来
         session_context = {
             'session_id': session_id,
             'role': session.role,
@@ -86,97 +119,256 @@ def send_message(session_id):
             'background': session.background
         }
         
-        ai_response = conversation_ai_service.generate_ai_response(user_message, session_context)
+        # 保存用户消息（短事务，提交后连接立即归还）
+        user_msg = {
+            'id': None,
+            'session_id': session_id,
+            'sender': 'user',
+            'message': user_message,
+            'timestamp': datetime.utcnow()
+        }
+        if message_writer.enabled:
+            db.session.rollback()
+        else:
+            user_msg['id'] = _insert_message(user_msg)
+            _invalidate_session_reads(session_id)
+        
+        # 生成AI回复（不持有数据库连接）
+        try:
+            ai_response = conversation_ai_service.generate_ai_response(user_message, session_context)
+        except Exception:
+            if user_msg['id'] is not None:
+                ConversationMessage.query.filter_by(id=user_msg['id']).delete()
+                repair_session_summaries(db.session, [session_id])
+                rebuild_message_index(db.session, [session_id])
+                db.session.commit()
+                _invalidate_session_reads(session_id)
+            raise
         
         # 保存AI回复
-        ai_msg = ConversationMessage(
-            session_id=session_id,
-            sender='assistant',
-            message=ai_response,
-            timestamp=datetime.utcnow()
-        )
-        db.session.add(ai_msg)
-        
-        db.session.commit()
+        ai_msg = {
+            'id': None,
+            'session_id': session_id,
+            'sender': 'assistant',
+            'message': ai_response,
+            'timestamp': datetime.utcnow()
+        }
+        if message_writer.enabled:
+            message_writer.enqueue([_message_row(user_msg), _message_row(ai_msg)])
+        else:
+            ai_msg['id'] = _insert_message(ai_msg)
+            _invalidate_session_reads(session_id)
         
         return jsonify({
             'success': True,
-            'user_message': {
-                'id': user_msg.id,
-                'session_id': user_msg.session_id,
-                'sender': user_msg.sender,
-                'message': user_msg.message,
-                'timestamp': user_msg.timestamp.isoformat() if user_msg.timestamp else None
-            },
-            'ai_message': {
-                'id': ai_msg.id,
-                'session_id': ai_msg.session_id,
-                'sender': ai_msg.sender,
-                'message': ai_msg.message,
-                'timestamp': ai_msg.timestamp.isoformat() if ai_msg.timestamp else None
-            }
+            'user_message': {**user_msg, 'timestamp': user_msg['timestamp'].isoformat()},
+            'ai_message': {**ai_msg, 'timestamp': ai_msg['timestamp'].isoformat()}
         })
         
+    except RateLimitExceeded as e:
+        db.session.rollback()
+        return rate_limited_response(e)
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def _message_row(msg):
+    return {key: msg[key] for key in ('session_id', 'sender', 'message', 'timestamp')}
+
+def _insert_message(msg) -> int:
+    """单独一个事务写入一条消息并更新会话的消息摘要和倒排索引，返回 id"""
+    row = ConversationMessage(**_message_row(msg))
+    db.session.add(row)
+    db.session.flush()
+    record_messages(db.session, [msg])
+    message_id = row.id
+    index_messages(db.session, [dict(msg, id=message_id)])
+    db.session.commit()
+    return message_id
+
+def _invalidate_session_reads(session_id):
+    # 消息列表和会话列表（消息摘要）都变了；唤醒等待这个会话新消息的长轮询
+    read_cache.invalidate_prefix(messages_cache_prefix(session_id))
+    read_cache.invalidate_prefix(SESSIONS_CACHE_PREFIX)
+    message_notifier.notify(session_id)
+
 @conversation_bp.route('/sessions/<session_id>/messages', methods=['GET'])
 def get_messages(session_id):
-    """获取对话消息"""
+    """获取对话消息（读穿透缓存，send_message / delete_session 时失效）
+
+    增量模式: 传 since_id（上次收到的最后一条消息的 id）或 since_ts（ISO 时间），只返回更新的消息；
+    再加 wait=N（秒，最多 LONG_POLL_MAX_SECONDS）时，没有新消息就等待最多 N 秒再返回。
+    只有 worker 在等待时还能处理别的请求（gevent / gthread worker、开发服务器）才会等待；
+    gunicorn sync worker 一次只处理一个请求，等待会卡住其它所有请求，wait 按 0 处理（响应里的 wait 是实际的等待上限）。
+    
+    非增量模式支持 If-None-Match / If-Modified-Since，会话没有新消息时返回 304（不查消息表）。
+    """
     try:
-        # 查找会话
-        session = ConversationSession.query.filter_by(session_id=session_id).first()
-        if not session:
+        # 批量写入队列里还有这个会话的消息时先写完，保证能读到刚发送的消息
+        message_writer.flush(session_id)
+        
+        if 'since_id' in request.args or 'since_ts' in request.args:
+            return _get_new_messages(session_id)
+        
+        def load():
+            # 查找会话
+            session = ConversationSession.query.filter_by(session_id=session_id).first()
+            if not session:
+                return None
+            
+            # 获取消息（游标分页，默认按时间正序；order=desc 时从最新的消息往前翻）
+            limit = min(max(request.args.get('limit', 100, type=int), 1), 500)
+            descending = request.args.get('order', 'asc').lower() == 'desc'
+            messages, next_cursor = keyset_paginate(
+                ConversationMessage.query.filter_by(session_id=session_id),
+                [ConversationMessage.timestamp, ConversationMessage.id], limit,
+                cursor=request.args.get('cursor'), descending=descending, scope=f'messages:{session_id}'
+            )
+            
+            message_list = [message_to_dict(msg, include_is_user=True) for msg in messages]
+            
+            result = {
+                'success': True,
+                'messages': message_list,
+                'next_cursor': next_cursor,
+                'has_more': next_cursor is not None
+            }
+            if request.args.get('include_total', '').lower() in ('1', 'true', 'yes'):
+                # 单个会话的消息数走 (session_id, timestamp, id) 索引，直接精确计数
+                result['total'] = ConversationMessage.query.filter_by(session_id=session_id).count()
+            return result
+        
+        # 条件 GET 的校验值: 会话上的消息摘要（和消息在同一事务里维护），和消息列表一样走读缓存
+        def load_state():
+            state = db.session.execute(
+                select(ConversationSession.message_count, ConversationSession.last_message_at)
+                .where(ConversationSession.session_id == session_id)
+            ).first()
+            return {'message_count': state[0], 'last_message_at': state[1]} if state else None
+        
+        state = read_cache.get_or_load(messages_cache_prefix(session_id) + 'state', load_state)
+        if state is None:
             return jsonify({'success': False, 'error': 'Session not found'}), 404
+        last_message_at = json.loads(state)['last_message_at']
         
-        # 获取消息
-        messages = ConversationMessage.query.filter_by(session_id=session_id)\
-                                          .order_by(ConversationMessage.timestamp.asc())\
-                                          .all()
-        
-        message_list = []
-        for msg in messages:
-            message_list.append({
-                'id': msg.id,
-                'session_id': msg.session_id,
-                'sender': msg.sender,
-                'message': msg.message,
-                'timestamp': msg.timestamp.isoformat() if msg.timestamp else None,
-                'is_user': msg.sender == 'user'
-            })
+        def respond():
+            body = read_cache.get_or_load(messages_cache_prefix(session_id) + _args_cache_key(), load)
+            if body is None:
+                return jsonify({'success': False, 'error': 'Session not found'}), 404
+            return json_body_response(body)
         
-        return jsonify({
-            'success': True,
-            'messages': message_list
-        })
+        return conditional_get([state], datetime.fromisoformat(last_message_at) if last_message_at else None,
+                               respond)
         
+    except InvalidCursor as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def _long_poll_limit():
+    """
+    wait 的上限。gunicorn 的 gevent / gthread worker 和 Flask 开发服务器设置 wsgi.multithread，
+    等待期间还能处理别的请求；sync worker（默认部署）一次只处理一个请求，不允许等待。
+    """
+    return LONG_POLL_MAX_SECONDS if request.environ.get('wsgi.multithread') else 0
+
+def _get_new_messages(session_id):
+    """
+    增量同步: 按 (timestamp, id) 顺序返回 since 之后的消息，走 (session_id, timestamp, id) 索引的范围扫描，
+    数据库和带宽的开销只和新消息的条数有关，和对话长度无关。不经过读缓存。
+    """
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 500)
+    wait = min(max(request.args.get('wait', 0, type=float), 0), _long_poll_limit())
+    since_id = request.args.get('since_id', type=int)
+    since_ts = request.args.get('since_ts')
+    
+    if db.session.query(ConversationSession.id).filter_by(session_id=session_id).first() is None:
+        return jsonify({'success': False, 'error': 'Session not found'}), 404
+    
+    # 起点: since_id 对应消息的 (timestamp, id)；只给 since_ts 时取该时间之后的消息
+    if since_id is not None:
+        anchor = db.session.query(ConversationMessage.timestamp, ConversationMessage.id) \
+            .filter_by(id=since_id, session_id=session_id).first()
+        if anchor is None:
+            return jsonify({'success': False, 'error': 'since_id does not belong to this session'}), 400
+        after = tuple_(ConversationMessage.timestamp, ConversationMessage.id) > tuple_(anchor[0], anchor[1])
+        since_ts = anchor[0].isoformat() if anchor[0] else None
+    elif since_ts:
+        try:
+            since = datetime.fromisoformat(since_ts)
+        except ValueError:
+            return jsonify({'success': False, 'error': 'since_ts must be an ISO 8601 timestamp'}), 400
+        if since.tzinfo is not None:
+            # 库里存的是不带时区的 UTC 时间
+            since = since.astimezone(timezone.utc).replace(tzinfo=None)
+        after = ConversationMessage.timestamp > since
+    else:
+        return jsonify({'success': False, 'error': 'since_id or since_ts is required'}), 400
+    
+    query = ConversationMessage.query.filter(ConversationMessage.session_id == session_id, after) \
+        .order_by(ConversationMessage.timestamp, ConversationMessage.id).limit(limit + 1)
+    deadline = time.monotonic() + wait
+    while True:
+        # 先记下通知版本号再查询，查询和开始等待之间写入的消息不会被漏掉
+        version = message_notifier.version(session_id)
+        messages = query.all()
+        remaining = deadline - time.monotonic()
+        if messages or remaining <= 0:
+            break
+        # 等待期间不占数据库连接
+        db.session.rollback()
+        message_notifier.wait(session_id, version, min(remaining, LONG_POLL_RECHECK_SECONDS))
+        message_writer.flush(session_id)
+    
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    last = messages[-1] if messages else None
+    return jsonify({
+        'success': True,
+        'messages': [message_to_dict(msg, include_is_user=True) for msg in messages],
+        'has_more': has_more,
+        'wait': wait,
+        # 下一次增量请求的起点（没有新消息时原样返回）
+        'since_id': last.id if last else since_id,
+        'since_ts': last.timestamp.isoformat() if last and last.timestamp else since_ts
+    })
+
 @conversation_bp.route('/sessions', methods=['GET'])
 def get_sessions():
-    """获取所有对话会话"""
+    """获取对话会话（按创建时间倒序，游标分页；读穿透缓存，创建 / 删除会话时失效）"""
     try:
-        sessions = ConversationSession.query.order_by(ConversationSession.created_at.desc()).all()
-        
-        session_list = []
-        for session in sessions:
-            session_list.append({
-                'id': session.id,
-                'session_id': session.session_id,
-                'theme': session.theme,
-                'background': session.background,
-                'role': session.role,
-                'image_path': session.image_path,
-                'created_at': session.created_at.isoformat() if session.created_at else None
-            })
+        def load():
+            limit = min(max(request.args.get('limit', 50, type=int), 1), 200)
+            include = {part.strip() for part in request.args.get('include', '').split(',') if part.strip()}
+            # Core 查询只取会话的列（Row 元组），不构造 ORM 对象；datetime 由 fast_json 序列化
+            rows, next_cursor = keyset_paginate(
+                select(*SESSION_COLUMNS), [ConversationSession.created_at, ConversationSession.id], limit,
+                cursor=request.args.get('cursor'), descending=True, scope='sessions', session=db.session
+            )
+            session_list = rows_to_dicts(rows)
+            
+            # include=messages: 本页所有会话最新的 messages_limit 条消息一次查出，查询数与会话数无关
+            if 'messages' in include:
+                messages_limit = min(max(request.args.get('messages_limit', DEFAULT_MESSAGES_LIMIT, type=int), 1),
+                                     MAX_MESSAGES_LIMIT)
+                messages = load_recent_messages([session['session_id'] for session in session_list], messages_limit)
+                for session in session_list:
+                    session['messages'] = rows_to_dicts(messages[session['session_id']])
+            
+            result = {
+                'success': True,
+                'sessions': session_list,
+                'next_cursor': next_cursor,
+                'has_more': next_cursor is not None
+            }
+            if request.args.get('include_total', '').lower() in ('1', 'true', 'yes'):
+                result['total'] = approximate_count(db.session, ConversationSession.__tablename__)
+            return result
         
-        return jsonify({
-            'success': True,
-            'sessions': session_list
-        })
+        return json_body_response(read_cache.get_or_load(SESSIONS_CACHE_PREFIX + _args_cache_key(), load))
         
+    except InvalidCursor as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -189,8 +381,10 @@ def delete_session(session_id):
         if not session:
             return jsonify({'success': False, 'error': 'Session not found'}), 404
         
-        # 删除相关消息
+        # 删除相关消息（包括还在批量写入队列里的）
+        message_writer.discard(session_id)
         ConversationMessage.query.filter_by(session_id=session_id).delete()
+        delete_session_index(db.session, [session_id])
         
         # 删除会话
         db.session.delete(session)
@@ -199,6 +393,9 @@ def delete_session(session_id):
         conversation_ai_service.clear_conversation_history(session_id)
         
         db.session.commit()
+        read_cache.invalidate_prefix(SESSIONS_CACHE_PREFIX)
+        read_cache.invalidate_prefix(messages_cache_prefix(session_id))
+        message_notifier.forget(session_id)
         
         return jsonify({
             'success': True,
@@ -4,6 +4,7 @@ from werkzeug.utils import secure_filename
 from PIL import Image
 from ..services.image_recognition2 import  image_recognition_service
 from ..services.conversation_ai import conversation_ai_service
+from ..services.rate_limiter import RateLimitExceeded, rate_limited_response
 
 #这个文件是项目的核心功能，是对图像处理相关功能的集成
 '''
@@ -78,6 +79,8 @@ def segment_objects():
             'objects': objects
         })
 
+    except RateLimitExceeded as e:
+        return rate_limited_response(e)
     except Exception as e:
         # 打印详细错误到后端控制台，方便调试
         print(f"Error in /segment-objects: {e}") 
@@ -103,6 +106,8 @@ def generate_word_info():
             'word_info': word_info
         })
         
+    except RateLimitExceeded as e:
+        return rate_limited_response(e)
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -124,6 +129,8 @@ def understand_image():
             'understanding': understanding
         })
         
+    except RateLimitExceeded as e:
+        return rate_limited_response(e)
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -145,6 +152,8 @@ def generate_conversation_themes():
             'themes': themes
         })
         
+    except RateLimitExceeded as e:
+        return rate_limited_response(e)
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -0,0 +1,66 @@
+from flask import Blueprint, jsonify
+from ..services.llm_client import llm_client
+from ..services.llm_metrics import llm_metrics
+from ..services.conversation_ai import conversation_ai_service
+from ..services.message_writer import message_writer
+from ..models import db
+from ..database.config import database_config, pool_status
+from ..services.read_cache import read_cache
+from ..services.maintenance import maintenance
+
+'''
+运行时指标接口，方便观察各个 LLM 调用点的尾延迟、重试和熔断状态。
+'''
+
+metrics_bp = Blueprint('metrics', __name__)
+
+@metrics_bp.route('/metrics/llm', methods=['GET'])
+def get_llm_metrics():
+    """获取LLM客户端指标"""
+    try:
+        return jsonify({
+            'success': True,
+            'llm_client': llm_client.get_stats(),
+            'opening_prefetch': conversation_ai_service.opening_prefetcher.get_stats(),
+            'reply_cache': conversation_ai_service.reply_cache.get_stats()
+        })
+
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@metrics_bp.route('/metrics/llm/calls', methods=['GET'])
+def get_llm_call_metrics():
+    """按调用点汇总的LLM调用埋点：耗时/token直方图、模型、重试、JSON解析失败和备用结果使用次数"""
+    try:
+        return jsonify({'success': True, **llm_metrics.snapshot()})
+
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@metrics_bp.route('/metrics/messages', methods=['GET'])
+def get_message_writer_metrics():
+    """对话消息批量写入队列的状态：待写入条数、已写入条数和批次、写入失败次数"""
+    try:
+        return jsonify({'success': True, 'message_writer': message_writer.get_stats()})
+
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@metrics_bp.route('/metrics/db', methods=['GET'])
+def get_db_metrics():
+    """数据库连接池状态（常驻 / 借出 / 空闲 / 溢出连接数）和热点读缓存的命中率"""
+    try:
+        return jsonify({'success': True, 'database': database_config.describe(), 'pool': pool_status(db.engine),
+                        'read_cache': read_cache.get_stats()})
+
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@metrics_bp.route('/metrics/maintenance', methods=['GET'])
+def get_maintenance_metrics():
+    """保留策略和最近一次清理的统计（删除的会话 / 消息数、淘汰的对话历史、清理的上传文件）"""
+    try:
+        return jsonify({'success': True, 'maintenance': maintenance.get_stats()})
+
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
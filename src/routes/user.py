@@ -2,6 +2,9 @@ from flask import Blueprint, jsonify, request
 #from src.models.user import User, db
 from src.models.user import User      # <-- 只导入模型
 from src.models import db             # <-- 从中央位置导入 db
+from src.models.serializers import USER_COLUMNS
+from src.services.fast_json import rows_to_dicts, json_response
+from sqlalchemy import select
 
 '''
 用于对 User 资源进行 CRUD (Create, Read, Update, Delete) 操作。代码写得非常简洁、清晰，并且很好地利用了 Flask 和 Flask-SQLAlchemy 提供的便利功能。
@@ -12,8 +15,9 @@ user_bp = Blueprint('user', __name__)
 
 @user_bp.route('/users', methods=['GET'])
 def get_users():
-    users = User.query.all()
-    return jsonify([user.to_dict() for user in users])
+    # 只取 to_dict() 的列，不构造 ORM 对象
+    rows = db.session.execute(select(*USER_COLUMNS))
+    return json_response(rows_to_dicts(rows))
 
 @user_bp.route('/users', methods=['POST'])
 def create_user():
@@ -1,16 +1,31 @@
-from flask import Blueprint, request, jsonify
-from src.models.vocabulary import VocabularyItem
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from src.models.vocabulary import VocabularyItem, ConversationMessage
 from src.models import db             # <-- 从中央位置导入 db
+from src.services.vocabulary_search import vocabulary_search
+from src.database.pagination import keyset_paginate, approximate_count, InvalidCursor
+from src.services.read_cache import read_cache, json_body_response
+from src.services.fast_json import rows_to_dicts, json_response
+from src.services.conditional import table_version, conditional_get
+from src.services.vocabulary_autocomplete import vocabulary_autocomplete
+from src.services.message_index import tokenize, term_counts, phrase_counts, phrase_matches
+from src.models.serializers import VOCABULARY_COLUMNS, MESSAGE_COLUMNS
+from src.services.vocabulary_io import export_chunks, EXPORT_FORMATS, import_vocabulary, iter_import_rows, IMPORT_FORMATS
 import json
+from datetime import datetime
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
 
 '''
 单词本的相关操作
 GET /vocabulary (get_vocabulary):
 目的: 获取单词本中的所有单词，并支持分页。
-流程: It uses request.args to get page and per_page parameters. The paginate() function from SQLAlchemy is used, which is the most efficient way to handle pagination. It returns a well-structured JSON object containing the list of words for the current page, total number of words, total pages, and the current page number. This is perfect for a front-end UI.
+流程: Cursor (keyset) pagination on (created_at, id): pass limit and the next_cursor from the previous response; every page costs the same as the first one. include_total=true adds an approximate total. The old page/per_page parameters still work through paginate() for older clients.
 POST /vocabulary (add_vocabulary):
 目的: 向单词本添加一个新单词。
 流程: It validates that required fields (word, definition) are present. It then checks if the word already exists to prevent duplicates, which is great for data integrity. If the word is new, it creates a VocabularyItem, saves it to the database, and returns the new item with a 201 Created status code.
+POST /vocabulary/import (import_vocabulary_items):
+目的: 批量导入单词。
+流程: Parses a JSON array, NDJSON or CSV body (or an uploaded file) as a stream and inserts it in batches with INSERT ... ON CONFLICT (word) DO NOTHING. Returns a summary plus a per-row status (inserted / duplicate / invalid); results=errors lists only the rows that were not inserted.
 GET /vocabulary/<int:item_id> (get_vocabulary_item):
 目的: 获取单个单词的详细信息。
 流程: Uses query.get_or_404(item_id) to find the item, which is a clean and robust way to handle both success and "not found" cases.
@@ -22,25 +37,56 @@ DELETE /vocabulary/<int:item_id> (delete_vocabulary_item):
 流程: Finds the item, deletes it from the database session, and commits the change.
 GET /vocabulary/search (search_vocabulary):
 目的: 根据关键词搜索单词本。
-流程: It takes a query parameter q and uses filter(VocabularyItem.word.contains(query) | VocabularyItem.definition.contains(query)) to search for the query string in both the word and its definition. The | operator correctly translates to a SQL OR.
+流程: It takes a query parameter q and runs an indexed full-text search over the word and its definition (see services/vocabulary_search.py), ranked by relevance and paginated with limit/offset. Only the newest VOCABULARY_SEARCH_CANDIDATES matches (default 1000) are ranked, plus an exact match on the word; when a query matches more than that, older words cannot appear and the response says so with truncated=true.
+GET /vocabulary/autocomplete (autocomplete_vocabulary):
+目的: 添加单词时的输入联想。
+流程: Prefix match (case-insensitive) on the word against an in-process sorted index (services/vocabulary_autocomplete.py), newest words first; no database query per keystroke.
+GET /vocabulary/usage, GET /vocabulary/<int:item_id>/usage (get_vocabulary_usage, get_vocabulary_item_usage):
+目的: 学习者在对话里用过哪些单词、在哪里用的。
+流程: Reads the inverted index over the learner's messages (services/message_index.py) instead of scanning message text; optional session_id narrows it to one conversation.
 GET /vocabulary/export (export_vocabulary):
-目的: 将整个单词本导出为 JSON 格式。
-流程: It fetches all vocabulary items and wraps them in a JSON object with some metadata like total count and an export timestamp.
+目的: 将整个单词本导出为 JSON / NDJSON / CSV 格式。
+流程: Streams the word book in batches (yield_per) through a generator response, optionally gzip-compressed; the JSON format keeps the old shape with total count and export timestamp. Memory use does not grow with the number of words.
 '''
 
 vocabulary_bp = Blueprint('vocabulary', __name__)
 
+def _item_cache_key(item_id):
+    # 读缓存的键；新增和批量导入只会产生新的 id（不缓存 404），不需要失效
+    return f'vocabulary:{item_id}'
+
+# 导入时没有 format 参数，按 Content-Type 判断格式
+IMPORT_CONTENT_TYPES = {
+    'application/json': 'json',
+    'application/x-ndjson': 'ndjson',
+    'application/ndjson': 'ndjson',
+    'text/csv': 'csv',
+}
+
 @vocabulary_bp.route('/vocabulary', methods=['GET'])
 def get_vocabulary():
-    """获取所有单词"""
+    """获取所有单词（按创建时间倒序，游标分页；支持 If-None-Match / If-Modified-Since，单词本没变时返回 304）"""
     try:
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
+        version = table_version(VocabularyItem.__tablename__)
+        if version is None:
+            return _list_vocabulary()
+        return conditional_get(version, version[1], _list_vocabulary)
         
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def _list_vocabulary():
+    """单词列表的响应（条件 GET 判断单词本有变化后才调用）"""
+    limit = min(max(request.args.get('limit', request.args.get('per_page', 20, type=int), type=int), 1), 100)
+    
+    if 'page' in request.args and 'cursor' not in request.args:
+        # 旧的页码分页（OFFSET + COUNT），保留给还没改用游标的客户端
+        page = request.args.get('page', 1, type=int)
         vocabulary_items = VocabularyItem.query.order_by(VocabularyItem.created_at.desc()).paginate(
-            page=page, per_page=per_page, error_out=False
+            page=page, per_page=limit, error_out=False
         )
-        
         return jsonify({
             'success': True,
             'vocabulary': [item.to_dict() for item in vocabulary_items.items],
@@ -48,9 +94,22 @@ def get_vocabulary():
             'pages': vocabulary_items.pages,
             'current_page': page
         })
-        
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    
+    # 只取 to_dict() 的列，不构造 ORM 对象
+    rows, next_cursor = keyset_paginate(
+        select(*VOCABULARY_COLUMNS), [VocabularyItem.created_at, VocabularyItem.id], limit,
+        cursor=request.args.get('cursor'), descending=True, scope='vocabulary', session=db.session
+    )
+    result = {
+        'success': True,
+        'vocabulary': rows_to_dicts(rows),
+        'next_cursor': next_cursor,
+        'has_more': next_cursor is not None,
+        'limit': limit
+    }
+    if request.args.get('include_total', '').lower() in ('1', 'true', 'yes'):
+        result['total'] = approximate_count(db.session, VocabularyItem.__tablename__)
+    return json_response(result)
 
 @vocabulary_bp.route('/vocabulary', methods=['POST'])
 def add_vocabulary():
@@ -77,26 +136,72 @@ def add_vocabulary():
         )
         
         db.session.add(vocabulary_item)
+        db.session.flush()
+        # 提交前读版本号（此时版本号的行被本事务锁着），联想索引据此判断能否增量更新
+        version = table_version(VocabularyItem.__tablename__)
         db.session.commit()
+        vocabulary_autocomplete.add(vocabulary_item.id, vocabulary_item.word, vocabulary_item.created_at, version)
         
         return jsonify({
             'success': True,
             'vocabulary_item': vocabulary_item.to_dict()
         }), 201
         
+    except IntegrityError:
+        # 并发添加同一个单词时，由 word 上的唯一索引兜底
+        db.session.rollback()
+        return jsonify({'error': '该单词已存在于单词本中'}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@vocabulary_bp.route('/vocabulary/import', methods=['POST'])
+def import_vocabulary_items():
+    """批量导入单词（JSON 数组 / NDJSON / CSV，流式解析，按批去重插入）"""
+    try:
+        upload = request.files.get('file')
+        if upload is not None:
+            stream = upload.stream
+            fmt = request.args.get('format') or upload.filename.rsplit('.', 1)[-1].lower()
+        else:
+            stream = request.stream
+            fmt = request.args.get('format') or IMPORT_CONTENT_TYPES.get(request.mimetype, '')
+        fmt = fmt.lower()
+        if fmt not in IMPORT_FORMATS:
+            return jsonify({'error': '无法识别的导入格式，请使用 format=json|ndjson|csv'}), 400
+        only_errors = request.args.get('results', 'all').lower() == 'errors'
+        
+        report = import_vocabulary(iter_import_rows(stream, fmt))
+        vocabulary_autocomplete.invalidate()
+        if report.error and not report.statuses:
+            return jsonify({'error': report.error}), 400
+        
+        def generate():
+            # 结果可能有十几万行，逐行写出
+            yield json.dumps({'success': True, 'summary': report.summary(), 'error': report.error},
+                             ensure_ascii=False)[:-1] + ', "results": ['
+            for i, result in enumerate(report.iter_results(only_errors)):
+                yield (',' if i else '') + json.dumps(result, ensure_ascii=False)
+            yield ']}'
+        
+        return Response(generate(), mimetype='application/json')
+        
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
 @vocabulary_bp.route('/vocabulary/<int:item_id>', methods=['GET'])
 def get_vocabulary_item(item_id):
-    """获取单个单词详情"""
+    """获取单个单词详情（读穿透缓存，更新 / 删除时失效）"""
     try:
-        vocabulary_item = VocabularyItem.query.get_or_404(item_id)
-        return jsonify({
-            'success': True,
-            'vocabulary_item': vocabulary_item.to_dict()
-        })
+        def load():
+            vocabulary_item = VocabularyItem.query.get_or_404(item_id)
+            return {
+                'success': True,
+                'vocabulary_item': vocabulary_item.to_dict()
+            }
+        
+        return json_body_response(read_cache.get_or_load(_item_cache_key(item_id), load))
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -120,13 +225,21 @@ def update_vocabulary_item(item_id):
         if 'segmented_image_path' in data:
             vocabulary_item.segmented_image_path = data['segmented_image_path']
         
+        db.session.flush()
+        version = table_version(VocabularyItem.__tablename__)
         db.session.commit()
+        read_cache.invalidate(_item_cache_key(item_id))
+        vocabulary_autocomplete.update(item_id, vocabulary_item.word, version)
         
         return jsonify({
             'success': True,
             'vocabulary_item': vocabulary_item.to_dict()
         })
-        
+
+    except IntegrityError:
+        # 改成单词本里已有的单词时，由 word 上的唯一索引兜底
+        db.session.rollback()
+        return jsonify({'error': '该单词已存在于单词本中'}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -137,7 +250,11 @@ def delete_vocabulary_item(item_id):
     try:
         vocabulary_item = VocabularyItem.query.get_or_404(item_id)
         db.session.delete(vocabulary_item)
+        db.session.flush()
+        version = table_version(VocabularyItem.__tablename__)
         db.session.commit()
+        read_cache.invalidate(_item_cache_key(item_id))
+        vocabulary_autocomplete.remove(item_id, version)
         
         return jsonify({
             'success': True,
@@ -150,43 +267,145 @@ def delete_vocabulary_item(item_id):
 
 @vocabulary_bp.route('/vocabulary/search', methods=['GET'])
 def search_vocabulary():
-    """搜索单词"""
+    """
+    搜索单词（全文检索，按相关度排序，limit/offset 分页）。
+    只对最新的 VOCABULARY_SEARCH_CANDIDATES 条匹配排序（加上单词完全相同的那一条），
+    匹配更多时 truncated 为 true，更早添加的单词不会出现在结果里，需要换更具体的关键词
+    """
     try:
-        query = request.args.get('q', '')
+        query = request.args.get('q', '').strip()
         if not query:
             return jsonify({'error': '缺少搜索关键词'}), 400
+        limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+        offset = max(request.args.get('offset', 0, type=int), 0)
         
-        vocabulary_items = VocabularyItem.query.filter(
-            VocabularyItem.word.contains(query) | 
-            VocabularyItem.definition.contains(query)
-        ).order_by(VocabularyItem.created_at.desc()).all()
+        result = vocabulary_search.search(query, limit=limit, offset=offset)
+        vocabulary_items = result['items']
         
+        return json_response({
+            'success': True,
+            'vocabulary': vocabulary_items,
+            'count': len(vocabulary_items),
+            'limit': limit,
+            'offset': offset,
+            'has_more': result['has_more'],
+            'next_offset': offset + limit if result['has_more'] else None,
+            'truncated': result['truncated']
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@vocabulary_bp.route('/vocabulary/autocomplete', methods=['GET'])
+def autocomplete_vocabulary():
+    """输入联想: 以 q 开头的单词（不区分大小写，最新添加的在前），由进程内的有序索引提供"""
+    try:
+        prefix = request.args.get('q', '').strip()
+        if not prefix:
+            return jsonify({'error': '缺少搜索关键词'}), 400
+        limit = request.args.get('limit', 10, type=int)
+        
+        suggestions = vocabulary_autocomplete.suggest(prefix, limit)
         return jsonify({
             'success': True,
-            'vocabulary': [item.to_dict() for item in vocabulary_items],
-            'count': len(vocabulary_items)
+            'suggestions': suggestions,
+            'count': len(suggestions)
         })
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@vocabulary_bp.route('/vocabulary/export', methods=['GET'])
-def export_vocabulary():
-    """导出单词本为JSON格式"""
+@vocabulary_bp.route('/vocabulary/usage', methods=['GET'])
+def get_vocabulary_usage():
+    """单词本里每个单词在学习者消息里的使用次数（倒排索引；session_id 只统计一个会话，include_unused 带上没用过的词）"""
     try:
-        vocabulary_items = VocabularyItem.query.order_by(VocabularyItem.created_at.desc()).all()
+        session_id = request.args.get('session_id')
+        include_unused = request.args.get('include_unused', '').lower() in ('1', 'true', 'yes')
+        items = db.session.execute(select(VocabularyItem.id, VocabularyItem.word)).all()
         
-        export_data = {
-            'vocabulary': [item.to_dict() for item in vocabulary_items],
-            'total_count': len(vocabulary_items),
-            'export_timestamp': VocabularyItem.query.first().created_at.isoformat() if vocabulary_items else None
-        }
+        # 单个词直接读计数列；多词短语一起取 postings，在内存里判断相邻
+        single = {}
+        phrases = {}
+        for item_id, word in items:
+            tokens = tokenize(word)
+            if len(tokens) == 1:
+                single[item_id] = tokens[0]
+            elif tokens:
+                phrases[item_id] = word
+        counts = term_counts(db.session, sorted(set(single.values())), session_id)
+        usage = {item_id: counts.get(term, (0, 0)) for item_id, term in single.items()}
+        counts = phrase_counts(db.session, sorted(set(phrases.values())), session_id)
+        usage.update((item_id, counts[word]) for item_id, word in phrases.items())
         
-        return jsonify({
+        result = []
+        for item_id, word in items:
+            message_count, occurrences = usage.get(item_id, (0, 0))
+            if message_count or include_unused:
+                result.append({'id': item_id, 'word': word, 'message_count': message_count,
+                               'occurrences': occurrences})
+        result.sort(key=lambda r: (-r['message_count'], -r['occurrences'], r['word']))
+        
+        return json_response({
             'success': True,
-            'data': export_data
+            'usage': result,
+            'practiced': sum(1 for message_count, _ in usage.values() if message_count),
+            'total': len(items)
         })
         
     except Exception as e:
+        db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+@vocabulary_bp.route('/vocabulary/<int:item_id>/usage', methods=['GET'])
+def get_vocabulary_item_usage(item_id):
+    """这个单词出现在学习者的哪些消息里（最近的在前，positions 为词在消息里的位置；session_id 只查一个会话）"""
+    try:
+        item = db.session.execute(
+            select(VocabularyItem.id, VocabularyItem.word).where(VocabularyItem.id == item_id)
+        ).first()
+        if item is None:
+            return jsonify({'error': '单词不存在'}), 404
+        limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+        
+        matches = phrase_matches(db.session, item.word, request.args.get('session_id'))
+        recent = matches[::-1][:limit]
+        rows = db.session.execute(
+            select(*MESSAGE_COLUMNS).where(ConversationMessage.id.in_([message_id for message_id, _, _ in recent]))
+        )
+        by_id = {row['id']: row for row in rows_to_dicts(rows)}
+        
+        return json_response({
+            'success': True,
+            'vocabulary_item': {'id': item.id, 'word': item.word},
+            'message_count': len(matches),
+            'occurrences': sum(len(starts) for _, _, starts in matches),
+            'session_count': len({sid for _, sid, _ in matches}),
+            'messages': [dict(by_id[message_id], positions=starts)
+                         for message_id, _, starts in recent if message_id in by_id]
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@vocabulary_bp.route('/vocabulary/export', methods=['GET'])
+def export_vocabulary():
+    """流式导出单词本（format=json|ndjson|csv，gzip=true 时压缩）"""
+    try:
+        fmt = request.args.get('format', 'json').lower()
+        if fmt not in EXPORT_FORMATS:
+            return jsonify({'error': f'不支持的导出格式: {fmt}'}), 400
+        compress = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+        
+        mimetype, extension = EXPORT_FORMATS[fmt]
+        filename = f"vocabulary-{datetime.utcnow().strftime('%Y%m%d')}.{extension}"
+        headers = {'Content-Disposition': f'attachment; filename="{filename}"'}
+        if compress:
+            headers['Content-Encoding'] = 'gzip'
+        
+        # stream_with_context: 生成器在响应写出期间仍然可以使用数据库会话
+        return Response(stream_with_context(export_chunks(fmt, compress=compress)),
+                        mimetype=mimetype, headers=headers)
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
@@ -0,0 +1,72 @@
+# conditional.py
+
+import hashlib
+from datetime import datetime
+from typing import Any, Callable, Optional, Sequence, Tuple
+
+from flask import current_app, request
+from sqlalchemy import text, BigInteger, DateTime
+from sqlalchemy.exc import SQLAlchemyError
+from werkzeug.http import is_resource_modified
+
+from ..models import db
+
+'''
+条件 GET（ETag / Last-Modified）。
+客户端轮询 /api/vocabulary、/api/sessions/<id>/messages，数据没变时也要重新下载整个响应。
+现在响应带上 ETag 和 Last-Modified，客户端下次带 If-None-Match / If-Modified-Since 来问，
+没变就返回 304（没有响应体），既省移动端流量，也不跑列表查询、不序列化。
+
+校验值不是从响应体算出来的（那样还是要查询和序列化），而是一条很便宜的查询:
+- 单词本: table_versions 里 vocabulary_items 的版本号（迁移 0005 的触发器在每次增删改时累加，删除也能发现）
+- 某个会话的消息: conversation_sessions 上的 message_count / last_message_at（和消息在同一事务里维护）
+ETag 还包含请求路径和查询参数，不同的页、不同的 limit 各自有各自的 ETag。
+
+If-None-Match 优先于 If-Modified-Since（RFC 7232）。Last-Modified 只有秒级精度，同一秒内的多次修改靠 ETag 区分。
+'''
+
+_warned_tables = set()
+
+
+def table_version(table: str) -> Optional[Tuple[int, datetime]]:
+    """(version, changed_at)；还没执行迁移 0005 时返回 None（此时不做条件 GET）"""
+    try:
+        statement = text('SELECT version, changed_at FROM table_versions WHERE table_name = :t') \
+            .columns(version=BigInteger, changed_at=DateTime)
+        row = db.session.execute(statement, {'t': table}).first()
+    except SQLAlchemyError:
+        db.session.rollback()
+        row = None
+    if row is None:
+        if table not in _warned_tables:
+            _warned_tables.add(table)
+            print(f"table_versions has no row for {table}; conditional GET disabled (run: python -m src.database upgrade)")
+        return None
+    return row[0], row[1]
+
+
+def make_etag(*parts: Any) -> str:
+    """数据的版本 + 请求路径和查询参数"""
+    raw = repr((parts, request.path, sorted(request.args.items(multi=True))))
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:20]
+
+
+def conditional_get(validators: Sequence[Any], last_modified: Optional[datetime], load: Callable[[], Any]):
+    """
+    validators 没变时直接返回 304，不调用 load；否则调用 load() 生成响应并加上 ETag / Last-Modified。
+    load 返回 (响应, 状态码) 的错误响应时原样返回，不加校验头。
+    """
+    etag = make_etag(*validators)
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = current_app.response_class(status=304)
+    else:
+        response = load()
+        if not isinstance(response, current_app.response_class) or response.status_code != 200:
+            return response
+    # 弱 ETag: 同样的数据经过压缩等处理后字节可能不同
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # 允许客户端缓存，但每次使用前都要来问一次（带上 If-None-Match）
+    response.cache_control.no_cache = True
+    return response
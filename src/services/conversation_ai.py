@@ -2,13 +2,15 @@
 
 import os
 import json
-from typing import List, Dict, Any
-# 导入智普AI的官方SDK
-try:
-    from zhipuai import ZhipuAI
-except ImportError:
-    print("ZhipuAI SDK not found. Please run 'pip install zhipuai'")
-    ZhipuAI = None
+import time
+from typing import List, Dict, Any, Tuple
+from .conversation_context import ConversationContextManager
+from .opening_prefetch import OpeningPrefetcher
+from .reply_cache import ReplyCache
+# 所有智普AI调用都经过共享的客户端层（连接池、超时、重试、熔断）
+from .llm_client import llm_client
+from .rate_limiter import RateLimitExceeded
+from .llm_metrics import llm_metrics
 
 class ConversationAIService:
     """
@@ -17,18 +19,20 @@ class ConversationAIService:
     """
     
     def __init__(self):
-        # 优先使用智普AI的API Key
-        #self.zhipu_api_key = os.getenv('ZHIPU_API_KEY')
-        self.zhipu_api_key ="482802cba1a144518285e3fb10068f4d.9drwfXmNcnr25cIe"
-        self.conversation_history = {}  # 存储对话历史
+        # 对话历史 + 滚动摘要，由上下文管理器维护（较早的轮次在后台折叠进摘要）
+        self.context_manager = ConversationContextManager(summarizer=self._summarize_turns)
+        self.conversation_history = self.context_manager.histories  # 存储对话历史
 
-        # 初始化智普AI客户端
-        self.zhipu_client = None
-        if self.zhipu_api_key and ZhipuAI:
-            try:
-                self.zhipu_client = ZhipuAI(api_key=self.zhipu_api_key)
-            except Exception as e:
-                print(f"Failed to initialize ZhipuAI client: {e}")
+        # 智普AI客户端（进程内共享）
+        self.zhipu_client = llm_client if llm_client.available else None
+
+        # 主题生成后在后台预取每个主题的开场白（CONVERSATION_PREFETCH_ENABLED 开启）
+        self.opening_prefetcher = OpeningPrefetcher(self._generate_opening_zhipu)
+        if not self.zhipu_client:
+            self.opening_prefetcher.enabled = False
+
+        # 开场阶段常见问候的回复缓存
+        self.reply_cache = ReplyCache()
     
     def generate_conversation_themes(self, image_understanding: Dict[str, Any]) -> List[Dict[str, Any]]:
         """根据图片理解生成对话主题"""
@@ -56,12 +60,18 @@ class ConversationAIService:
                 themes = self._generate_themes_zhipu(prompt)
             else:
                 print("ZhipuAI client not available. Using fallback themes.")
+                llm_metrics.record_fallback('conversation.themes', 'no_client')
                 themes = self._generate_themes_fallback(image_understanding)
             
+            # 用户很可能马上选其中一个主题开始对话，提前生成开场白
+            self.opening_prefetcher.prefetch_themes(themes)
             return themes
             
+        except RateLimitExceeded:
+            raise
         except Exception as e:
             print(f"Error generating conversation themes: {e}")
+            llm_metrics.record_fallback('conversation.themes', 'error')
             return self._generate_themes_fallback(image_understanding)
     
     def _generate_themes_zhipu(self, prompt: str) -> List[Dict[str, Any]]:
@@ -70,7 +80,9 @@ class ConversationAIService:
             return []
         try:
             print("--- Calling Zhipu AI for theme generation ---")
-            response = self.zhipu_client.chat.completions.create(
+            response = self.zhipu_client.chat_completion(
+                'conversation.themes',
+                priority='image',
                 model="glm-4-flash-250414",
                 messages=[{"role": "user", "content": prompt}],
                 response_format={"type": "json_object"},  # 强制JSON输出，非常稳定
@@ -80,15 +92,28 @@ class ConversationAIService:
             )
             content = getattr(response, 'choices', [{}])[0].message.content if hasattr(response, 'choices') else None
             if not content:
+                llm_metrics.record_fallback('conversation.themes', 'empty')
+                return []
+            try:
+                themes = json.loads(content)
+            except json.JSONDecodeError:
+                print(f"Zhipu AI theme generation: Failed to decode JSON. Content: {content}")
+                llm_metrics.record_json_parse_failure('conversation.themes')
+                llm_metrics.record_fallback('conversation.themes', 'json_parse')
                 return []
-            themes = json.loads(content)
             # 确保返回的是列表
             if isinstance(themes, dict) and isinstance(list(themes.values())[0], list):
                 themes = list(themes.values())[0]
 
-            return themes if isinstance(themes, list) else []
+            if not isinstance(themes, list):
+                llm_metrics.record_fallback('conversation.themes', 'invalid_shape')
+                return []
+            return themes
+        except RateLimitExceeded:
+            raise
         except Exception as e:
             print(f"Error in Zhipu AI theme generation (SDK): {e}")
+            llm_metrics.record_fallback('conversation.themes', 'error')
             return []
 
     def _generate_themes_fallback(self, image_understanding: Dict[str, Any]) -> List[Dict[str, Any]]:
@@ -111,52 +136,52 @@ class ConversationAIService:
             theme = session_context.get('theme', 'General Chat')
             background = session_context.get('background', '')
             
-            history = self.conversation_history.get(session_id, [])
+            history = self.context_manager.get_history(session_id)
+            summary = self.context_manager.get_summary(session_id)
             
             if self.zhipu_client:
-                response_text = self._generate_response_zhipu(user_message, role, theme, background, history)
+                # 早期轮次先查回复缓存（只缓存真正由LLM生成的回复）
+                cache_key = self.reply_cache.make_key(user_message, role, theme, background, history, summary)
+                response_text = self.reply_cache.get(cache_key)
+                if response_text is None:
+                    start = time.monotonic()
+                    response_text, is_fallback = self._generate_response_zhipu(
+                        user_message, role, theme, background, history, summary)
+                    if not is_fallback:
+                        self.reply_cache.put(cache_key, response_text, time.monotonic() - start)
             else:
                 print("ZhipuAI client not available. Using fallback response.")
+                llm_metrics.record_fallback('conversation.reply', 'no_client')
                 response_text = self._generate_response_fallback(user_message, role, theme)
             
-            # 更新对话历史
+            # 更新对话历史（超出保留轮数的部分会在后台折叠进摘要）
             if session_id:
-                if session_id not in self.conversation_history:
-                    self.conversation_history[session_id] = []
-                self.conversation_history[session_id].append({'user': user_message, 'assistant': response_text})
-                if len(self.conversation_history[session_id]) > 10:
-                    self.conversation_history[session_id] = self.conversation_history[session_id][-10:]
+                self.context_manager.append_turn(session_id, user_message, response_text)
             
             return response_text
             
+        except RateLimitExceeded:
+            raise
         except Exception as e:
             print(f"Error generating AI response: {e}")
+            llm_metrics.record_fallback('conversation.reply', 'error')
             return self._generate_response_fallback(user_message, 'Assistant', 'General Chat')
     
     def _generate_response_zhipu(self, user_message: str, role: str, theme: str, 
-                                background: str, history: List[Dict]) -> str:
-        """使用智普AI SDK生成回复"""
+                                background: str, history: List[Dict], summary: str = '') -> Tuple[str, bool]:
+        """使用智普AI SDK生成回复，返回 (回复文本, 是否为备用回复)；备用回复不能写入回复缓存"""
         if not self.zhipu_client:
-            return self._generate_response_fallback(user_message, role, theme)
+            return self._generate_response_fallback(user_message, role, theme), True
         try:
             print(f"--- Calling Zhipu AI for conversation (Role: {role}) ---")
-            system_prompt = f"""
-            You are a {role} in a {theme} scenario. {background}
-            Your goal is to help the user learn English vocabulary through natural conversation.
-            - Stay in character as a {role}.
-            - Use vocabulary appropriate for the scenario.
-            - Provide helpful explanations when needed.
-            - Keep responses conversational and engaging.
-            - If the user asks about vocabulary, provide clear definitions and examples.
-            """
+            system_prompt = self._build_system_prompt(role, theme, background)
             
-            messages = [{"role": "system", "content": system_prompt}]
-            for h in history[-5:]:  # 只保留最近5轮对话
-                messages.append({"role": "user", "content": h['user']})
-                messages.append({"role": "assistant", "content": h['assistant']})
-            messages.append({"role": "user", "content": user_message})
+            # 在token预算内组装: system + 滚动摘要 + 尽可能多的最近对话 + 当前消息
+            messages = self.context_manager.build_messages(system_prompt, user_message, history, summary)
             
-            response = self.zhipu_client.chat.completions.create(
+            response = self.zhipu_client.chat_completion(
+                'conversation.reply',
+                priority='interactive',
                 model="glm-4-flash-250414",
                 messages=messages,
                 max_tokens=300,
@@ -164,11 +189,83 @@ class ConversationAIService:
                 stream=False
             )
             content = getattr(response, 'choices', [{}])[0].message.content if hasattr(response, 'choices') else None
-            return content if content else self._generate_response_fallback(user_message, role, theme)
+            if not content:
+                llm_metrics.record_fallback('conversation.reply', 'empty')
+                return self._generate_response_fallback(user_message, role, theme), True
+            return content, False
                 
+        except RateLimitExceeded:
+            # 额度用尽时交给路由层返回 429，而不是静默地返回备用回复
+            raise
         except Exception as e:
             print(f"Error in Zhipu AI response generation: {e}")
-            return self._generate_response_fallback(user_message, role, theme)
+            llm_metrics.record_fallback('conversation.reply', 'error')
+            return self._generate_response_fallback(user_message, role, theme), True
+
+    def _build_system_prompt(self, role: str, theme: str, background: str) -> str:
+        return f"""
+            You are a {role} in a {theme} scenario. {background}
+            Your goal is to help the user learn English vocabulary through natural conversation.
+            - Stay in character as a {role}.
+            - Use vocabulary appropriate for the scenario.
+            - Provide helpful explanations when needed.
+            - Keep responses conversational and engaging.
+            - If the user asks about vocabulary, provide clear definitions and examples.
+            """
+
+    def _generate_opening_zhipu(self, theme: Dict[str, Any]) -> str:
+        """为一个主题生成AI的开场白（预取时在后台线程调用）"""
+        role = theme.get('role') or 'Assistant'
+        system_prompt = self._build_system_prompt(role, theme.get('title') or 'General Chat', theme.get('background') or '')
+        response = self.zhipu_client.chat_completion(
+            'conversation.opening',
+            priority='background',
+            model="glm-4-flash-250414",
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": "Start the conversation: greet the learner in character and ask an opening question. Keep it to two sentences."}
+            ],
+            max_tokens=120,
+            temperature=0.7,
+            stream=False
+        )
+        content = getattr(response, 'choices', [{}])[0].message.content if hasattr(response, 'choices') else None
+        return content or ''
+
+    def take_opening(self, theme: Dict[str, Any]) -> str:
+        """新会话开始时取用预取好的开场白（没有则返回空字符串）"""
+        return self.opening_prefetcher.consume(theme) or ''
+
+    def start_session(self, session_id: str, opening: str):
+        """会话（和开场白消息）提交到数据库之后调用，把开场白记入对话历史"""
+        if opening and session_id:
+            self.context_manager.append_turn(session_id, '', opening)
+
+    def _summarize_turns(self, previous_summary: str, turns: List[Dict[str, str]]) -> str:
+        """把较早的对话增量折叠进滚动摘要（由上下文管理器在后台线程调用）"""
+        if not self.zhipu_client:
+            return ''
+        transcript = "\n".join((f"User: {t['user']}\n" if t['user'] else '') + f"Assistant: {t['assistant']}" for t in turns)
+        prompt = f"""
+        Update the running summary of an English-learning conversation.
+        Current summary: {previous_summary or '(empty)'}
+        New exchanges:
+        {transcript}
+        
+        Write the updated summary in at most {self.context_manager.summary_max_tokens // 2} words.
+        Keep facts about the user, topics discussed and vocabulary already taught. Respond with the summary only.
+        """
+        response = self.zhipu_client.chat_completion(
+            'conversation.summary',
+            priority='background',
+            model="glm-4-flash-250414",
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=self.context_manager.summary_max_tokens,
+            temperature=0.3,
+            stream=False
+        )
+        content = getattr(response, 'choices', [{}])[0].message.content if hasattr(response, 'choices') else None
+        return content or ''
 
     def _generate_response_fallback(self, user_message: str, role: str, theme: str) -> str:
         """生成备用回复"""
@@ -177,7 +274,7 @@ class ConversationAIService:
     def clear_conversation_history(self, session_id: str):
         """清除对话历史"""
         if session_id in self.conversation_history:
-            del self.conversation_history[session_id]
+            self.context_manager.clear(session_id)
             print(f"History for session {session_id} cleared.")
 
 # 创建全局实例
@@ -195,7 +292,7 @@ if __name__ == "__main__":
     print("=" * 50)
 
     # 1. 检查API Key是否设置
-    api_key = "482802cba1a144518285e3fb10068f4d.9drwfXmNcnr25cIe" # 直接硬编码
+    api_key = os.getenv('ZHIPU_API_KEY')
     if not api_key:
         print("\nERROR: ZHIPU_API_KEY environment variable is not set.")
         print("Please set it before running the test.")
@@ -0,0 +1,274 @@
+# conversation_context.py
+
+import os
+import re
+import math
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Callable
+
+'''
+对话上下文管理器。
+以前 _generate_response_zhipu 只发送 system prompt + 最近5轮原始对话，更早的内容直接丢弃。
+这里为每个会话维护:
+- 最近若干轮的原始对话 (recent turns)
+- 一段滚动摘要 (rolling summary)，较早的对话在每次回复后由后台线程增量折叠进摘要
+组装 prompt 时使用本地 token 估算器，保证 system + 摘要 + 历史 + 当前消息 不超过配置的 token 预算。
+这样对话再长，prompt 大小和延迟也是有上限的，同时长程上下文不会丢失。
+'''
+
+_CJK_RE = re.compile(r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]')
+_WORD_RE = re.compile(r'[A-Za-z0-9]+|[^\sA-Za-z0-9]')
+
+# 每条 message 在 chat 格式里的固定开销 (role、分隔符等)
+MESSAGE_TOKEN_OVERHEAD = 4
+
+# 英文单词平均约1.3个token；长单词按每4个字符1个token计，取两者中较大的
+TOKENS_PER_WORD = 1.3
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """本地估算文本的 token 数: 中日韩字符按1个token计，英文单词按1.3个token计（长单词按每4个字符1个），标点各1个"""
+    if not text:
+        return 0
+    cjk_count = len(_CJK_RE.findall(text))
+    rest = _CJK_RE.sub(' ', text)
+    word_tokens = 0.0
+    punctuation = 0
+    for piece in _WORD_RE.findall(rest):
+        if piece.isalnum():
+            word_tokens += max(TOKENS_PER_WORD, len(piece) / CHARS_PER_TOKEN)
+        else:
+            punctuation += 1
+    return cjk_count + punctuation + math.ceil(word_tokens)
+
+
+def estimate_messages_tokens(messages: List[Dict[str, Any]]) -> int:
+    """估算一组 chat messages 的 token 数"""
+    total = 0
+    for m in messages:
+        content = m.get('content', '')
+        total += MESSAGE_TOKEN_OVERHEAD + estimate_tokens(content if isinstance(content, str) else str(content))
+    return total
+
+
+def truncate_to_tokens(text: str, max_tokens: int, keep: str = 'tail') -> str:
+    """把文本截断到大约 max_tokens 个token；keep='tail' 保留末尾（最新）部分"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return ''
+    words = text.split()
+    if len(words) <= 1:
+        # 没有空格分隔（例如整段中文），按字符截断
+        return text[-max_tokens:] if keep == 'tail' else text[:max_tokens]
+    if keep == 'tail':
+        kept: List[str] = []
+        for w in reversed(words):
+            kept.insert(0, w)
+            if estimate_tokens(' '.join(kept)) > max_tokens:
+                kept.pop(0)
+                break
+        return ' '.join(kept)
+    kept = []
+    for w in words:
+        kept.append(w)
+        if estimate_tokens(' '.join(kept)) > max_tokens:
+            kept.pop()
+            break
+    return ' '.join(kept)
+
+
+class _SessionContext:
+    """单个会话的上下文状态"""
+
+    def __init__(self):
+        self.summary = ''
+        self.summarized_turns = 0  # 已经折叠进摘要的轮数
+        self.compacting = False
+        self.last_active = time.monotonic()  # 最后一次 append_turn 的时间，evict_idle 按它淘汰
+
+
+class ConversationContextManager:
+    """
+    维护每个会话的原始历史 + 滚动摘要，并在 token 预算内组装 prompt。
+    summarizer(previous_summary, turns) -> new_summary 由调用方提供（通常调用LLM），
+    失败时使用本地的抽取式摘要兜底。
+    """
+
+    def __init__(self, summarizer: Optional[Callable[[str, List[Dict[str, str]]], str]] = None,
+                 token_budget: Optional[int] = None,
+                 keep_recent_turns: Optional[int] = None,
+                 summary_max_tokens: Optional[int] = None,
+                 compaction_batch: Optional[int] = None,
+                 background: bool = True):
+        self.summarizer = summarizer
+        # prompt 预算（不含回复的 max_tokens）
+        self.token_budget = token_budget or int(os.getenv('CONVERSATION_PROMPT_TOKEN_BUDGET', 1500))
+        # 保留多少轮原始对话，不折叠进摘要
+        self.keep_recent_turns = keep_recent_turns or int(os.getenv('CONVERSATION_KEEP_RECENT_TURNS', 4))
+        self.summary_max_tokens = summary_max_tokens or int(os.getenv('CONVERSATION_SUMMARY_MAX_TOKENS', 200))
+        # 超出保留轮数多少轮后才触发一次折叠，避免每轮都调用摘要
+        self.compaction_batch = compaction_batch or int(os.getenv('CONVERSATION_COMPACTION_BATCH', 2))
+        self.background = background
+
+        self.histories: Dict[str, List[Dict[str, str]]] = {}
+        self._sessions: Dict[str, _SessionContext] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='conv-summary') if background else None
+
+    # ------------------------------------------------------------------
+    #  历史与摘要
+    # ------------------------------------------------------------------
+    def get_history(self, session_id: str) -> List[Dict[str, str]]:
+        with self._lock:
+            return list(self.histories.get(session_id, []))
+
+    def get_summary(self, session_id: str) -> str:
+        with self._lock:
+            state = self._sessions.get(session_id)
+            return state.summary if state else ''
+
+    def append_turn(self, session_id: str, user_message: str, assistant_message: str):
+        """记录一轮对话，并在需要时触发后台摘要折叠"""
+        if not session_id:
+            return
+        with self._lock:
+            self.histories.setdefault(session_id, []).append({'user': user_message, 'assistant': assistant_message})
+            self._sessions.setdefault(session_id, _SessionContext()).last_active = time.monotonic()
+            needs_compaction = self._needs_compaction(session_id)
+        if needs_compaction:
+            self._schedule_compaction(session_id)
+
+    def clear(self, session_id: str):
+        with self._lock:
+            self.histories.pop(session_id, None)
+            self._sessions.pop(session_id, None)
+
+    def evict_idle(self, max_idle_seconds: float) -> int:
+        """丢弃超过 max_idle_seconds 没有新对话的会话的历史和摘要（正在折叠的跳过），返回丢弃的会话数"""
+        cutoff = time.monotonic() - max_idle_seconds
+        with self._lock:
+            idle = [sid for sid, state in self._sessions.items()
+                    if state.last_active < cutoff and not state.compacting]
+            for sid in idle:
+                self.histories.pop(sid, None)
+                self._sessions.pop(sid, None)
+        return len(idle)
+
+    def _needs_compaction(self, session_id: str) -> bool:
+        history = self.histories.get(session_id, [])
+        return len(history) >= self.keep_recent_turns + self.compaction_batch
+
+    def _schedule_compaction(self, session_id: str):
+        with self._lock:
+            state = self._sessions.get(session_id)
+            if state is None or state.compacting:
+                return
+            state.compacting = True
+        if self._executor:
+            self._executor.submit(self._compact, session_id, state)
+        else:
+            self._compact(session_id, state)
+
+    def _compact(self, session_id: str, state: _SessionContext):
+        """把较早的对话折叠进摘要。在后台线程执行，对同一会话串行。"""
+        try:
+            while True:
+                with self._lock:
+                    # 会话在此期间被清除则放弃
+                    if self._sessions.get(session_id) is not state or not self._needs_compaction(session_id):
+                        return
+                    history = self.histories[session_id]
+                    fold_count = len(history) - self.keep_recent_turns
+                    turns_to_fold = history[:fold_count]
+                    previous_summary = state.summary
+
+                new_summary = self._summarize(previous_summary, turns_to_fold)
+
+                with self._lock:
+                    if self._sessions.get(session_id) is not state:
+                        return
+                    state.summary = new_summary
+                    state.summarized_turns += fold_count
+                    # 只有 append 会修改历史的尾部，所以头部这 fold_count 轮仍然是刚才折叠的那些
+                    del self.histories[session_id][:fold_count]
+        except Exception as e:
+            print(f"Error compacting conversation context for {session_id}: {e}")
+        finally:
+            with self._lock:
+                state.compacting = False
+
+    def _summarize(self, previous_summary: str, turns: List[Dict[str, str]]) -> str:
+        summary = ''
+        if self.summarizer:
+            try:
+                summary = self.summarizer(previous_summary, turns) or ''
+            except Exception as e:
+                print(f"Error in conversation summarizer, using local fallback: {e}")
+        if not summary.strip():
+            summary = self._summarize_fallback(previous_summary, turns)
+        return truncate_to_tokens(summary.strip(), self.summary_max_tokens)
+
+    def _summarize_fallback(self, previous_summary: str, turns: List[Dict[str, str]]) -> str:
+        """本地抽取式摘要：保留每轮的开头部分，超出长度时丢弃最旧的内容"""
+        lines = [previous_summary] if previous_summary else []
+        for t in turns:
+            user_part = truncate_to_tokens(t.get('user', ''), 25, keep='head')
+            assistant_part = truncate_to_tokens(t.get('assistant', ''), 25, keep='head')
+            lines.append(f"User: {user_part} / Assistant: {assistant_part}")
+        return ' '.join(lines)
+
+    # ------------------------------------------------------------------
+    #  prompt 组装
+    # ------------------------------------------------------------------
+    def build_messages(self, system_prompt: str, user_message: str,
+                       history: List[Dict[str, str]], summary: str = '') -> List[Dict[str, str]]:
+        """
+        在 token 预算内组装 messages:
+        system(+摘要) 和当前用户消息总是保留，然后从最新的一轮开始尽量多地加入历史。
+        两者合起来仍超出预算时先压缩摘要，再从开头截断当前消息。
+        """
+        system_content = system_prompt.strip()
+        if summary:
+            system_content += f"\n\nSummary of the earlier conversation:\n{summary}"
+
+        fixed = [{"role": "system", "content": system_content}, {"role": "user", "content": user_message}]
+        used = estimate_messages_tokens(fixed)
+        if used > self.token_budget and summary:
+            # 预算紧张时先压缩摘要
+            remaining = max(0, self.summary_max_tokens - (used - self.token_budget))
+            system_content = system_prompt.strip()
+            if remaining:
+                system_content += f"\n\nSummary of the earlier conversation:\n{truncate_to_tokens(summary, remaining)}"
+            fixed[0]["content"] = system_content
+            used = estimate_messages_tokens(fixed)
+        if used > self.token_budget:
+            # 摘要压缩后仍然超出时截断当前消息，保留末尾（通常是真正的问题）
+            available = self.token_budget - estimate_messages_tokens([fixed[0], {"role": "user", "content": ''}])
+            fixed[1]["content"] = truncate_to_tokens(user_message, available, keep='tail')
+            used = estimate_messages_tokens(fixed)
+
+        turns: List[Dict[str, str]] = []
+        for h in reversed(history):
+            pair = [{"role": "assistant", "content": h['assistant']}]
+            if h['user']:  # 开场白只有 assistant 一侧
+                pair.insert(0, {"role": "user", "content": h['user']})
+            cost = estimate_messages_tokens(pair)
+            if used + cost > self.token_budget:
+                break
+            turns = pair + turns
+            used += cost
+
+        return [fixed[0]] + turns + [fixed[1]]
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'sessions': len(self.histories),
+                'buffered_turns': sum(len(h) for h in self.histories.values()),
+                'summarized_turns': sum(s.summarized_turns for s in self._sessions.values()),
+                'token_budget': self.token_budget,
+            }
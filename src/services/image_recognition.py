@@ -17,12 +17,9 @@ except ImportError:
     print("Ultralytics library not found. Please run 'pip install ultralytics opencv-python'")
     YOLO = None
 
-# zhipuai 用于多模态理解和单词定义
-try:
-    from zhipuai import ZhipuAI
-except ImportError:
-    print("ZhipuAI SDK not found. Please run 'pip install zhipuai'")
-    ZhipuAI = None
+# zhipuai 用于多模态理解和单词定义，通过共享的客户端层调用
+from .llm_client import llm_client
+from .rate_limiter import RateLimitExceeded
 
 
 class ImageRecognitionService:
@@ -34,14 +31,8 @@ class ImageRecognitionService:
     """
     
     def __init__(self):
-        # 配置API密钥
-        #self.zhipu_api_key = os.getenv('ZHIPU_API_KEY', "482802cba1a144518285e3fb10068f4d.9drwfXmNcnr25cIe")
-        self.zhipu_api_key="482802cba1a144518285e3fb10068f4d.9drwfXmNcnr25cIe"
-        # --- 智普AI客户端初始化 ---
-        self.zhipu_client = None
-        if self.zhipu_api_key and ZhipuAI:
-            self.zhipu_client = ZhipuAI(api_key=self.zhipu_api_key)
-            print("ZhipuAI client initialized.")
+        # --- 智普AI客户端（进程内共享，密钥和连接池在 llm_client 中配置） ---
+        self.zhipu_client = llm_client if llm_client.available else None
 
         # --- YOLOv8模型初始化 ---
         self.yolo_model = None
@@ -78,7 +69,10 @@ class ImageRecognitionService:
             Your response MUST be only the valid JSON object, without any surrounding text or markdown formatting.
             """
             
-            response = self.zhipu_client.chat.completions.create(
+            response = self.zhipu_client.chat_completion(
+                'image.understand',
+                priority='image',
+                coalesce=True,  # 同一时刻相同的请求只调用一次上游
                 model="glm-4v-flash", 
                 messages=[
                     {
@@ -109,6 +103,8 @@ class ImageRecognitionService:
                 print(f"GLM-4V: Failed to decode JSON. Content: {content}")
                 return {'description': content, 'objects': [], 'scene': 'unknown', 'mood': 'neutral'}
 
+        except RateLimitExceeded:
+            raise
         except Exception as e:
             print(f"Error in GLM-4V image understanding: {e}")
             return self._get_fallback_understanding()
@@ -164,7 +160,10 @@ class ImageRecognitionService:
             print("ZhipuAI client is not available. Using fallback for word definition.")
             return self._get_fallback_word_info(word)
         try:
-            response = self.zhipu_client.chat.completions.create(
+            response = self.zhipu_client.chat_completion(
+                'image.word_definition',
+                priority='image',
+                coalesce=True,  # 同一时刻相同的请求只调用一次上游
                 model="glm-4-flash-250414",
                 messages=[{
                     "role": "user",
@@ -183,6 +182,8 @@ class ImageRecognitionService:
                 print("ZhipuAI: No content received for word definition")
                 return self._get_fallback_word_info(word)
             return json.loads(content)
+        except RateLimitExceeded:
+            raise
         except Exception as e:
             print(f"Error generating word definition with ZhipuAI: {e}")
             return self._get_fallback_word_info(word)
@@ -17,12 +17,10 @@ except ImportError:
     print("Ultralytics library not found. Please run 'pip install ultralytics opencv-python'")
     YOLO = None
 
-# zhipuai 用于多模态理解和单词定义
-try:
-    from zhipuai import ZhipuAI
-except ImportError:
-    print("ZhipuAI SDK not found. Please run 'pip install zhipuai'")
-    ZhipuAI = None
+# zhipuai 用于多模态理解和单词定义，通过共享的客户端层调用
+from .llm_client import llm_client
+from .rate_limiter import RateLimitExceeded
+from .llm_metrics import llm_metrics
 
 
 class ImageRecognitionService:
@@ -34,13 +32,8 @@ class ImageRecognitionService:
     """
     
     def __init__(self):
-        # 配置API密钥
-        self.zhipu_api_key="482802cba1a144518285e3fb10068f4d.9drwfXmNcnr25cIe"
-        # --- 智普AI客户端初始化 ---
-        self.zhipu_client = None
-        if self.zhipu_api_key and ZhipuAI:
-            self.zhipu_client = ZhipuAI(api_key=self.zhipu_api_key)
-            print("ZhipuAI client initialized.")
+        # --- 智普AI客户端（进程内共享，密钥和连接池在 llm_client 中配置） ---
+        self.zhipu_client = llm_client if llm_client.available else None
 
         # --- YOLOv8模型初始化 ---
         self.yolo_model = None
@@ -61,6 +54,7 @@ class ImageRecognitionService:
         """使用智普AI GLM-4V进行图片理解，并要求返回JSON"""
         if not self.zhipu_client:
             print("ZhipuAI client is not available. Using fallback understanding.")
+            llm_metrics.record_fallback('image.understand', 'no_client')
             return self._get_fallback_understanding()
 
         try:
@@ -77,7 +71,10 @@ class ImageRecognitionService:
             Your response MUST be only the valid JSON object, without any surrounding text or markdown formatting.
             """
             
-            response = self.zhipu_client.chat.completions.create(
+            response = self.zhipu_client.chat_completion(
+                'image.understand',
+                priority='image',
+                coalesce=True,  # 同一时刻相同的请求只调用一次上游
                 model="glm-4v-flash", 
                 messages=[
                     {
@@ -97,19 +94,26 @@ class ImageRecognitionService:
                 content = getattr(response, 'choices', [{}])[0].message.content if hasattr(response, 'choices') else None
             except (AttributeError, IndexError):
                 print("GLM-4V: Streaming response received, using fallback")
+                llm_metrics.record_fallback('image.understand', 'empty')
                 return self._get_fallback_understanding()
             if not content:
                 print("GLM-4V: No content received")
+                llm_metrics.record_fallback('image.understand', 'empty')
                 return self._get_fallback_understanding()
             try:
                 cleaned_content = content.strip().lstrip("```json").rstrip("```").strip()
                 return json.loads(cleaned_content)
             except json.JSONDecodeError:
                 print(f"GLM-4V: Failed to decode JSON. Content: {content}")
+                llm_metrics.record_json_parse_failure('image.understand')
+                llm_metrics.record_fallback('image.understand', 'json_parse')
                 return {'description': content, 'objects': [], 'scene': 'unknown', 'mood': 'neutral'}
 
+        except RateLimitExceeded:
+            raise
         except Exception as e:
             print(f"Error in GLM-4V image understanding: {e}")
+            llm_metrics.record_fallback('image.understand', 'error')
             return self._get_fallback_understanding()
 
     def segment_objects_yolo(self, image_path: str, upload_folder: str) -> List[Dict[str, Any]]:
@@ -167,12 +171,16 @@ class ImageRecognitionService:
     def _identify_single_object_glm4v(self, image_path: str) -> str:
         """使用GLM-4V识别单个裁剪后的图片中的物体名称"""
         if not self.zhipu_client:
+            llm_metrics.record_fallback('image.identify_object', 'no_client')
             return "unknown"
         try:
             base64_image = self.encode_image_to_base64(image_path)
             prompt = "What is the single, primary object in this image? Respond with ONLY a single word or short phrase, without any extra text."
             
-            response = self.zhipu_client.chat.completions.create(
+            response = self.zhipu_client.chat_completion(
+                'image.identify_object',
+                priority='image',
+                coalesce=True,  # 同一时刻相同的请求只调用一次上游
                 model="glm-4v-flash",
                 messages=[
                     {
@@ -188,10 +196,15 @@ class ImageRecognitionService:
                 stream=False
             )
             content = getattr(response, 'choices', [{}])[0].message.content if hasattr(response, 'choices') else None
-            object_name = content.strip().lower() if content else "unknown"
-            return object_name
+            if not content or not content.strip():
+                llm_metrics.record_fallback('image.identify_object', 'empty')
+                return "unknown"
+            return content.strip().lower()
+        except RateLimitExceeded:
+            raise
         except Exception as e:
             print(f"Error identifying single object with GLM-4V: {e}")
+            llm_metrics.record_fallback('image.identify_object', 'error')
             return "unknown"
 
     # --- 新增主方法: 结合YOLO分割和GLM-4V识别 (更新版) ---
@@ -238,9 +251,13 @@ class ImageRecognitionService:
     def generate_word_definition_zhipu(self, word: str) -> Dict[str, Any]:
         if not self.zhipu_client:
             print("ZhipuAI client is not available. Using fallback for word definition.")
+            llm_metrics.record_fallback('image.word_definition', 'no_client')
             return self._get_fallback_word_info(word)
         try:
-            response = self.zhipu_client.chat.completions.create(
+            response = self.zhipu_client.chat_completion(
+                'image.word_definition',
+                priority='image',
+                coalesce=True,  # 同一时刻相同的请求只调用一次上游
                 model="glm-4-flash-250414",
                 messages=[{
                     "role": "user",
@@ -254,13 +271,24 @@ class ImageRecognitionService:
                 content = getattr(response, 'choices', [{}])[0].message.content if hasattr(response, 'choices') else None
             except (AttributeError, IndexError):
                 print("ZhipuAI: Streaming response received, using fallback")
+                llm_metrics.record_fallback('image.word_definition', 'empty')
                 return self._get_fallback_word_info(word)
             if not content:
                 print("ZhipuAI: No content received for word definition")
+                llm_metrics.record_fallback('image.word_definition', 'empty')
+                return self._get_fallback_word_info(word)
+            try:
+                return json.loads(content)
+            except json.JSONDecodeError:
+                print(f"ZhipuAI: Failed to decode word definition JSON. Content: {content}")
+                llm_metrics.record_json_parse_failure('image.word_definition')
+                llm_metrics.record_fallback('image.word_definition', 'json_parse')
                 return self._get_fallback_word_info(word)
-            return json.loads(content)
+        except RateLimitExceeded:
+            raise
         except Exception as e:
             print(f"Error generating word definition with ZhipuAI: {e}")
+            llm_metrics.record_fallback('image.word_definition', 'error')
             return self._get_fallback_word_info(word)
     
     def _get_fallback_understanding(self) -> Dict[str, Any]:
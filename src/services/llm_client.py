@@ -0,0 +1,426 @@
+# llm_client.py
+
+import os
+import json
+import time
+import random
+import hashlib
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait, TimeoutError as FutureTimeoutError
+from typing import Dict, Any, Optional
+
+import httpx
+
+from .singleflight import SingleFlight
+from .rate_limiter import llm_scheduler
+from .llm_metrics import llm_metrics
+
+# 导入智普AI的官方SDK
+try:
+    from zhipuai import ZhipuAI, APIStatusError, APIConnectionError, APITimeoutError
+except ImportError:
+    print("ZhipuAI SDK not found. Please run 'pip install zhipuai'")
+    ZhipuAI = None
+    APIStatusError = APIConnectionError = APITimeoutError = None
+
+'''
+共享的智普AI出站客户端层。
+以前 ConversationAIService 和 ImageRecognitionService 各自创建 ZhipuAI 客户端，调用时没有显式超时、
+重试策略或并发上限，上游一慢就会无限期占住 gunicorn 线程。现在所有 LLM 调用都经过这里:
+- 共享一个 httpx 连接池 (keep-alive)，整个进程复用 TLS 连接
+- 每次调用有总截止时间 (deadline)，重试也在截止时间内完成
+- 对可重试错误 (超时/连接错误/429/5xx) 做带抖动的指数退避重试
+- 错误率飙升时打开熔断器，快速失败，冷却后半开探测
+- 可选的对冲请求 (hedging)：首个请求超过该调用点 p95 延迟仍未返回时，再发一个相同请求，取先返回者
+- 按调用点 (call site) 记录延迟分布，提供 p50/p95/p99 等尾延迟指标
+- 可选的请求合并 (coalesce)：并发的完全相同请求只发一次上游调用
+- 每次逻辑调用的耗时、模型、token 用量、重试次数和错误类型计入 llm_metrics 聚合器
+'''
+
+
+class LLMUnavailableError(Exception):
+    """LLM 调用失败（熔断打开、并发已满、超过截止时间或重试耗尽）"""
+
+
+class CircuitOpenError(LLMUnavailableError):
+    """熔断器打开，快速失败"""
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    return os.getenv(name, str(default)).lower() in ('1', 'true', 'yes')
+
+
+def _cooperative_io() -> bool:
+    """是否运行在 gevent 协程 worker 中（socket 已被 monkey-patch）"""
+    try:
+        from gevent import monkey
+        return monkey.is_module_patched('socket')
+    except ImportError:
+        return False
+
+
+def _percentile(sorted_values, pct: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class CircuitBreaker:
+    """基于滑动时间窗口错误率的熔断器: closed -> open -> half_open -> closed"""
+
+    def __init__(self, failure_ratio: float = 0.5, min_requests: int = 10,
+                 window_seconds: float = 30.0, cooldown_seconds: float = 30.0):
+        self.failure_ratio = failure_ratio
+        self.min_requests = min_requests
+        self.window_seconds = window_seconds
+        self.cooldown_seconds = cooldown_seconds
+        self.state = 'closed'
+        self.opened_at = 0.0
+        self.open_count = 0
+        self._outcomes = deque()  # (timestamp, ok)
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.cooldown_seconds:
+                self.state = 'half_open'
+                self._probe_in_flight = False
+            if self.state == 'half_open' and not self._probe_in_flight:
+                # 半开状态只放行一个探测请求
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def release_probe(self):
+        """拿到许可后没有真正发出请求（排队被拒、没有并发槽位）时调用: 不记录结果，半开状态的探测许可交还给下一个请求"""
+        with self._lock:
+            if self.state == 'half_open':
+                self._probe_in_flight = False
+
+    def record(self, ok: bool):
+        now = time.monotonic()
+        with self._lock:
+            if self.state == 'half_open':
+                self._probe_in_flight = False
+                if ok:
+                    self.state = 'closed'
+                    self._outcomes.clear()
+                else:
+                    self._open(now)
+                return
+            self._outcomes.append((now, ok))
+            while self._outcomes and now - self._outcomes[0][0] > self.window_seconds:
+                self._outcomes.popleft()
+            total = len(self._outcomes)
+            failures = sum(1 for _, success in self._outcomes if not success)
+            if self.state == 'closed' and total >= self.min_requests and failures / total >= self.failure_ratio:
+                self._open(now)
+
+    def _open(self, now: float):
+        self.state = 'open'
+        self.opened_at = now
+        self.open_count += 1
+        self._outcomes.clear()
+        print(f"LLM circuit breaker opened (cooldown {self.cooldown_seconds}s)")
+
+
+class LatencyTracker:
+    """按调用点记录最近的延迟样本和计数"""
+
+    def __init__(self, max_samples: int = 1000):
+        self.max_samples = max_samples
+        self._sites: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def _site(self, call_site: str) -> Dict[str, Any]:
+        site = self._sites.get(call_site)
+        if site is None:
+            site = {'samples': deque(maxlen=self.max_samples), 'calls': 0, 'errors': 0,
+                    'retries': 0, 'hedges': 0, 'hedge_wins': 0}
+            self._sites[call_site] = site
+        return site
+
+    def record(self, call_site: str, duration: float, ok: bool):
+        with self._lock:
+            site = self._site(call_site)
+            site['calls'] += 1
+            if ok:
+                site['samples'].append(duration)
+            else:
+                site['errors'] += 1
+
+    def incr(self, call_site: str, key: str, amount: int = 1):
+        with self._lock:
+            self._site(call_site)[key] += amount
+
+    def percentile(self, call_site: str, pct: float, min_samples: int = 20) -> Optional[float]:
+        with self._lock:
+            site = self._sites.get(call_site)
+            if not site or len(site['samples']) < min_samples:
+                return None
+            return _percentile(sorted(site['samples']), pct)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            result = {}
+            for name, site in self._sites.items():
+                samples = sorted(site['samples'])
+                result[name] = {
+                    'calls': site['calls'],
+                    'errors': site['errors'],
+                    'retries': site['retries'],
+                    'hedges': site['hedges'],
+                    'hedge_wins': site['hedge_wins'],
+                    'p50_ms': round(_percentile(samples, 50) * 1000, 1) if samples else None,
+                    'p95_ms': round(_percentile(samples, 95) * 1000, 1) if samples else None,
+                    'p99_ms': round(_percentile(samples, 99) * 1000, 1) if samples else None,
+                    'max_ms': round(samples[-1] * 1000, 1) if samples else None,
+                }
+            return result
+
+
+class LLMClient:
+    """
+    进程内共享的智普AI客户端。用法:
+        response = llm_client.chat_completion('conversation.reply', model=..., messages=..., max_tokens=...)
+    返回值与 ZhipuAI 的 chat.completions.create 相同。
+    """
+
+    def __init__(self):
+        self.api_key = os.getenv('ZHIPU_API_KEY')  # 未设置时 client 为 None，各服务走各自的备用逻辑
+        self.base_url = os.getenv('ZHIPU_BASE_URL') or None  # None 时使用SDK默认地址
+
+        # 超时与重试
+        self.timeout = float(os.getenv('LLM_TIMEOUT_SECONDS', 30))              # 单次调用总截止时间
+        self.connect_timeout = float(os.getenv('LLM_CONNECT_TIMEOUT_SECONDS', 5))
+        self.max_retries = int(os.getenv('LLM_MAX_RETRIES', 2))
+        self.backoff_base = float(os.getenv('LLM_BACKOFF_BASE_SECONDS', 0.5))
+        self.backoff_max = float(os.getenv('LLM_BACKOFF_MAX_SECONDS', 4))
+
+        # 连接池与并发。gevent worker 中一个进程可以同时挂起数百个 LLM 调用，默认值相应放大
+        cooperative = _cooperative_io()
+        self.max_connections = int(os.getenv('LLM_POOL_MAX_CONNECTIONS', 400 if cooperative else 20))
+        self.max_keepalive = int(os.getenv('LLM_POOL_MAX_KEEPALIVE', 100 if cooperative else 10))
+        self.keepalive_expiry = float(os.getenv('LLM_POOL_KEEPALIVE_EXPIRY', 60))
+        self.max_concurrency = int(os.getenv('LLM_MAX_CONCURRENCY', 400 if cooperative else 16))
+
+        # 对冲请求
+        self.hedge_enabled = _env_bool('LLM_HEDGE_ENABLED', False)
+        self.hedge_percentile = float(os.getenv('LLM_HEDGE_PERCENTILE', 95))
+        self.hedge_min_delay = float(os.getenv('LLM_HEDGE_MIN_DELAY_SECONDS', 1.0))
+
+        self.breaker = CircuitBreaker(
+            failure_ratio=float(os.getenv('LLM_BREAKER_FAILURE_RATIO', 0.5)),
+            min_requests=int(os.getenv('LLM_BREAKER_MIN_REQUESTS', 10)),
+            window_seconds=float(os.getenv('LLM_BREAKER_WINDOW_SECONDS', 30)),
+            cooldown_seconds=float(os.getenv('LLM_BREAKER_COOLDOWN_SECONDS', 30)),
+        )
+        self.latency = LatencyTracker()
+        self.singleflight = SingleFlight()
+        self._semaphore = threading.BoundedSemaphore(self.max_concurrency)
+        self._hedge_executor = None
+
+        self.client = None
+        if self.api_key and ZhipuAI:
+            try:
+                http_client = httpx.Client(
+                    limits=httpx.Limits(max_connections=self.max_connections,
+                                        max_keepalive_connections=self.max_keepalive,
+                                        keepalive_expiry=self.keepalive_expiry),
+                    timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+                )
+                # 重试由本层负责，关闭SDK内部的重试
+                self.client = ZhipuAI(api_key=self.api_key, base_url=self.base_url,
+                                      timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+                                      max_retries=0, http_client=http_client)
+            except Exception as e:
+                print(f"Failed to initialize ZhipuAI client: {e}")
+        elif not self.api_key:
+            print("ZHIPU_API_KEY is not set, LLM features will use their fallbacks")
+
+    @property
+    def available(self) -> bool:
+        return self.client is not None
+
+    def chat_completion(self, call_site: str, timeout: Optional[float] = None,
+                        hedge: Optional[bool] = None, coalesce: bool = False,
+                        priority: str = 'interactive', **kwargs):
+        """
+        带截止时间、重试、熔断和可选对冲的 chat.completions.create。
+        coalesce=True 时，与正在进行中的完全相同的请求（同一调用点、同样参数）合并为一次上游调用，
+        只适合结果与调用者无关的请求（单词释义、图片识别等）。
+        priority 为限流优先级 (interactive / image / background)，额度用尽时抛出 RateLimitExceeded。
+        """
+        if not self.client:
+            raise LLMUnavailableError('ZhipuAI client is not available')
+        if coalesce:
+            key = (call_site, self._request_fingerprint(kwargs))
+            return self.singleflight.do(key, lambda: self._instrumented(call_site, timeout, hedge, priority, kwargs),
+                                        group=call_site)
+        return self._instrumented(call_site, timeout, hedge, priority, kwargs)
+
+    def _instrumented(self, call_site: str, timeout: Optional[float], hedge: Optional[bool],
+                      priority: str, kwargs: Dict[str, Any]):
+        """一次逻辑调用（含排队、重试）的耗时、token 用量和错误计入 llm_metrics"""
+        start = time.monotonic()
+        attempts = [0]
+        try:
+            response = self._chat_completion(call_site, timeout, hedge, priority, kwargs, attempts)
+        except Exception as e:
+            llm_metrics.record_call(call_site, time.monotonic() - start, model=kwargs.get('model'),
+                                    attempts=attempts[0], error=e)
+            raise
+        llm_metrics.record_call(call_site, time.monotonic() - start, model=kwargs.get('model'),
+                                response=response, attempts=attempts[0])
+        return response
+
+    @staticmethod
+    def _request_fingerprint(kwargs: Dict[str, Any]) -> str:
+        payload = json.dumps(kwargs, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _chat_completion(self, call_site: str, timeout: Optional[float], hedge: Optional[bool],
+                         priority: str, kwargs: Dict[str, Any], attempts: Optional[list] = None):
+        deadline = time.monotonic() + (timeout or self.timeout)
+        attempt = 0
+        while True:
+            # 先检查截止时间再向熔断器要许可: 半开状态下拿到探测许可后不能不记录结果就退出
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise LLMUnavailableError(f'LLM call {call_site} exceeded its deadline')
+            if not self.breaker.allow_request():
+                raise CircuitOpenError('LLM circuit breaker is open')
+
+            # 先按优先级排队领取 API Key 的令牌，再占用并发槽位，避免排队的请求占着槽位
+            try:
+                llm_scheduler.acquire(priority, timeout=remaining)
+                if not self._semaphore.acquire(timeout=max(0.0, deadline - time.monotonic())):
+                    raise LLMUnavailableError(f'LLM concurrency limit reached ({self.max_concurrency})')
+            except BaseException:
+                # 请求没有发出，不计入熔断器
+                self.breaker.release_probe()
+                raise
+            start = time.monotonic()
+            if attempts is not None:
+                attempts[0] += 1
+            try:
+                response = self._attempt(call_site, deadline - start, hedge, priority, kwargs)
+            except Exception as e:
+                self.latency.record(call_site, time.monotonic() - start, ok=False)
+                retryable = self._is_retryable(e)
+                self.breaker.record(ok=not retryable)
+                if not retryable or attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                self.latency.incr(call_site, 'retries')
+                # 带抖动的指数退避 (full jitter)，但不超过剩余时间
+                backoff = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+                backoff = min(backoff, max(0.0, deadline - time.monotonic()))
+                print(f"LLM call {call_site} failed ({e}); retry {attempt}/{self.max_retries} in {backoff:.2f}s")
+                time.sleep(backoff)
+                continue
+            finally:
+                self._semaphore.release()
+
+            self.latency.record(call_site, time.monotonic() - start, ok=True)
+            self.breaker.record(ok=True)
+            return response
+
+    def _attempt(self, call_site: str, remaining: float, hedge: Optional[bool], priority: str,
+                 kwargs: Dict[str, Any]):
+        use_hedge = self.hedge_enabled if hedge is None else hedge
+        hedge_delay = None
+        if use_hedge:
+            p = self.latency.percentile(call_site, self.hedge_percentile)
+            if p is not None:
+                hedge_delay = max(self.hedge_min_delay, p)
+        if hedge_delay is None or hedge_delay >= remaining:
+            return self.client.chat.completions.create(timeout=remaining, **kwargs)
+        return self._hedged_attempt(call_site, remaining, hedge_delay, priority, kwargs)
+
+    def _hedged_attempt(self, call_site: str, remaining: float, hedge_delay: float, priority: str,
+                        kwargs: Dict[str, Any]):
+        """首个请求超过 hedge_delay 仍未完成时发出第二个请求，返回最先成功的结果"""
+        if self._hedge_executor is None:
+            self._hedge_executor = ThreadPoolExecutor(max_workers=self.max_concurrency * 2,
+                                                      thread_name_prefix='llm-hedge')
+        start = time.monotonic()
+        primary = self._hedge_executor.submit(self.client.chat.completions.create, timeout=remaining, **kwargs)
+        done, _ = wait([primary], timeout=hedge_delay)
+        if done:
+            return primary.result()
+        if not llm_scheduler.try_acquire(priority):
+            # 对冲请求不排队：额度紧张时只等待首个请求
+            try:
+                return primary.result(timeout=max(0.0, remaining - (time.monotonic() - start)))
+            except FutureTimeoutError:
+                raise self._timeout_error()
+
+        self.latency.incr(call_site, 'hedges')
+        hedge_remaining = max(0.1, remaining - (time.monotonic() - start))
+        secondary = self._hedge_executor.submit(self.client.chat.completions.create, timeout=hedge_remaining, **kwargs)
+        pending = {primary, secondary}
+        last_error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, remaining - (time.monotonic() - start)),
+                                 return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    if future is secondary:
+                        self.latency.incr(call_site, 'hedge_wins')
+                    for other in pending:
+                        other.cancel()
+                    return future.result()
+                last_error = future.exception()
+        if last_error:
+            raise last_error
+        raise self._timeout_error()
+
+    def _timeout_error(self) -> Exception:
+        """
+        对冲路径等到截止时间仍没有结果时抛出的异常，和非对冲路径里 SDK 超时抛出的 APITimeoutError 相同，
+        重试、熔断和 llm_metrics 的错误类型按同样的方式计数
+        """
+        url = httpx.URL(self.base_url.rstrip('/') + '/').join('chat/completions') if self.base_url else 'chat/completions'
+        request = httpx.Request('POST', url)
+        if APITimeoutError is not None:
+            return APITimeoutError(request=request)
+        return httpx.ReadTimeout('LLM request timed out', request=request)
+
+    @staticmethod
+    def _is_retryable(error: Exception) -> bool:
+        if isinstance(error, (httpx.TimeoutException, httpx.TransportError)):
+            return True
+        if APIConnectionError is not None and isinstance(error, APIConnectionError):
+            return True
+        if APIStatusError is not None and isinstance(error, APIStatusError):
+            return error.status_code == 429 or error.status_code >= 500
+        return False
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'available': self.available,
+            'circuit_breaker': {'state': self.breaker.state, 'open_count': self.breaker.open_count},
+            'config': {
+                'timeout_seconds': self.timeout,
+                'max_retries': self.max_retries,
+                'max_concurrency': self.max_concurrency,
+                'pool_max_connections': self.max_connections,
+                'cooperative_io': _cooperative_io(),
+                'hedge_enabled': self.hedge_enabled,
+            },
+            'call_sites': self.latency.snapshot(),
+            'coalescing': self.singleflight.get_stats(),
+            'rate_limiter': llm_scheduler.get_stats(),
+        }
+
+
+# 创建全局实例
+llm_client = LLMClient()
@@ -0,0 +1,156 @@
+# llm_metrics.py
+
+import os
+import json
+import time
+import threading
+from bisect import bisect_left
+from typing import Dict, Any, Optional, Tuple
+
+'''
+LLM 调用的结构化埋点。
+每次逻辑调用（含重试）记录: 耗时、模型、prompt/completion token 数（取自响应的 usage）、尝试次数、错误类型；
+业务层再补充 JSON 解析失败和使用备用结果 (fallback) 的次数。
+数据进入进程内的聚合器（按调用点分桶的直方图），通过 GET /api/metrics/llm/calls 查看，
+用来判断哪个环节吃掉了延迟预算。
+
+慢调用 / 全部调用可以按一行 JSON 打印到日志: LLM_CALL_LOG=slow|all|off
+'''
+
+# 直方图分桶上界（毫秒 / token 数），最后隐含一个 +Inf 桶
+DURATION_BUCKETS_MS: Tuple[float, ...] = (100, 250, 500, 1000, 2000, 4000, 8000, 15000, 30000, 60000)
+TOKEN_BUCKETS: Tuple[int, ...] = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+
+class Histogram:
+    """固定分桶的累计直方图（不保存原始样本，内存恒定）"""
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """用所在桶的上界估算分位数（落在 +Inf 桶时返回最后一个上界）"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return self.bounds[min(i, len(self.bounds) - 1)]
+        return self.bounds[-1]
+
+    def snapshot(self) -> Dict[str, Any]:
+        # [上界, 计数] 列表（jsonify 会对 dict 的键排序，列表可以保持桶的顺序）
+        labels = list(self.bounds) + ['inf']
+        return {
+            'count': self.count,
+            'sum': round(self.total, 1),
+            'avg': round(self.total / self.count, 1) if self.count else None,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'buckets': [[label, c] for label, c in zip(labels, self.counts)],
+        }
+
+
+class _CallSiteMetrics:
+    def __init__(self):
+        self.calls = 0
+        self.errors: Dict[str, int] = {}
+        self.retries = 0
+        self.models: Dict[str, int] = {}
+        self.duration_ms = Histogram(DURATION_BUCKETS_MS)
+        self.prompt_tokens = Histogram(TOKEN_BUCKETS)
+        self.completion_tokens = Histogram(TOKEN_BUCKETS)
+        self.json_parse_failures = 0
+        self.fallbacks: Dict[str, int] = {}
+
+
+class LLMMetrics:
+    """按调用点聚合 LLM 调用指标"""
+
+    def __init__(self, log_mode: Optional[str] = None, slow_call_seconds: Optional[float] = None):
+        self.log_mode = (log_mode or os.getenv('LLM_CALL_LOG', 'slow')).lower()
+        self.slow_call_seconds = slow_call_seconds or float(os.getenv('LLM_SLOW_CALL_SECONDS', 5))
+        self._sites: Dict[str, _CallSiteMetrics] = {}
+        self._lock = threading.Lock()
+        self._started_at = time.time()
+
+    def _site(self, call_site: str) -> _CallSiteMetrics:
+        site = self._sites.get(call_site)
+        if site is None:
+            site = _CallSiteMetrics()
+            self._sites[call_site] = site
+        return site
+
+    def record_call(self, call_site: str, duration: float, model: Optional[str] = None,
+                    response: Any = None, attempts: int = 1, error: Optional[Exception] = None):
+        """记录一次逻辑调用（重试合并为一次，attempts 为实际发出的上游请求数）"""
+        usage = getattr(response, 'usage', None) if response is not None else None
+        prompt_tokens = getattr(usage, 'prompt_tokens', None) if usage is not None else None
+        completion_tokens = getattr(usage, 'completion_tokens', None) if usage is not None else None
+        model = getattr(response, 'model', None) or model or 'unknown'
+        error_type = type(error).__name__ if error is not None else None
+
+        with self._lock:
+            site = self._site(call_site)
+            site.calls += 1
+            site.retries += max(0, attempts - 1)
+            site.models[model] = site.models.get(model, 0) + 1
+            site.duration_ms.observe(duration * 1000)
+            if error_type:
+                site.errors[error_type] = site.errors.get(error_type, 0) + 1
+            if prompt_tokens is not None:
+                site.prompt_tokens.observe(prompt_tokens)
+            if completion_tokens is not None:
+                site.completion_tokens.observe(completion_tokens)
+
+        if self.log_mode == 'all' or (self.log_mode == 'slow' and duration >= self.slow_call_seconds):
+            print('LLM_CALL ' + json.dumps({
+                'call_site': call_site, 'duration_ms': round(duration * 1000, 1), 'model': model,
+                'attempts': attempts, 'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                'error': f'{error_type}: {error}' if error_type else None,
+            }, ensure_ascii=False))
+
+    def record_json_parse_failure(self, call_site: str):
+        with self._lock:
+            self._site(call_site).json_parse_failures += 1
+
+    def record_fallback(self, call_site: str, reason: str):
+        """业务层放弃 LLM 结果、改用备用结果时调用；reason 如 no_client / empty / json_parse / error"""
+        with self._lock:
+            site = self._site(call_site)
+            site.fallbacks[reason] = site.fallbacks.get(reason, 0) + 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            total_ms = sum(s.duration_ms.total for s in self._sites.values())
+            sites = {}
+            for name, s in sorted(self._sites.items()):
+                fallbacks = sum(s.fallbacks.values())
+                sites[name] = {
+                    'calls': s.calls,
+                    'errors': dict(s.errors),
+                    'retries': s.retries,
+                    'models': dict(s.models),
+                    'json_parse_failures': s.json_parse_failures,
+                    'fallbacks': dict(s.fallbacks),
+                    'fallback_rate': round(fallbacks / s.calls, 3) if s.calls else None,
+                    # 该调用点占全部 LLM 等待时间的比例
+                    'share_of_llm_time': round(s.duration_ms.total / total_ms, 3) if total_ms else None,
+                    'duration_ms': s.duration_ms.snapshot(),
+                    'prompt_tokens': s.prompt_tokens.snapshot(),
+                    'completion_tokens': s.completion_tokens.snapshot(),
+                }
+            return {'since': int(self._started_at), 'call_sites': sites}
+
+# 创建全局实例
+llm_metrics = LLMMetrics()
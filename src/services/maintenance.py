@@ -0,0 +1,323 @@
+# maintenance.py
+
+import os
+import time
+import threading
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional, Set
+
+from sqlalchemy import text, bindparam, Integer, String, DateTime
+from sqlalchemy.engine import Engine
+
+from ..models import db
+from .session_summary import repair_session_summaries
+from .message_index import rebuild_message_index, delete_session_index
+from .read_cache import read_cache, SESSIONS_CACHE_PREFIX, messages_cache_prefix
+from .message_notifier import message_notifier
+
+'''
+数据保留和清理（后台维护任务）。
+会话、消息、进程内的对话历史（ConversationContextManager.histories）和 src/static/uploads 里的图片都只增不减，
+表、索引和磁盘一直膨胀。这里按可配置的保留策略定期清理:
+
+- RETENTION_SESSION_DAYS:   最后活动（last_message_at，没有消息时为 created_at）早于 N 天的会话连同消息、倒排索引一起删除
+- RETENTION_MESSAGE_DAYS:   早于 N 天的消息（会话保留，消息摘要和倒排索引按剩下的消息修复）
+- RETENTION_HISTORY_IDLE_MINUTES: 进程内超过 N 分钟没有新对话的会话历史（只影响 prompt 里带的上下文）
+- RETENTION_ORPHAN_UPLOADS: 删除没有任何单词（image_path / segmented_image_path）或会话（image_path）引用、
+  且超过 RETENTION_UPLOAD_GRACE_HOURS 小时的上传图片（上传后要过一会儿才会被单词 / 会话引用，宽限期内不删）
+天数为 0 表示永久保留；整个任务默认关闭（MAINTENANCE_ENABLED）。
+
+删除都是小批量的短事务（MAINTENANCE_BATCH_SIZE 行），批之间暂停 MAINTENANCE_BATCH_PAUSE_MS 毫秒，不长时间持有锁。
+会话在删除期间又收到新消息时（最后活动时间变了）不会被删除。
+Postgres 上多个 worker 用 advisory lock 保证同一时间只有一个在删数据库里的数据；进程内历史和本机文件每个 worker 各自清理。
+每次运行后打印一行统计，/api/metrics/maintenance 返回最近一次的统计。
+
+命令行（只清理数据库和文件，--dry-run 只统计不删除）:
+    python -m src.database purge [--dry-run]
+'''
+
+# pg_try_advisory_lock 的键（和迁移的锁不同）
+_ADVISORY_LOCK_KEY = 724180036
+
+DEFAULT_UPLOAD_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static', 'uploads')
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.getenv(name, str(default)))
+
+
+def _with_ids(sql: str):
+    """:ids 是一个列表（IN 展开）"""
+    return text(sql).bindparams(bindparam('ids', expanding=True))
+
+
+class RetentionPolicy:
+    def __init__(self, session_days: Optional[int] = None, message_days: Optional[int] = None,
+                 history_idle_minutes: Optional[int] = None, orphan_uploads: Optional[bool] = None,
+                 upload_grace_hours: Optional[int] = None, upload_dir: Optional[str] = None):
+        self.session_days = session_days if session_days is not None else _env_int('RETENTION_SESSION_DAYS', 0)
+        self.message_days = message_days if message_days is not None else _env_int('RETENTION_MESSAGE_DAYS', 0)
+        self.history_idle_minutes = history_idle_minutes if history_idle_minutes is not None else _env_int(
+            'RETENTION_HISTORY_IDLE_MINUTES', 360)
+        if orphan_uploads is None:
+            orphan_uploads = os.getenv('RETENTION_ORPHAN_UPLOADS', 'false').lower() in ('1', 'true', 'yes')
+        self.orphan_uploads = orphan_uploads
+        self.upload_grace_hours = upload_grace_hours if upload_grace_hours is not None else _env_int(
+            'RETENTION_UPLOAD_GRACE_HOURS', 24)
+        self.upload_dir = upload_dir or os.getenv('RETENTION_UPLOAD_DIR') or DEFAULT_UPLOAD_DIR
+
+    def describe(self) -> Dict[str, Any]:
+        return dict(vars(self))
+
+
+class MaintenanceJob:
+    def __init__(self, enabled: Optional[bool] = None, interval_seconds: Optional[int] = None,
+                 batch_size: Optional[int] = None, batch_pause_ms: Optional[int] = None,
+                 policy: Optional[RetentionPolicy] = None):
+        if enabled is None:
+            enabled = os.getenv('MAINTENANCE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+        self.enabled = enabled
+        self.interval = interval_seconds if interval_seconds is not None else _env_int('MAINTENANCE_INTERVAL_SECONDS', 3600)
+        self.batch_size = batch_size if batch_size is not None else _env_int('MAINTENANCE_BATCH_SIZE', 500)
+        self.batch_pause = (batch_pause_ms if batch_pause_ms is not None
+                            else _env_int('MAINTENANCE_BATCH_PAUSE_MS', 100)) / 1000.0
+        self.policy = policy or RetentionPolicy()
+        self._app = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._run_lock = threading.Lock()
+        self._last_run: Optional[Dict[str, Any]] = None
+        self._runs = 0
+
+    def init_app(self, app):
+        """MAINTENANCE_ENABLED=true 时启动后台线程，每 MAINTENANCE_INTERVAL_SECONDS 秒运行一次"""
+        self._app = app
+        if not self.enabled or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name='maintenance', daemon=True)
+        self._thread.start()
+        print(f"Maintenance job enabled: every {self.interval}s, policy {self.policy.describe()}")
+
+    def _loop(self):
+        # 启动后先等一个周期，不和启动时的迁移、预热抢资源
+        while not self._stop.wait(self.interval):
+            try:
+                with self._app.app_context():
+                    self.run_once(db.engine)
+            except Exception as e:
+                print(f"Maintenance run failed: {e}")
+
+    def stop(self):
+        self._stop.set()
+
+    # ---------- 一次运行 ----------
+
+    def run_once(self, engine: Engine, dry_run: bool = False, in_process: bool = True) -> Dict[str, Any]:
+        """
+        按保留策略清理一次，返回统计。dry_run 时只统计不删除；
+        in_process=False（命令行）时不清理进程内的对话历史和缓存。
+        """
+        with self._run_lock:
+            started = time.monotonic()
+            stats: Dict[str, Any] = {
+                'started_at': datetime.utcnow().isoformat(), 'dry_run': dry_run,
+                'sessions_deleted': 0, 'messages_deleted': 0, 'sessions_repaired': 0,
+                'histories_evicted': 0, 'uploads_deleted': 0, 'upload_bytes_freed': 0,
+                'database': 'skipped', 'errors': []
+            }
+            if in_process and not dry_run and self.policy.history_idle_minutes > 0:
+                stats['histories_evicted'] = self._evict_histories()
+
+            if self.policy.session_days > 0 or self.policy.message_days > 0:
+                try:
+                    stats['database'] = self._purge_database(engine, stats, dry_run, in_process)
+                except Exception as e:
+                    stats['errors'].append(f'database: {e}')
+
+            if self.policy.orphan_uploads:
+                try:
+                    self._collect_orphan_uploads(engine, stats, dry_run)
+                except Exception as e:
+                    stats['errors'].append(f'uploads: {e}')
+
+            stats['duration_ms'] = round((time.monotonic() - started) * 1000, 1)
+            self._last_run = stats
+            self._runs += 1
+            print("Maintenance run: " + ', '.join(f'{k}={v}' for k, v in stats.items() if k != 'started_at'))
+            return stats
+
+    def _evict_histories(self) -> int:
+        from .conversation_ai import conversation_ai_service
+        return conversation_ai_service.context_manager.evict_idle(self.policy.history_idle_minutes * 60)
+
+    def _purge_database(self, engine: Engine, stats: Dict[str, Any], dry_run: bool, in_process: bool) -> str:
+        lock_conn = None
+        if engine.dialect.name == 'postgresql':
+            lock_conn = engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+            if not lock_conn.execute(text('SELECT pg_try_advisory_lock(:key)'), {'key': _ADVISORY_LOCK_KEY}).scalar():
+                lock_conn.close()
+                return 'locked by another worker'
+        try:
+            now = datetime.utcnow()
+            session_cutoff = now - timedelta(days=self.policy.session_days) if self.policy.session_days > 0 else None
+            message_cutoff = now - timedelta(days=self.policy.message_days) if self.policy.message_days > 0 else None
+            if dry_run:
+                self._count_expired(engine, session_cutoff, message_cutoff, stats)
+                return 'done'
+            if session_cutoff is not None:
+                self._purge_sessions(engine, session_cutoff, stats, in_process)
+            if message_cutoff is not None:
+                self._purge_messages(engine, message_cutoff, stats, in_process)
+            return 'done'
+        finally:
+            if lock_conn is not None:
+                lock_conn.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': _ADVISORY_LOCK_KEY})
+                lock_conn.close()
+
+    @staticmethod
+    def _count_expired(engine: Engine, session_cutoff: Optional[datetime], message_cutoff: Optional[datetime],
+                       stats: Dict[str, Any]):
+        """dry run: 只统计会删除的会话、消息和要修复摘要的会话，和实际运行的结果一致"""
+        expired_session = 'COALESCE(s.last_message_at, s.created_at) < :session_cutoff'
+        params = {'session_cutoff': session_cutoff, 'message_cutoff': message_cutoff}
+        with engine.connect() as conn:
+            if session_cutoff is not None:
+                stats['sessions_deleted'] += conn.execute(text(
+                    f'SELECT COUNT(*) FROM conversation_sessions s WHERE {expired_session}'), params).scalar()
+                stats['messages_deleted'] += conn.execute(text(
+                    'SELECT COUNT(*) FROM conversation_messages m JOIN conversation_sessions s '
+                    f'ON s.session_id = m.session_id WHERE {expired_session}'), params).scalar()
+            if message_cutoff is not None:
+                # 所在会话整个被删除的消息上面已经算过
+                keep_session = f'AND NOT ({expired_session})' if session_cutoff is not None else ''
+                messages, sessions = conn.execute(text(
+                    'SELECT COUNT(*), COUNT(DISTINCT m.session_id) FROM conversation_messages m '
+                    'JOIN conversation_sessions s ON s.session_id = m.session_id '
+                    f'WHERE m.timestamp < :message_cutoff {keep_session}'), params).one()
+                stats['messages_deleted'] += messages
+                stats['sessions_repaired'] += sessions
+
+    def _purge_sessions(self, engine: Engine, cutoff: datetime, stats: Dict[str, Any], in_process: bool):
+        select_expired = text('SELECT session_id FROM conversation_sessions '
+                              'WHERE COALESCE(last_message_at, created_at) < :cutoff ORDER BY id LIMIT :n')
+        delete_messages = _with_ids(
+            'DELETE FROM conversation_messages WHERE id IN (SELECT id FROM conversation_messages '
+            'WHERE session_id IN :ids AND (timestamp < :cutoff OR timestamp IS NULL) LIMIT :n)')
+        # 删除消息期间又有新消息的会话（最后活动时间变了）不删
+        delete_sessions = _with_ids(
+            'DELETE FROM conversation_sessions WHERE session_id IN :ids '
+            'AND COALESCE(last_message_at, created_at) < :cutoff RETURNING session_id')
+
+        skipped: Set[str] = set()
+        while True:
+            with engine.begin() as conn:
+                session_ids = [row[0] for row in conn.execute(select_expired,
+                                                               {'cutoff': cutoff, 'n': self.batch_size})]
+            session_ids = [sid for sid in session_ids if sid not in skipped]
+            if not session_ids:
+                return
+            while True:
+                with engine.begin() as conn:
+                    deleted = conn.execute(delete_messages, {'ids': session_ids, 'cutoff': cutoff,
+                                                             'n': self.batch_size}).rowcount or 0
+                stats['messages_deleted'] += deleted
+                if deleted < self.batch_size:
+                    break
+                time.sleep(self.batch_pause)
+            with engine.begin() as conn:
+                deleted_ids = [row[0] for row in conn.execute(delete_sessions,
+                                                               {'ids': session_ids, 'cutoff': cutoff})]
+                delete_session_index(conn, deleted_ids)
+                survivors = [sid for sid in session_ids if sid not in set(deleted_ids)]
+                if survivors:
+                    repair_session_summaries(conn, survivors)
+                    rebuild_message_index(conn, survivors)
+            stats['sessions_deleted'] += len(deleted_ids)
+            stats['sessions_repaired'] += len(survivors)
+            skipped.update(survivors)
+            if in_process:
+                self._after_change(deleted_ids, survivors)
+            time.sleep(self.batch_pause)
+
+    def _purge_messages(self, engine: Engine, cutoff: datetime, stats: Dict[str, Any], in_process: bool):
+        """
+        按 id 顺序走主键（消息表没有单独的 timestamp 索引），删除 timestamp 早于 cutoff 的消息。
+        id 和时间基本同序，遇到一整批都不早于 cutoff 就停止。
+        """
+        select_batch = text('SELECT id, session_id, timestamp FROM conversation_messages '
+                            'WHERE id > :after ORDER BY id LIMIT :n'
+                            ).columns(id=Integer, session_id=String, timestamp=DateTime)
+        delete_batch = _with_ids('DELETE FROM conversation_messages WHERE id IN :ids')
+        after = 0
+        while True:
+            with engine.begin() as conn:
+                rows = conn.execute(select_batch, {'after': after, 'n': self.batch_size}).all()
+                if not rows:
+                    return
+                after = rows[-1][0]
+                expired = [row for row in rows if row[2] is not None and row[2] < cutoff]
+                if not expired:
+                    return
+                session_ids = sorted({row[1] for row in expired})
+                conn.execute(delete_batch, {'ids': [row[0] for row in expired]})
+                # 先更新（锁住）会话行再重建索引，和写消息时的顺序一致
+                repair_session_summaries(conn, session_ids)
+                rebuild_message_index(conn, session_ids)
+            stats['messages_deleted'] += len(expired)
+            stats['sessions_repaired'] += len(session_ids)
+            if in_process:
+                self._after_change([], session_ids)
+            time.sleep(self.batch_pause)
+
+    @staticmethod
+    def _after_change(deleted_sessions: List[str], changed_sessions: List[str]):
+        """提交之后: 清掉相关的读缓存，删除的会话同时丢掉进程内的历史和长轮询版本号"""
+        from .conversation_ai import conversation_ai_service
+        for session_id in deleted_sessions:
+            read_cache.invalidate_prefix(messages_cache_prefix(session_id))
+            message_notifier.forget(session_id)
+            conversation_ai_service.context_manager.clear(session_id)
+        for session_id in changed_sessions:
+            read_cache.invalidate_prefix(messages_cache_prefix(session_id))
+        read_cache.invalidate_prefix(SESSIONS_CACHE_PREFIX)
+
+    def _collect_orphan_uploads(self, engine: Engine, stats: Dict[str, Any], dry_run: bool):
+        """路径的写法不统一（绝对路径、/static/uploads/x.png），按文件名判断是否被引用"""
+        upload_dir = self.policy.upload_dir
+        if not os.path.isdir(upload_dir):
+            return
+        referenced: Set[str] = set()
+        with engine.connect() as conn:
+            for sql in ('SELECT image_path, segmented_image_path FROM vocabulary_items',
+                        'SELECT image_path, NULL FROM conversation_sessions'):
+                for row in conn.execute(text(sql)):
+                    referenced.update(os.path.basename(p.replace('\\', '/')) for p in row if p)
+
+        cutoff = time.time() - self.policy.upload_grace_hours * 3600
+        deleted_in_batch = 0
+        for entry in os.scandir(upload_dir):
+            if not entry.is_file() or entry.name.startswith('.') or entry.name in referenced:
+                continue
+            try:
+                info = entry.stat()
+                if info.st_mtime >= cutoff:
+                    continue
+                if not dry_run:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                # 同一台机器上的另一个 worker 刚删掉
+                continue
+            stats['uploads_deleted'] += 1
+            stats['upload_bytes_freed'] += info.st_size
+            deleted_in_batch += 1
+            if deleted_in_batch >= self.batch_size:
+                deleted_in_batch = 0
+                time.sleep(self.batch_pause)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {'enabled': self.enabled, 'interval_seconds': self.interval, 'batch_size': self.batch_size,
+                'policy': self.policy.describe(), 'runs': self._runs, 'last_run': self._last_run}
+
+
+# 创建全局实例
+maintenance = MaintenanceJob()
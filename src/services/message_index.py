@@ -0,0 +1,308 @@
+# message_index.py
+
+import re
+from typing import List, Dict, Any, Optional, Iterable, Tuple
+
+from sqlalchemy import text, bindparam
+
+'''
+对话消息的倒排索引: 词 -> 用到这个词的消息 id 和词在消息里的位置。
+"你在哪些对话里用过这个单词"、"单词本里哪些词真正练习过" 如果对每个单词在 conversation_messages.message 上做 LIKE，
+每个单词都是一次全表扫描；倒排索引按词直接取到消息 id，多词短语（ice cream）用位置判断是否相邻。
+
+存储（message_postings 表，模型 MessagePosting，迁移 0006 创建）: 每个 (term, session_id) 一行
+- postings: 按消息 id 递增的 [id 差值, 位置个数, 位置差值...]，全部用 varint 编码（一般每个消息 3~4 个字节）
+- last_message_id: 追加时只需要和它比较，新消息的 id 更大时直接把编码后的字节接在后面，不用解码
+- message_count / occurrences: 出现这个词的消息数 / 出现次数，只统计次数时不用解码 postings
+
+只索引学习者自己（sender == 'user'）的消息: AI 的回复里出现了某个词不算学习者练习过它。
+词按小写、去掉标点切分（don't、well-being 里的连字符两边是两个词），不做词干化: apples 和 apple 是两个词。
+
+维护:
+- index_messages: 插入消息的同一事务里、record_messages 之后调用。record_messages 已经更新（锁住）了会话行，
+  同一会话的索引更新因此是串行的，读-改-写 postings 不会互相覆盖
+- rebuild_message_index: 按消息表重建指定会话（删除消息后）或全部会话（迁移 0006 回填），
+  命令行: python -m src.database rebuild-message-index [--session-id ...]
+- delete_session_index: 删除会话时调用
+
+conn 可以是 db.session 也可以是 Connection（和 session_summary.py 一样）。
+'''
+
+# 字母组成的词，允许中间有撇号（don't、learner's）
+_TOKEN_RE = re.compile(r"[^\W\d_]+(?:'[^\W\d_]+)*")
+
+# term 列宽；更长的 "词" 不索引
+MAX_TERM_LENGTH = 64
+
+# 按会话 id 分批重建
+REBUILD_BATCH_SIZE = 200
+
+# IN 列表的最大长度
+_IN_CHUNK = 500
+
+_SELECT_POSTINGS_SQL = text(
+    'SELECT term, session_id, last_message_id, message_count, occurrences, postings FROM message_postings '
+    'WHERE session_id = :session_id AND term IN :terms'
+).bindparams(bindparam('terms', expanding=True))
+
+_INSERT_SQL = text(
+    'INSERT INTO message_postings (term, session_id, last_message_id, message_count, occurrences, postings) '
+    'VALUES (:term, :session_id, :last_message_id, :message_count, :occurrences, :postings)'
+)
+
+_UPDATE_SQL = text(
+    'UPDATE message_postings SET last_message_id = :last_message_id, message_count = :message_count, '
+    'occurrences = :occurrences, postings = :postings WHERE term = :term AND session_id = :session_id'
+)
+
+
+# ---------- 编码 ----------
+
+def _write_varint(out: bytearray, value: int):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def encode_postings(entries: Iterable[Tuple[int, List[int]]], after_id: int = 0) -> bytes:
+    """entries 为按 id 递增的 (message_id, positions)；after_id 是已有 postings 的最后一个 id（追加时）"""
+    out = bytearray()
+    last = after_id
+    for message_id, positions in entries:
+        _write_varint(out, message_id - last)
+        _write_varint(out, len(positions))
+        previous = 0
+        for position in positions:
+            _write_varint(out, position - previous)
+            previous = position
+        last = message_id
+    return bytes(out)
+
+
+def decode_postings(data: bytes) -> List[Tuple[int, List[int]]]:
+    values = []
+    value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        values.append(value)
+        value = shift = 0
+
+    entries = []
+    i = message_id = 0
+    while i < len(values):
+        message_id += values[i]
+        count = values[i + 1]
+        positions = []
+        position = 0
+        for delta in values[i + 2:i + 2 + count]:
+            position += delta
+            positions.append(position)
+        entries.append((message_id, positions))
+        i += 2 + count
+    return entries
+
+
+# ---------- 切词 ----------
+
+def tokenize(message: Optional[str]) -> List[str]:
+    if not message:
+        return []
+    return [t for t in _TOKEN_RE.findall(message.lower()) if len(t) <= MAX_TERM_LENGTH]
+
+
+def term_positions(message: Optional[str]) -> Dict[str, List[int]]:
+    positions: Dict[str, List[int]] = {}
+    for i, term in enumerate(tokenize(message)):
+        positions.setdefault(term, []).append(i)
+    return positions
+
+
+def _binary(value) -> bytes:
+    # psycopg2 返回 memoryview
+    return bytes(value) if value is not None else b''
+
+
+# ---------- 写入 ----------
+
+def _build(rows: Iterable[Dict[str, Any]]) -> Dict[Tuple[str, str], List[Tuple[int, List[int]]]]:
+    """{(term, session_id): [(message_id, positions)...]}，每个列表按 id 递增"""
+    by_key: Dict[Tuple[str, str], List[Tuple[int, List[int]]]] = {}
+    for row in sorted((r for r in rows if r['sender'] == 'user'), key=lambda r: r['id']):
+        for term, positions in term_positions(row['message']).items():
+            by_key.setdefault((term, row['session_id']), []).append((row['id'], positions))
+    return by_key
+
+
+def _new_row(term: str, session_id: str, entries: List[Tuple[int, List[int]]]) -> Dict[str, Any]:
+    return {'term': term, 'session_id': session_id, 'last_message_id': entries[-1][0],
+            'message_count': len(entries), 'occurrences': sum(len(p) for _, p in entries),
+            'postings': encode_postings(entries)}
+
+
+def index_messages(conn, rows: Iterable[Dict[str, Any]]):
+    """
+    rows 为刚插入的消息（id, session_id, sender, message），可以属于多个会话。
+    每个会话一条 SELECT 取出已有的 postings，再批量 UPDATE / INSERT；调用方负责提交。
+    """
+    by_session: Dict[str, Dict[str, List[Tuple[int, List[int]]]]] = {}
+    for (term, session_id), entries in _build(rows).items():
+        by_session.setdefault(session_id, {})[term] = entries
+
+    for session_id, new_terms in by_session.items():
+        existing = {}
+        terms = list(new_terms)
+        for start in range(0, len(terms), _IN_CHUNK):
+            for row in conn.execute(_SELECT_POSTINGS_SQL, {'session_id': session_id,
+                                                           'terms': terms[start:start + _IN_CHUNK]}):
+                existing[row[0]] = row
+
+        inserts, updates = [], []
+        for term, entries in new_terms.items():
+            old = existing.get(term)
+            if old is None:
+                inserts.append(_new_row(term, session_id, entries))
+                continue
+            last_message_id, message_count, occurrences, postings = old[2], old[3], old[4], _binary(old[5])
+            if entries[0][0] > last_message_id:
+                # 常见情况: 新消息的 id 都更大，直接追加
+                postings += encode_postings(entries, after_id=last_message_id)
+                updates.append({'term': term, 'session_id': session_id, 'last_message_id': entries[-1][0],
+                                'message_count': message_count + len(entries),
+                                'occurrences': occurrences + sum(len(p) for _, p in entries),
+                                'postings': postings})
+            else:
+                merged = dict(decode_postings(postings))
+                merged.update(entries)
+                updates.append(_new_row(term, session_id, sorted(merged.items())))
+        if inserts:
+            conn.execute(_INSERT_SQL, inserts)
+        if updates:
+            conn.execute(_UPDATE_SQL, updates)
+
+
+def delete_session_index(conn, session_ids: List[str]):
+    if not session_ids:
+        return
+    conn.execute(text('DELETE FROM message_postings WHERE session_id IN :ids')
+                 .bindparams(bindparam('ids', expanding=True)), {'ids': list(session_ids)})
+
+
+def rebuild_message_index(conn, session_ids: Optional[List[str]] = None,
+                          batch_size: int = REBUILD_BATCH_SIZE) -> int:
+    """从消息表重建索引。session_ids 为空时处理所有会话（按会话 id 分批），返回处理的会话数"""
+    if session_ids is not None:
+        batches = [list(session_ids[i:i + batch_size]) for i in range(0, len(session_ids), batch_size)]
+    else:
+        all_ids = [row[0] for row in conn.execute(text('SELECT session_id FROM conversation_sessions ORDER BY id'))]
+        batches = [all_ids[i:i + batch_size] for i in range(0, len(all_ids), batch_size)]
+
+    select_messages = text(
+        "SELECT id, session_id, sender, message FROM conversation_messages "
+        "WHERE sender = 'user' AND session_id IN :ids"
+    ).bindparams(bindparam('ids', expanding=True))
+    total = 0
+    for batch in batches:
+        if not batch:
+            continue
+        rows = [{'id': r[0], 'session_id': r[1], 'sender': r[2], 'message': r[3]}
+                for r in conn.execute(select_messages, {'ids': batch})]
+        delete_session_index(conn, batch)
+        new_rows = [_new_row(term, session_id, entries) for (term, session_id), entries in _build(rows).items()]
+        if new_rows:
+            conn.execute(_INSERT_SQL, new_rows)
+        total += len(batch)
+    return total
+
+
+# ---------- 查询 ----------
+
+def term_counts(conn, terms: List[str], session_id: Optional[str] = None) -> Dict[str, Tuple[int, int]]:
+    """单个词的 {term: (消息数, 出现次数)}，只读计数列，不解码 postings"""
+    sql = 'SELECT term, SUM(message_count), SUM(occurrences) FROM message_postings WHERE term IN :terms'
+    params: Dict[str, Any] = {}
+    if session_id is not None:
+        sql += ' AND session_id = :session_id'
+        params['session_id'] = session_id
+    statement = text(sql + ' GROUP BY term').bindparams(bindparam('terms', expanding=True))
+    result = {}
+    for start in range(0, len(terms), _IN_CHUNK):
+        params['terms'] = terms[start:start + _IN_CHUNK]
+        for term, messages, occurrences in conn.execute(statement, params):
+            result[term] = (int(messages or 0), int(occurrences or 0))
+    return result
+
+
+def _load_postings(conn, terms: List[str], session_id: Optional[str]) -> Dict[str, Dict[str, bytes]]:
+    """{session_id: {term: postings}}，未解码；terms 按 _IN_CHUNK 分批，每批一条查询"""
+    sql = 'SELECT term, session_id, postings FROM message_postings WHERE term IN :terms'
+    params: Dict[str, Any] = {}
+    if session_id is not None:
+        sql += ' AND session_id = :session_id'
+        params['session_id'] = session_id
+    statement = text(sql).bindparams(bindparam('terms', expanding=True))
+    by_session: Dict[str, Dict[str, bytes]] = {}
+    for start in range(0, len(terms), _IN_CHUNK):
+        params['terms'] = terms[start:start + _IN_CHUNK]
+        for term, sid, postings in conn.execute(statement, params):
+            by_session.setdefault(sid, {})[term] = _binary(postings)
+    return by_session
+
+
+def _match_phrase(tokens: List[str], postings: Dict[str, Dict[int, List[int]]]) -> List[Tuple[int, List[int]]]:
+    """一个会话里包含 tokens（按顺序相邻）的消息: [(message_id, 起始位置...)]；postings 为 {term: {message_id: positions}}"""
+    # 所有词都出现过的消息，再按位置判断是否相邻
+    message_ids = set.intersection(*(set(postings[token]) for token in set(tokens)))
+    matches = []
+    for message_id in message_ids:
+        following = [set(postings[token][message_id]) for token in tokens[1:]]
+        starts = [p for p in postings[tokens[0]][message_id]
+                  if all(p + offset + 1 in positions for offset, positions in enumerate(following))]
+        if starts:
+            matches.append((message_id, starts))
+    return matches
+
+
+def phrase_matches(conn, phrase: str, session_id: Optional[str] = None) -> List[Tuple[int, str, List[int]]]:
+    """
+    包含 phrase（一个或多个词，按顺序相邻）的消息: [(message_id, session_id, 起始位置...)]，按 id 递增。
+    需要解码 postings；单个词只要计数时用 term_counts，很多个短语只要计数时用 phrase_counts。
+    """
+    tokens = tokenize(phrase)
+    if not tokens:
+        return []
+    matches = []
+    for sid, raw in _load_postings(conn, sorted(set(tokens)), session_id).items():
+        if any(token not in raw for token in tokens):
+            continue
+        postings = {term: dict(decode_postings(raw[term])) for term in set(tokens)}
+        matches.extend((message_id, sid, starts) for message_id, starts in _match_phrase(tokens, postings))
+    matches.sort()
+    return matches
+
+
+def phrase_counts(conn, phrases: List[str], session_id: Optional[str] = None) -> Dict[str, Tuple[int, int]]:
+    """
+    多个短语的 {phrase: (消息数, 出现次数)}。所有短语里的词一次取出 postings（和 term_counts 一样按 IN 分批），
+    相邻判断在内存里做，每个 (词, 会话) 的 postings 只解码一次。
+    """
+    tokens_by_phrase = {phrase: tokenize(phrase) for phrase in phrases}
+    tokens_by_phrase = {phrase: tokens for phrase, tokens in tokens_by_phrase.items() if tokens}
+    terms = sorted({token for tokens in tokens_by_phrase.values() for token in tokens})
+    result = {phrase: (0, 0) for phrase in tokens_by_phrase}
+    for raw in _load_postings(conn, terms, session_id).values():
+        decoded: Dict[str, Dict[int, List[int]]] = {}
+        for phrase, tokens in tokens_by_phrase.items():
+            if any(token not in raw for token in tokens):
+                continue
+            for token in tokens:
+                if token not in decoded:
+                    decoded[token] = dict(decode_postings(raw[token]))
+            matches = _match_phrase(tokens, decoded)
+            if matches:
+                messages, occurrences = result[phrase]
+                result[phrase] = (messages + len(matches), occurrences + sum(len(starts) for _, starts in matches))
+    return result
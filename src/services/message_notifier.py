@@ -0,0 +1,51 @@
+# message_notifier.py
+
+import time
+import threading
+from typing import Dict
+
+'''
+新消息通知，给 GET /api/sessions/<id>/messages?since_id=...&wait=N 的长轮询用。
+写消息的地方提交后调用 notify(session_id)，等待中的请求立即醒来重新查询；
+等待期间不持有数据库连接，gevent worker 下 threading.Condition 被 monkey-patch 成协程原语，不占线程。
+
+通知只在本进程内有效，别的 worker 写入的消息靠长轮询里的定期重查发现（见 conversation.py 的 LONG_POLL_RECHECK_SECONDS）。
+'''
+
+
+class MessageNotifier:
+    """每个会话一个递增的版本号；wait 在版本号变化或超时时返回"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._versions: Dict[str, int] = {}
+
+    def version(self, session_id: str) -> int:
+        with self._cond:
+            return self._versions.get(session_id, 0)
+
+    def notify(self, session_id: str):
+        with self._cond:
+            self._versions[session_id] = self._versions.get(session_id, 0) + 1
+            self._cond.notify_all()
+
+    def wait(self, session_id: str, version: int, timeout: float) -> bool:
+        """等到 session_id 的版本号不再是 version，返回是否有新通知（超时返回 False）"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._versions.get(session_id, 0) == version:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def forget(self, session_id: str):
+        """会话删除后释放它的版本号（等待中的请求会被唤醒）"""
+        with self._cond:
+            if self._versions.pop(session_id, None) is not None:
+                self._cond.notify_all()
+
+
+# 创建全局实例
+message_notifier = MessageNotifier()
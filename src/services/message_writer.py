@@ -0,0 +1,141 @@
+# message_writer.py
+
+import os
+import atexit
+import threading
+from typing import List, Dict, Any, Optional
+
+from flask import current_app
+
+from ..models import db
+from ..models.vocabulary import ConversationMessage
+from .session_summary import record_messages
+from .message_index import index_messages
+from .read_cache import read_cache, SESSIONS_CACHE_PREFIX, messages_cache_prefix
+from .message_notifier import message_notifier
+
+'''
+对话消息的批量延迟写入 (write-behind)。
+默认关闭，send_message 用两个短事务分别写用户消息和AI回复。
+CONVERSATION_WRITE_BEHIND=true 时，一轮对话的两条消息放进进程内队列，由后台线程每隔
+CONVERSATION_WRITE_BEHIND_INTERVAL_MS 毫秒合并成一次 executemany 写入（会话的消息摘要在同一事务里更新），聊天高峰时每轮对话不再各自占用一次连接和提交。
+
+代价:
+- 响应里的消息 id 为 null（还没写入），客户端用 timestamp 排序
+- 进程崩溃会丢失队列里还没写入的消息（正常退出时 atexit 会写完）
+- 读消息 / 删会话前先调用 flush / discard，保证能读到自己刚发的消息、删掉的会话不会被再写回来
+'''
+
+# 写入失败时保留在队列里重试的次数，超过后丢弃并打印日志
+_MAX_ATTEMPTS = 3
+
+
+class MessageWriter:
+    """进程内的消息写入队列，后台线程按批写入"""
+
+    def __init__(self, enabled: Optional[bool] = None, interval_ms: Optional[int] = None,
+                 max_batch: Optional[int] = None):
+        if enabled is None:
+            enabled = os.getenv('CONVERSATION_WRITE_BEHIND', 'false').lower() in ('1', 'true', 'yes')
+        self.enabled = enabled
+        self.interval = (interval_ms or int(os.getenv('CONVERSATION_WRITE_BEHIND_INTERVAL_MS', 200))) / 1000
+        self.max_batch = max_batch or int(os.getenv('CONVERSATION_WRITE_BEHIND_BATCH', 500))
+        self._pending: List[Dict[str, Any]] = []
+        self._attempts = 0
+        self._cond = threading.Condition()
+        # 同一时间只有一个线程在写，flush() 和后台线程不会把同一批写两次
+        self._write_lock = threading.Lock()
+        self._app = None
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {'enqueued': 0, 'written': 0, 'batches': 0, 'failures': 0, 'dropped': 0}
+
+    def init_app(self, app):
+        self._app = app
+        if self.enabled:
+            atexit.register(self.flush)
+
+    def enqueue(self, rows: List[Dict[str, Any]]):
+        """rows 为 conversation_messages 的列值（session_id, sender, message, timestamp）"""
+        if self._app is None:
+            self._app = current_app._get_current_object()
+        with self._cond:
+            self._pending.extend(rows)
+            self._stats['enqueued'] += len(rows)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='message-writer', daemon=True)
+                self._thread.start()
+            if len(self._pending) >= self.max_batch:
+                self._cond.notify()
+
+    def has_pending(self, session_id: Optional[str] = None) -> bool:
+        with self._cond:
+            if session_id is None:
+                return bool(self._pending)
+            return any(row['session_id'] == session_id for row in self._pending)
+
+    def flush(self, session_id: Optional[str] = None):
+        """把队列写完（session_id 不为空时只在该会话有待写消息时才写）"""
+        if session_id is not None and not self.has_pending(session_id):
+            return
+        with self._write_lock:
+            while self._write_once():
+                pass
+
+    def discard(self, session_id: str) -> int:
+        """删除会话时丢弃它还没写入的消息，返回丢弃的条数"""
+        with self._write_lock, self._cond:
+            before = len(self._pending)
+            self._pending = [row for row in self._pending if row['session_id'] != session_id]
+            return before - len(self._pending)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait(self.interval)
+            with self._write_lock:
+                self._write_once()
+
+    def _write_once(self) -> bool:
+        """写入一批，返回是否还有剩余（调用方持有 _write_lock）"""
+        with self._cond:
+            batch = self._pending[:self.max_batch]
+        if not batch:
+            return False
+        try:
+            with self._app.app_context():
+                table = ConversationMessage.__table__
+                ids = db.session.execute(table.insert().returning(table.c.id, sort_by_parameter_order=True),
+                                         batch).scalars().all()
+                record_messages(db.session, batch)
+                # record_messages 之后（会话行已被本事务锁住）再更新倒排索引
+                index_messages(db.session, [dict(row, id=message_id) for row, message_id in zip(batch, ids)])
+                db.session.commit()
+        except Exception as e:
+            self._attempts += 1
+            self._stats['failures'] += 1
+            if self._attempts < _MAX_ATTEMPTS:
+                print(f"Message write-behind failed (attempt {self._attempts}), will retry: {e}")
+                return False
+            print(f"Message write-behind failed {self._attempts} times, dropping {len(batch)} messages: {e}")
+            self._stats['dropped'] += len(batch)
+        else:
+            self._stats['written'] += len(batch)
+            self._stats['batches'] += 1
+            for session_id in {row['session_id'] for row in batch}:
+                read_cache.invalidate_prefix(messages_cache_prefix(session_id))
+                message_notifier.notify(session_id)
+            read_cache.invalidate_prefix(SESSIONS_CACHE_PREFIX)
+        self._attempts = 0
+        with self._cond:
+            # 写入期间只会在队尾追加（discard 需要 _write_lock），队首这一批可以直接去掉
+            del self._pending[:len(batch)]
+            return bool(self._pending)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {'enabled': self.enabled, 'pending': len(self._pending),
+                    'interval_ms': int(self.interval * 1000), **self._stats}
+
+
+# 创建全局实例
+message_writer = MessageWriter()
@@ -0,0 +1,142 @@
+# opening_prefetch.py
+
+import os
+import time
+import hashlib
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError as FutureTimeoutError
+from typing import List, Dict, Any, Optional, Callable
+
+'''
+对话开场白的预取 (speculative prefetch)。
+/api/generate-conversation-themes 返回4个主题后，用户选一个，然后 create_session + 第一次 send_message 都是冷启动。
+开启预取后，主题一生成就在后台为每个主题生成 AI 的开场白，放进短 TTL 的缓存；
+新会话创建时直接取用，第一条聊天气泡可以立即显示。
+
+成本控制:
+- 每小时最多发起 CONVERSATION_PREFETCH_MAX_PER_HOUR 次预取
+- 同时在途的预取不超过 CONVERSATION_PREFETCH_MAX_PENDING 个
+- 某个主题被选中后，同一批次里其它还没开始的预取会被取消
+- 超过 TTL 未被使用的结果直接丢弃
+'''
+
+
+def theme_key(theme: Dict[str, Any]) -> str:
+    """主题的缓存键：由标题、角色、背景决定（与 create_session 收到的 theme 数据一致）"""
+    parts = [str(theme.get(k) or '').strip().lower() for k in ('title', 'role', 'background')]
+    return hashlib.sha1('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+
+class _PrefetchEntry:
+    def __init__(self, future: Future, batch_id: int):
+        self.future = future
+        self.batch_id = batch_id
+        self.created_at = time.monotonic()
+
+
+class OpeningPrefetcher:
+    """为一批主题在后台预先生成开场白"""
+
+    def __init__(self, generate_fn: Callable[[Dict[str, Any]], str],
+                 enabled: Optional[bool] = None,
+                 ttl_seconds: Optional[float] = None,
+                 max_pending: Optional[int] = None,
+                 max_per_hour: Optional[int] = None,
+                 consume_wait_seconds: Optional[float] = None):
+        self.generate_fn = generate_fn
+        if enabled is None:
+            enabled = os.getenv('CONVERSATION_PREFETCH_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+        self.enabled = enabled
+        self.ttl_seconds = ttl_seconds or float(os.getenv('CONVERSATION_PREFETCH_TTL_SECONDS', 300))
+        self.max_pending = max_pending or int(os.getenv('CONVERSATION_PREFETCH_MAX_PENDING', 16))
+        self.max_per_hour = max_per_hour or int(os.getenv('CONVERSATION_PREFETCH_MAX_PER_HOUR', 400))
+        # 预取还没完成时，创建会话最多等它多久（之后就当作没有预取）
+        self.consume_wait_seconds = consume_wait_seconds if consume_wait_seconds is not None \
+            else float(os.getenv('CONVERSATION_PREFETCH_CONSUME_WAIT_SECONDS', 3))
+
+        self._entries: Dict[str, _PrefetchEntry] = {}
+        self._recent_starts = deque()  # 最近一小时发起预取的时间
+        self._batch_seq = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='opening-prefetch')
+        self._stats = {'scheduled': 0, 'skipped_budget': 0, 'hits': 0, 'misses': 0,
+                       'cancelled': 0, 'expired': 0, 'failed': 0}
+
+    def prefetch_themes(self, themes: List[Dict[str, Any]]):
+        """为一批主题发起预取（不阻塞调用方）"""
+        if not self.enabled or not themes:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._purge_expired(now)
+            self._batch_seq += 1
+            batch_id = self._batch_seq
+            for theme in themes:
+                if not isinstance(theme, dict):
+                    continue
+                key = theme_key(theme)
+                if key in self._entries:
+                    continue
+                while self._recent_starts and now - self._recent_starts[0] > 3600:
+                    self._recent_starts.popleft()
+                pending = sum(1 for e in self._entries.values() if not e.future.done())
+                if pending >= self.max_pending or len(self._recent_starts) >= self.max_per_hour:
+                    self._stats['skipped_budget'] += 1
+                    continue
+                self._recent_starts.append(now)
+                self._stats['scheduled'] += 1
+                future = self._executor.submit(self._run, dict(theme))
+                self._entries[key] = _PrefetchEntry(future, batch_id)
+
+    def _run(self, theme: Dict[str, Any]) -> Optional[str]:
+        try:
+            return self.generate_fn(theme)
+        except Exception as e:
+            with self._lock:
+                self._stats['failed'] += 1
+            print(f"Opening prefetch failed for theme '{theme.get('title')}': {e}")
+            return None
+
+    def consume(self, theme: Dict[str, Any]) -> Optional[str]:
+        """取出某个主题预取好的开场白；没有预取或已过期时返回 None"""
+        if not self.enabled or not theme:
+            return None
+        key = theme_key(theme)
+        with self._lock:
+            self._purge_expired(time.monotonic())
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            # 用户已经选定主题，同一批次里其它还没开始的预取不再需要
+            self._cancel_batch(entry.batch_id)
+
+        try:
+            result = entry.future.result(timeout=self.consume_wait_seconds)
+        except FutureTimeoutError:
+            result = None
+        except Exception:
+            result = None
+        with self._lock:
+            self._stats['hits' if result else 'misses'] += 1
+        return result
+
+    def _cancel_batch(self, batch_id: int):
+        for key, entry in list(self._entries.items()):
+            if entry.batch_id == batch_id and entry.future.cancel():
+                del self._entries[key]
+                self._stats['cancelled'] += 1
+
+    def _purge_expired(self, now: float):
+        for key, entry in list(self._entries.items()):
+            if now - entry.created_at > self.ttl_seconds:
+                entry.future.cancel()
+                del self._entries[key]
+                self._stats['expired'] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._purge_expired(time.monotonic())
+            return dict(self._stats, enabled=self.enabled, cached=len(self._entries),
+                        pending=sum(1 for e in self._entries.values() if not e.future.done()))
@@ -0,0 +1,186 @@
+# rate_limiter.py
+
+import os
+import time
+import heapq
+import itertools
+import threading
+from collections import deque
+from typing import Dict, Any, Optional
+
+'''
+智普AI API Key 的优先级限流调度器 (token bucket)。
+所有 LLM 流量共用一个 API Key，而服务商有速率限制；以前批量任务可能把交互式对话饿死。
+这里按优先级排队领取令牌:
+- interactive: 对话回复，最先服务
+- image:       图片理解/物体识别/单词释义/主题生成
+- background:  后台预计算（摘要、预取等），只能使用预留额度之外的令牌
+等待时间超过该优先级的上限时抛出 RateLimitExceeded，路由层转换成 429 + Retry-After。
+
+额度是整个 API Key 的；每个 gunicorn worker 各自持有一个桶，
+总速率按 WEB_CONCURRENCY（gunicorn 的 worker 数）平分，保证多个 worker 加起来不超限。
+'''
+
+PRIORITY_CLASSES = {
+    'interactive': 0,
+    'image': 1,
+    'background': 2,
+}
+
+
+class RateLimitExceeded(Exception):
+    """LLM 调用额度已用尽，需要在 retry_after 秒后重试"""
+
+    def __init__(self, priority: str, retry_after: float):
+        self.priority = priority
+        self.retry_after = max(1, int(retry_after + 0.999))
+        super().__init__(f'LLM rate limit exceeded for {priority} requests, retry after {self.retry_after}s')
+
+
+def rate_limited_response(error: RateLimitExceeded):
+    """把 RateLimitExceeded 转成 429 响应（带 Retry-After 头）"""
+    from flask import jsonify
+    return jsonify({
+        'success': False,
+        'error': 'AI service is busy, please retry later',
+        'retry_after': error.retry_after
+    }), 429, {'Retry-After': str(error.retry_after)}
+
+
+class PriorityTokenBucket:
+    """
+    按优先级排队的令牌桶。
+    令牌按 rate 每秒匀速补充，最多积攒 burst 个；同一时刻只有队首（优先级最高、最先到达）的请求能拿令牌。
+    """
+
+    def __init__(self, rate: float, burst: float, max_wait: Dict[str, float], background_reserve: float = 0):
+        self.rate = rate
+        self.burst = burst
+        self.max_wait = max_wait
+        # background 请求必须在桶里至少留下这么多令牌，为交互请求保留突发额度
+        self.background_reserve = min(background_reserve, max(0.0, burst - 1))
+        self._tokens = burst
+        self._last_refill = time.monotonic()
+        self._waiters = []  # heap of (rank, seq)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stats = {name: {'granted': 0, 'rejected': 0, 'queue_samples': deque(maxlen=1000)}
+                       for name in PRIORITY_CLASSES}
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def _reserve_for(self, priority: str) -> float:
+        return self.background_reserve if priority == 'background' else 0.0
+
+    def acquire(self, priority: str = 'interactive', timeout: Optional[float] = None) -> float:
+        """领取一个令牌，返回排队时间（秒）。等不到时抛出 RateLimitExceeded"""
+        if priority not in PRIORITY_CLASSES:
+            priority = 'background'
+        rank = PRIORITY_CLASSES[priority]
+        max_wait = self.max_wait.get(priority, 10.0)
+        if timeout is not None:
+            max_wait = min(max_wait, timeout)
+        start = time.monotonic()
+        deadline = start + max_wait
+        needed = 1 + self._reserve_for(priority)
+
+        with self._cond:
+            self._refill(start)
+            # 估算排在前面的请求还要多久，明显等不到就直接拒绝，不占队列
+            ahead = sum(1 for r, _ in self._waiters if r <= rank)
+            estimated_wait = max(0.0, (ahead + needed - self._tokens) / self.rate)
+            if estimated_wait > max_wait:
+                self._stats[priority]['rejected'] += 1
+                raise RateLimitExceeded(priority, estimated_wait)
+
+            ticket = (rank, next(self._seq))
+            heapq.heappush(self._waiters, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if self._waiters[0] == ticket and self._tokens >= needed:
+                        heapq.heappop(self._waiters)
+                        self._tokens -= 1
+                        waited = now - start
+                        self._stats[priority]['granted'] += 1
+                        self._stats[priority]['queue_samples'].append(waited)
+                        self._cond.notify_all()
+                        return waited
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self._waiters.remove(ticket)
+                        heapq.heapify(self._waiters)
+                        self._stats[priority]['rejected'] += 1
+                        self._cond.notify_all()
+                        raise RateLimitExceeded(priority, (len(self._waiters) + needed) / self.rate)
+                    if self._waiters[0] == ticket:
+                        wait_for = (needed - self._tokens) / self.rate
+                    else:
+                        wait_for = remaining
+                    self._cond.wait(min(remaining, max(wait_for, 0.005)))
+            except RateLimitExceeded:
+                raise
+            except BaseException:
+                if ticket in self._waiters:
+                    self._waiters.remove(ticket)
+                    heapq.heapify(self._waiters)
+                    self._cond.notify_all()
+                raise
+
+    def try_acquire(self, priority: str = 'interactive') -> bool:
+        """不排队地尝试领取一个令牌（用于对冲请求等可有可无的调用）"""
+        needed = 1 + self._reserve_for(priority)
+        with self._cond:
+            self._refill(time.monotonic())
+            if self._waiters or self._tokens < needed:
+                return False
+            self._tokens -= 1
+            return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            self._refill(time.monotonic())
+            waiting = {name: 0 for name in PRIORITY_CLASSES}
+            rank_to_name = {v: k for k, v in PRIORITY_CLASSES.items()}
+            for rank, _ in self._waiters:
+                waiting[rank_to_name[rank]] += 1
+            classes = {}
+            for name, s in self._stats.items():
+                samples = sorted(s['queue_samples'])
+                classes[name] = {
+                    'granted': s['granted'],
+                    'rejected': s['rejected'],
+                    'waiting': waiting[name],
+                    'queue_p50_ms': round(samples[len(samples) // 2] * 1000, 1) if samples else None,
+                    'queue_p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 1) if samples else None,
+                    'queue_max_ms': round(samples[-1] * 1000, 1) if samples else None,
+                }
+            return {
+                'rate_per_second': self.rate,
+                'burst': self.burst,
+                'tokens_available': round(self._tokens, 2),
+                'classes': classes,
+            }
+
+
+def _create_scheduler() -> PriorityTokenBucket:
+    workers = max(1, int(os.getenv('WEB_CONCURRENCY', 1)))
+    total_rate = float(os.getenv('LLM_RATE_LIMIT_RPS', 5))
+    total_burst = float(os.getenv('LLM_RATE_LIMIT_BURST', 10))
+    return PriorityTokenBucket(
+        rate=total_rate / workers,
+        burst=max(1.0, total_burst / workers),
+        max_wait={
+            'interactive': float(os.getenv('LLM_RATE_LIMIT_MAX_WAIT_INTERACTIVE', 5)),
+            'image': float(os.getenv('LLM_RATE_LIMIT_MAX_WAIT_IMAGE', 10)),
+            'background': float(os.getenv('LLM_RATE_LIMIT_MAX_WAIT_BACKGROUND', 30)),
+        },
+        background_reserve=float(os.getenv('LLM_RATE_LIMIT_BACKGROUND_RESERVE', 2)) / workers,
+    )
+
+
+# 创建全局实例（进程内共享）
+llm_scheduler = _create_scheduler()
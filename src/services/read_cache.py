@@ -0,0 +1,231 @@
+# read_cache.py
+
+import os
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Any, Optional, Tuple
+
+from flask import current_app
+
+from . import fast_json
+
+'''
+热点读接口的读穿透 (read-through) 缓存。
+数据库是 us-east-2 的 Neon，GET /api/vocabulary/<id>、/api/sessions、/api/sessions/<id>/messages
+每次都要跨区域往返，而这些数据很少变化。缓存的是序列化好的 JSON 响应体，命中时不碰数据库、也不再序列化。
+
+两级:
+- 进程内 LRU（READ_CACHE_MAX_ENTRIES 条）
+- 可选的本机 SQLite 镜像（READ_CACHE_SQLITE_PATH），同一台机器上的所有 gunicorn worker 共享，
+  一个 worker 里的写操作清掉镜像后，其它 worker 最多 READ_CACHE_LOCAL_TTL_SECONDS 秒后就能看到
+
+一致性:
+- 写接口（PUT / POST / DELETE）提交后显式调用 invalidate / invalidate_prefix
+- 所有条目最多缓存 READ_CACHE_TTL_SECONDS 秒，这是任何情况下（其它进程直接改库、其它机器上的 worker）的最大陈旧时间
+- 读库期间如果发生了失效，读出来的结果不写入缓存，避免把旧数据放回去
+'''
+
+
+# 会话列表 / 某个会话的消息列表的键前缀（路由拼上查询参数作为键，写入消息的地方按前缀失效）
+SESSIONS_CACHE_PREFIX = 'sessions:'
+
+
+def messages_cache_prefix(session_id: str) -> str:
+    return f'messages:{session_id}:'
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.lower() in ('1', 'true', 'yes')
+
+
+class _SQLiteMirror:
+    """本机共享的 key -> 响应体 表；缓存数据丢了也没关系，所以不做 fsync"""
+
+    # 每写入这么多次清理一次过期条目
+    PURGE_EVERY = 500
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        with self._conn() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS read_cache ('
+                         'key TEXT PRIMARY KEY, body BLOB NOT NULL, expires_at REAL NOT NULL) WITHOUT ROWID')
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = OFF')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[Tuple[bytes, float]]:
+        row = self._conn().execute('SELECT body, expires_at FROM read_cache WHERE key = ? AND expires_at > ?',
+                                   (key, time.time())).fetchone()
+        return (bytes(row[0]), row[1]) if row else None
+
+    def put(self, key: str, body: bytes, expires_at: float):
+        conn = self._conn()
+        conn.execute('INSERT OR REPLACE INTO read_cache (key, body, expires_at) VALUES (?, ?, ?)',
+                     (key, body, expires_at))
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            conn.execute('DELETE FROM read_cache WHERE expires_at <= ?', (time.time(),))
+
+    def delete(self, key: str):
+        self._conn().execute('DELETE FROM read_cache WHERE key = ?', (key,))
+
+    def delete_prefix(self, prefix: str):
+        # 主键上的范围扫描
+        self._conn().execute('DELETE FROM read_cache WHERE key >= ? AND key < ?', (prefix, prefix + '\uffff'))
+
+
+class ReadCache:
+    """两级读穿透缓存，值为 JSON 响应体"""
+
+    def __init__(self, enabled: Optional[bool] = None, ttl_seconds: Optional[float] = None,
+                 local_ttl_seconds: Optional[float] = None, max_entries: Optional[int] = None,
+                 sqlite_path: Optional[str] = None):
+        if enabled is None:
+            enabled = _env_bool('READ_CACHE_ENABLED', True)
+        self.enabled = enabled
+        self.ttl_seconds = ttl_seconds or float(os.getenv('READ_CACHE_TTL_SECONDS', 30))
+        self.max_entries = max_entries or int(os.getenv('READ_CACHE_MAX_ENTRIES', 5000))
+        sqlite_path = sqlite_path if sqlite_path is not None else os.getenv('READ_CACHE_SQLITE_PATH', '')
+        self.mirror = _SQLiteMirror(sqlite_path) if enabled and sqlite_path else None
+        # 有共享镜像时，进程内一级只保留很短时间，其它 worker 的失效能很快生效
+        if self.mirror is not None:
+            local_ttl = local_ttl_seconds or float(os.getenv('READ_CACHE_LOCAL_TTL_SECONDS', 2))
+            self.local_ttl_seconds = min(local_ttl, self.ttl_seconds)
+        else:
+            self.local_ttl_seconds = self.ttl_seconds
+
+        self._entries: 'OrderedDict[str, Tuple[bytes, float]]' = OrderedDict()
+        self._lock = threading.Lock()
+        # 每次失效加一；读库前后不一致说明读的过程中数据可能变了
+        self._epoch = 0
+        self._stats = {'hits': 0, 'mirror_hits': 0, 'misses': 0, 'stores': 0, 'skipped_stores': 0,
+                       'invalidations': 0, 'mirror_errors': 0}
+
+    def get_or_load(self, key: str, loader: Callable[[], Optional[Dict[str, Any]]]) -> Optional[bytes]:
+        """
+        返回 key 对应的 JSON 响应体；未命中时调用 loader 读库，loader 返回 None（如记录不存在）时不缓存、返回 None。
+        """
+        if not self.enabled:
+            payload = loader()
+            return self._serialize(payload) if payload is not None else None
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] > now:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return entry[0]
+            epoch = self._epoch
+
+        if self.mirror is not None:
+            found = self._mirror_call(self.mirror.get, key)
+            if found:
+                body, expires_at = found
+                self._store_local(key, body, epoch, min(expires_at - time.time(), self.local_ttl_seconds))
+                with self._lock:
+                    self._stats['mirror_hits'] += 1
+                return body
+
+        with self._lock:
+            self._stats['misses'] += 1
+        payload = loader()
+        if payload is None:
+            return None
+        body = self._serialize(payload)
+        if self._store_local(key, body, epoch, self.local_ttl_seconds) and self.mirror is not None:
+            self._mirror_call(self.mirror.put, key, body, time.time() + self.ttl_seconds)
+        return body
+
+    def invalidate(self, *keys: str):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._epoch += 1
+            self._stats['invalidations'] += 1
+            for key in keys:
+                self._entries.pop(key, None)
+        if self.mirror is not None:
+            for key in keys:
+                self._mirror_call(self.mirror.delete, key)
+
+    def invalidate_prefix(self, prefix: str):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._epoch += 1
+            self._stats['invalidations'] += 1
+            for key in [k for k in self._entries if k.startswith(prefix)]:
+                del self._entries[key]
+        if self.mirror is not None:
+            self._mirror_call(self.mirror.delete_prefix, prefix)
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
+        if self.mirror is not None:
+            self._mirror_call(self.mirror.delete_prefix, '')
+
+    def _store_local(self, key: str, body: bytes, epoch: int, ttl: float) -> bool:
+        with self._lock:
+            if epoch != self._epoch:
+                self._stats['skipped_stores'] += 1
+                return False
+            if ttl > 0:
+                self._entries[key] = (body, time.monotonic() + ttl)
+                self._entries.move_to_end(key)
+                self._stats['stores'] += 1
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            return True
+
+    def _mirror_call(self, fn, *args):
+        """镜像出错（文件被锁、磁盘满）时只记录，不影响请求"""
+        try:
+            return fn(*args)
+        except sqlite3.Error as e:
+            with self._lock:
+                self._stats['mirror_errors'] += 1
+            print(f"Read cache mirror error: {e}")
+            return None
+
+    @staticmethod
+    def _serialize(payload: Dict[str, Any]) -> bytes:
+        # 字段顺序和 jsonify 一致；loader 可以直接返回 Core 查询出来的 datetime
+        return fast_json.dumps(payload)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['mirror_hits'] + self._stats['misses']
+            return dict(
+                self._stats,
+                enabled=self.enabled,
+                entries=len(self._entries),
+                mirror=self.mirror.path if self.mirror is not None else None,
+                ttl_seconds=self.ttl_seconds,
+                local_ttl_seconds=self.local_ttl_seconds,
+                hit_rate=round((self._stats['hits'] + self._stats['mirror_hits']) / lookups, 3) if lookups else None,
+            )
+
+
+def json_body_response(body: bytes):
+    """把缓存里的响应体包装成响应（和 jsonify 的 Content-Type 一致）"""
+    return current_app.response_class(body, mimetype=current_app.json.mimetype)
+
+
+# 创建全局实例
+read_cache = ReadCache()
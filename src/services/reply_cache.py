@@ -0,0 +1,119 @@
+# reply_cache.py
+
+import os
+import re
+import time
+import random
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional
+
+'''
+开场阶段的对话回复缓存。
+大多数会话开头的用户消息几乎一样（"hello"、"hi, what is this?"），角色和主题也相同，
+每次都要等一次完整的 LLM 调用。这里做精确匹配缓存:
+- key = 规范化后的用户消息 + 角色 + 主题 + 背景 + 历史深度 + 历史内容指纹
+- 只对早期轮次生效（历史为空，或历史完全相同），后面的对话依赖上下文，不缓存
+- 每个 key 先生成 variety 次回复，之后随机返回其中一条，避免所有人看到同一句话
+'''
+
+_PUNCT_RE = re.compile(r"[^\w\s']+", re.UNICODE)
+_SPACE_RE = re.compile(r'\s+')
+
+
+def normalize_message(text: str) -> str:
+    """规范化用户消息：小写、去标点、合并空白"""
+    text = _PUNCT_RE.sub(' ', (text or '').lower())
+    return _SPACE_RE.sub(' ', text).strip()
+
+
+class ReplyCache:
+    """早期轮次回复的精确匹配缓存（LRU + TTL）"""
+
+    def __init__(self, enabled: Optional[bool] = None, ttl_seconds: Optional[float] = None,
+                 variety: Optional[int] = None, max_history_depth: Optional[int] = None,
+                 max_entries: Optional[int] = None):
+        if enabled is None:
+            enabled = os.getenv('REPLY_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+        self.enabled = enabled
+        self.ttl_seconds = ttl_seconds or float(os.getenv('REPLY_CACHE_TTL_SECONDS', 3600))
+        self.variety = variety or int(os.getenv('REPLY_CACHE_VARIETY', 3))
+        self.max_history_depth = max_history_depth if max_history_depth is not None \
+            else int(os.getenv('REPLY_CACHE_MAX_HISTORY_DEPTH', 1))
+        self.max_entries = max_entries or int(os.getenv('REPLY_CACHE_MAX_ENTRIES', 2000))
+
+        self._entries: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'lookups': 0, 'hits': 0, 'misses': 0, 'ineligible': 0, 'stores': 0}
+        self._miss_latency_total = 0.0
+        self._miss_latency_count = 0
+
+    def make_key(self, user_message: str, role: str, theme: str, background: str,
+                 history: List[Dict[str, str]], summary: str = '') -> Optional[str]:
+        """返回缓存键；不满足缓存条件（对话已深入）时返回 None"""
+        if not self.enabled:
+            return None
+        normalized = normalize_message(user_message)
+        if not normalized or summary or len(history) > self.max_history_depth:
+            with self._lock:
+                self._stats['ineligible'] += 1
+            return None
+        history_part = '\x1e'.join(f"{normalize_message(h.get('user', ''))}\x1f{h.get('assistant', '')}" for h in history)
+        raw = '\x1d'.join([normalized, (role or '').lower(), (theme or '').lower(), (background or '').strip(),
+                           str(len(history)), history_part])
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key: Optional[str]) -> Optional[str]:
+        """命中时返回缓存的一条回复；还没生成够 variety 次时算未命中，让调用方再生成一条"""
+        if key is None:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            self._stats['lookups'] += 1
+            entry = self._entries.get(key)
+            if entry and now - entry['created_at'] > self.ttl_seconds:
+                del self._entries[key]
+                entry = None
+            if not entry or entry['samples'] < self.variety:
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return random.choice(entry['replies'])
+
+    def put(self, key: Optional[str], reply: str, latency: Optional[float] = None):
+        """记录一条新生成的回复（latency 为这次 LLM 调用耗时，用于估算缓存节省的时间）"""
+        if key is None or not reply:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if latency is not None:
+                self._miss_latency_total += latency
+                self._miss_latency_count += 1
+            entry = self._entries.get(key)
+            if entry is None or now - entry['created_at'] > self.ttl_seconds:
+                entry = {'created_at': now, 'replies': [], 'samples': 0}
+                self._entries[key] = entry
+            # LLM 可能多次给出同样的回复，按生成次数而不是不同回复的条数判断是否攒够
+            entry['samples'] += 1
+            if reply not in entry['replies'] and len(entry['replies']) < self.variety:
+                entry['replies'].append(reply)
+                self._stats['stores'] += 1
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            avg_miss = self._miss_latency_total / self._miss_latency_count if self._miss_latency_count else None
+            lookups = self._stats['lookups']
+            return dict(
+                self._stats,
+                enabled=self.enabled,
+                entries=len(self._entries),
+                hit_rate=round(self._stats['hits'] / lookups, 3) if lookups else None,
+                avg_miss_latency_ms=round(avg_miss * 1000, 1) if avg_miss is not None else None,
+                # 估算: 每次命中省掉一次平均耗时的 LLM 调用
+                estimated_saved_ms=round(self._stats['hits'] * avg_miss * 1000) if avg_miss is not None else None,
+            )
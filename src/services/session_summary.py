@@ -0,0 +1,85 @@
+# session_summary.py
+
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Iterable
+
+from sqlalchemy import text
+
+'''
+会话的消息摘要: message_count / last_message_at / last_message_preview（conversation_sessions 上的冗余列）。
+会话列表要显示 "N 条消息，最后一句 X，时间 T"，每页都对 conversation_messages 做聚合或 LATERAL 查询太贵；
+改为写消息时在同一个事务里更新会话行，列表只需要按 (created_at, id) 索引扫一遍会话表。
+
+- record_messages: 插入消息的同一事务里调用，计数用 message_count + n 原子累加，并发写同一会话不会丢计数
+- repair_session_summaries: 从 conversation_messages 重新计算（迁移 0004 回填、删除消息后、怀疑不一致时），
+  命令行: python -m src.database repair-session-summaries [--session-id ...]
+
+conn 可以是 db.session 也可以是 Connection（两者都有 execute(statement, params)）。
+'''
+
+# 预览保留的字符数（列宽 200，留出余量给多字节字符在部分数据库上的计算差异）
+PREVIEW_LENGTH = 120
+
+# 按会话 id 分批回填，每批一个语句（autocommit 连接上即一个短事务）
+REPAIR_BATCH_SIZE = 1000
+
+_RECORD_SQL = text("""
+    UPDATE conversation_sessions SET
+        message_count = message_count + :n,
+        last_message_preview = CASE WHEN last_message_at IS NULL OR last_message_at <= :ts
+                                    THEN :preview ELSE last_message_preview END,
+        last_message_at = CASE WHEN last_message_at IS NULL OR last_message_at <= :ts
+                               THEN :ts ELSE last_message_at END
+    WHERE session_id = :session_id
+""")
+
+# 相关子查询都走 (session_id, timestamp, id) 索引
+_REPAIR_SQL = f"""
+    UPDATE conversation_sessions SET
+        message_count = (SELECT COUNT(*) FROM conversation_messages m
+                         WHERE m.session_id = conversation_sessions.session_id),
+        last_message_at = (SELECT MAX(m.timestamp) FROM conversation_messages m
+                           WHERE m.session_id = conversation_sessions.session_id),
+        last_message_preview = (SELECT substr(m.message, 1, {PREVIEW_LENGTH}) FROM conversation_messages m
+                                WHERE m.session_id = conversation_sessions.session_id
+                                ORDER BY m.timestamp DESC, m.id DESC LIMIT 1)
+"""
+
+
+def preview(message: Optional[str]) -> Optional[str]:
+    if message is None:
+        return None
+    return message[:PREVIEW_LENGTH]
+
+
+def record_messages(conn, rows: Iterable[Dict[str, Any]]):
+    """
+    rows 为刚插入的消息（session_id, message, timestamp），可以属于多个会话。
+    每个会话一条 UPDATE；调用方负责提交（和消息的 INSERT 在同一个事务里）。
+    """
+    by_session: Dict[str, List[Dict[str, Any]]] = {}
+    for row in rows:
+        by_session.setdefault(row['session_id'], []).append(row)
+    for session_id, session_rows in by_session.items():
+        last = max(session_rows, key=lambda r: r['timestamp'] or datetime.min)
+        conn.execute(_RECORD_SQL, {'n': len(session_rows), 'ts': last['timestamp'],
+                                   'preview': preview(last['message']), 'session_id': session_id})
+
+
+def repair_session_summaries(conn, session_ids: Optional[List[str]] = None,
+                             batch_size: int = REPAIR_BATCH_SIZE) -> int:
+    """从消息表重新计算摘要。session_ids 为空时处理所有会话（按 id 分批），返回处理的会话数"""
+    if session_ids is not None:
+        if not session_ids:
+            return 0
+        params = {f's{i}': sid for i, sid in enumerate(session_ids)}
+        placeholders = ', '.join(f':{name}' for name in params)
+        conn.execute(text(_REPAIR_SQL + f' WHERE session_id IN ({placeholders})'), params)
+        return len(session_ids)
+
+    max_id = conn.execute(text('SELECT MAX(id) FROM conversation_sessions')).scalar() or 0
+    statement = text(_REPAIR_SQL + ' WHERE id > :lo AND id <= :hi')
+    total = 0
+    for lo in range(0, max_id, batch_size):
+        total += conn.execute(statement, {'lo': lo, 'hi': lo + batch_size}).rowcount or 0
+    return total
@@ -0,0 +1,74 @@
+# singleflight.py
+
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional
+
+'''
+请求合并 (singleflight)。
+同一时刻到达的相同请求（按 key 判断）只有第一个真正执行上游调用，其余的并发重复请求等待它的结果。
+- 结果和异常都会原样传递给所有等待者
+- 调用结束后立即移除，不做任何缓存，所以不会返回过期结果
+例如一个班30个学生同时拍同一间教室，会在同一秒内产生大量相同的 generate_word_definition_zhipu("desk")。
+'''
+
+
+class _InFlightCall:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.duplicates = 0
+
+
+class SingleFlight:
+    """按 key 合并正在进行中的相同调用"""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _InFlightCall] = {}
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any], group: str = 'default') -> Any:
+        with self._lock:
+            stats = self._stats.setdefault(group, {'upstream_calls': 0, 'collapsed_calls': 0})
+            call = self._calls.get(key)
+            if call is not None:
+                call.duplicates += 1
+                stats['collapsed_calls'] += 1
+                leader = False
+            else:
+                call = _InFlightCall()
+                self._calls[key] = call
+                stats['upstream_calls'] += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            groups = {name: dict(s) for name, s in self._stats.items()}
+            return {
+                'in_flight': len(self._calls),
+                'upstream_calls': sum(s['upstream_calls'] for s in groups.values()),
+                'collapsed_calls': sum(s['collapsed_calls'] for s in groups.values()),
+                'by_call_site': groups,
+            }
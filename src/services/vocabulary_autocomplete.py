@@ -0,0 +1,198 @@
+# vocabulary_autocomplete.py
+
+import os
+import time
+import heapq
+import bisect
+import threading
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple
+
+from sqlalchemy import select
+
+from ..models import db
+from ..models.vocabulary import VocabularyItem
+from .conditional import table_version
+
+'''
+添加单词时的输入联想（GET /api/vocabulary/autocomplete?q=ap）。
+/api/vocabulary/search 是全文检索，每敲一个字母都查一次数据库太重；联想只需要按前缀匹配单词本身，
+所以在进程内维护一个按小写单词排序的数组，前缀匹配就是两次二分查找，结果按创建时间取最新的 K 个，耗时在微秒级。
+
+- 懒加载: 第一次联想时从数据库加载全部单词（只取 id, word, created_at）
+- 本进程的增删改: 路由提交后调用 add / update / remove 增量更新，不重建
+- 其它 worker 的修改: 每隔 AUTOCOMPLETE_VERSION_CHECK_SECONDS 秒查一次 table_versions 里 vocabulary_items 的版本号
+  （迁移 0005 的触发器维护），和索引对应的版本不同就整体重建
+- 增量更新时带上写入事务里读到的版本号，正好比索引的版本号大 1 才说明中间没有别人的修改，否则标记为过期，下次联想时重建
+- 批量导入直接标记过期
+
+1、2 个字符的前缀匹配范围很大，它们的 top-K 结果单独缓存，索引有任何变化时清空。
+'''
+
+# 前缀的上界: 所有以 prefix 开头的字符串都 < prefix + _MAX_CHAR
+_MAX_CHAR = chr(0x10FFFF)
+
+# 这个长度以内的前缀缓存 top-K 结果
+SHORT_PREFIX_LENGTH = 2
+
+MAX_SUGGESTIONS = 50
+
+# 没有 table_versions（还没执行迁移 0005）时，索引最多用这么久就重建
+REBUILD_WITHOUT_VERSION_SECONDS = 60
+
+
+def _rank(created_at: Optional[datetime], item_id: int) -> Tuple[datetime, int]:
+    """越新越大，和单词列表的排序（created_at DESC, id DESC）一致"""
+    return created_at or datetime.min, item_id
+
+
+class VocabularyAutocomplete:
+    def __init__(self, check_interval: Optional[float] = None):
+        self.check_interval = check_interval if check_interval is not None else float(
+            os.getenv('AUTOCOMPLETE_VERSION_CHECK_SECONDS', '1'))
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        # _keys 是小写单词（有序，大小写不同的单词可能重复），_entries 和它一一对应: (rank, id, word)
+        self._keys: List[str] = []
+        self._entries: List[Tuple[Tuple[datetime, int], int, str]] = []
+        self._by_id: Dict[int, Tuple[str, Tuple[datetime, int]]] = {}
+        self._short_cache: Dict[str, List[Tuple[Tuple[datetime, int], int, str]]] = {}
+        self._built = False
+        self._stale = False
+        self._version: Optional[int] = None
+        self._built_at = 0.0
+        self._checked_at = 0.0
+        self._stats = {'lookups': 0, 'rebuilds': 0, 'incremental_updates': 0, 'last_build_ms': None}
+
+    # ---------- 查询 ----------
+
+    def suggest(self, prefix: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """以 prefix 开头（不区分大小写）的单词，最新添加的在前"""
+        self._ensure_fresh()
+        key = prefix.lower()
+        limit = min(max(limit, 1), MAX_SUGGESTIONS)
+        with self._lock:
+            self._stats['lookups'] += 1
+            if len(key) <= SHORT_PREFIX_LENGTH:
+                top = self._short_cache.get(key)
+                if top is None:
+                    top = self._short_cache[key] = self._top(key, MAX_SUGGESTIONS)
+                top = top[:limit]
+            else:
+                top = self._top(key, limit)
+        return [{'id': item_id, 'word': word} for _, item_id, word in top]
+
+    def _top(self, key: str, limit: int) -> List[Tuple[Tuple[datetime, int], int, str]]:
+        lo = bisect.bisect_left(self._keys, key)
+        hi = bisect.bisect_left(self._keys, key + _MAX_CHAR, lo)
+        if hi - lo <= limit:
+            return sorted(self._entries[lo:hi], reverse=True)
+        return heapq.nlargest(limit, (self._entries[i] for i in range(lo, hi)))
+
+    # ---------- 构建 / 版本检查 ----------
+
+    def _ensure_fresh(self):
+        now = time.monotonic()
+        if self._built and not self._stale:
+            if now - self._checked_at < self.check_interval:
+                return
+            self._checked_at = now
+            version = table_version(VocabularyItem.__tablename__)
+            if version is None:
+                if now - self._built_at < REBUILD_WITHOUT_VERSION_SECONDS:
+                    return
+            elif version[0] == self._version:
+                return
+        # 已经有索引时，别的线程正在重建就先用旧的；还没有索引时等它建完
+        if not self._build_lock.acquire(blocking=not self._built):
+            return
+        try:
+            if self._built and not self._stale and now < self._built_at:
+                return
+            self.rebuild()
+        finally:
+            self._build_lock.release()
+
+    def rebuild(self):
+        """从数据库重新加载全部单词。先读版本号再读数据: 读数据期间如果有修改，下次检查会再重建一次"""
+        started = time.perf_counter()
+        version = table_version(VocabularyItem.__tablename__)
+        rows = db.session.execute(select(VocabularyItem.id, VocabularyItem.word, VocabularyItem.created_at)).all()
+        entries = sorted((word.lower(), _rank(created_at, item_id), item_id, word)
+                         for item_id, word, created_at in rows if word)
+        with self._lock:
+            self._keys = [e[0] for e in entries]
+            self._entries = [(rank, item_id, word) for _, rank, item_id, word in entries]
+            self._by_id = {item_id: (key, rank) for key, rank, item_id, _ in entries}
+            self._short_cache = {}
+            self._version = version[0] if version else None
+            self._built = True
+            self._stale = False
+            self._built_at = self._checked_at = time.monotonic()
+            self._stats['rebuilds'] += 1
+            self._stats['last_build_ms'] = round((time.perf_counter() - started) * 1000, 2)
+
+    def invalidate(self):
+        """批量修改后调用，下次联想时重建"""
+        with self._lock:
+            self._stale = True
+
+    # ---------- 本进程写入后的增量更新（在提交之后调用） ----------
+
+    def add(self, item_id: int, word: str, created_at: Optional[datetime], version: Optional[Tuple[int, Any]]):
+        self._apply(version, lambda: self._insert(item_id, word, _rank(created_at, item_id)))
+
+    def update(self, item_id: int, word: str, version: Optional[Tuple[int, Any]]):
+        def change():
+            old = self._by_id.get(item_id)
+            if old is None or self._entries[self._position(item_id)][2] != word:
+                rank = old[1] if old else _rank(None, item_id)
+                self._delete(item_id)
+                self._insert(item_id, word, rank)
+        self._apply(version, change)
+
+    def remove(self, item_id: int, version: Optional[Tuple[int, Any]]):
+        self._apply(version, lambda: self._delete(item_id))
+
+    def _apply(self, version: Optional[Tuple[int, Any]], change):
+        """version 是写入事务里（提交前）读到的版本号；单条语句的修改让版本号加 1"""
+        with self._lock:
+            if not self._built or self._stale:
+                return
+            if version is None or self._version is None or version[0] not in (self._version, self._version + 1):
+                # 中间有别的 worker 的修改（或者没有版本号可比），增量更新不可靠
+                self._stale = True
+                return
+            change()
+            self._version = version[0]
+            self._short_cache = {}
+            self._stats['incremental_updates'] += 1
+
+    def _position(self, item_id: int) -> int:
+        key, rank = self._by_id[item_id]
+        return bisect.bisect_left(self._entries, (rank, item_id), bisect.bisect_left(self._keys, key),
+                                  bisect.bisect_right(self._keys, key))
+
+    def _insert(self, item_id: int, word: str, rank: Tuple[datetime, int]):
+        key = word.lower()
+        lo, hi = bisect.bisect_left(self._keys, key), bisect.bisect_right(self._keys, key)
+        i = bisect.bisect_left(self._entries, (rank, item_id), lo, hi)
+        self._keys.insert(i, key)
+        self._entries.insert(i, (rank, item_id, word))
+        self._by_id[item_id] = (key, rank)
+
+    def _delete(self, item_id: int):
+        if item_id not in self._by_id:
+            return
+        i = self._position(item_id)
+        del self._keys[i]
+        del self._entries[i]
+        del self._by_id[item_id]
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats, words=len(self._keys), version=self._version, stale=self._stale)
+
+
+# 创建全局实例
+vocabulary_autocomplete = VocabularyAutocomplete()
@@ -0,0 +1,349 @@
+# vocabulary_io.py
+
+import io
+import csv
+import json
+import zlib
+import codecs
+from array import array
+from datetime import datetime
+from typing import Iterator, Iterable, Optional, List, Dict, Any, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from ..models import db
+from ..models.vocabulary import VocabularyItem
+
+'''
+单词本的流式导出与批量导入。
+
+导出:
+以前 /api/vocabulary/export 把所有 VocabularyItem 读进内存、拼成一个大 dict 再 jsonify，
+单词本很大时内存暴涨，客户端要等全部序列化完才收到第一个字节。
+现在用 yield_per 分批读取（Postgres 上是服务端游标），每一行序列化后立即写给生成器响应:
+- format=json:   与原来相同的 {"success": true, "data": {...}} 结构，只是边读边写
+- format=ndjson: 每行一个 JSON 对象
+- format=csv:    带表头的 CSV（带 UTF-8 BOM，Excel 打开中文不乱码）
+gzip=true 时整个响应流式 gzip 压缩。内存占用只和批大小有关，与总行数无关。
+
+导入 (POST /api/vocabulary/import):
+以前只能一次加一个单词，每个单词先查一次是否存在再插入，两次往返远程数据库，而且并发时会重复。
+现在从请求体流式解析 JSON 数组 / NDJSON / CSV，每 IMPORT_BATCH_SIZE 行做一次多行
+INSERT ... ON CONFLICT (word) DO NOTHING RETURNING word，由 word 上的唯一索引去重（一次往返，没有竞态）。
+SQLite 3.35 以下不支持 RETURNING，退回到先批量查已存在的单词再插入。
+每一行的结果 (inserted / duplicate / invalid) 用一个字节记录，10 万行也只占 100KB。
+'''
+
+EXPORT_FIELDS = ['id', 'word', 'definition', 'example_sentence', 'image_path', 'segmented_image_path',
+                 'created_at', 'updated_at']
+
+EXPORT_FORMATS = {
+    'json': ('application/json', 'json'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+}
+
+# 每次读取的行数，以及攒够多少字节再交给 WSGI 服务器写出
+BATCH_SIZE = 1000
+FLUSH_BYTES = 64 * 1024
+
+
+def iter_vocabulary_items(batch_size: int = BATCH_SIZE) -> Iterator[VocabularyItem]:
+    """按创建时间倒序分批读取全部单词（yield_per 在 Postgres 上使用服务端游标）"""
+    query = VocabularyItem.query.order_by(VocabularyItem.created_at.desc(), VocabularyItem.id.desc())
+    return iter(query.yield_per(batch_size))
+
+
+def _ndjson_chunks(items: Iterable[VocabularyItem]) -> Iterator[str]:
+    for item in items:
+        yield json.dumps(item.to_dict(), ensure_ascii=False) + '\n'
+
+
+def _csv_chunks(items: Iterable[VocabularyItem]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS, extrasaction='ignore')
+    yield '\ufeff'
+    writer.writeheader()
+    for item in items:
+        writer.writerow(item.to_dict())
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _json_chunks(items: Iterable[VocabularyItem]) -> Iterator[str]:
+    # 导出开始的时间；总数在最后写出，不需要事先 COUNT
+    export_timestamp = datetime.utcnow().isoformat()
+    yield '{"success": true, "data": {"vocabulary": ['
+    count = 0
+    for item in items:
+        yield (',' if count else '') + json.dumps(item.to_dict(), ensure_ascii=False)
+        count += 1
+    yield f'], "total_count": {count}, "export_timestamp": "{export_timestamp}"}}}}'
+
+
+def export_chunks(fmt: str, items: Optional[Iterable[VocabularyItem]] = None,
+                  compress: bool = False) -> Iterator[bytes]:
+    """生成导出内容的字节块（攒到 FLUSH_BYTES 再输出；compress=True 时为 gzip 流）"""
+    if items is None:
+        items = iter_vocabulary_items()
+    chunks = {'json': _json_chunks, 'ndjson': _ndjson_chunks, 'csv': _csv_chunks}[fmt](items)
+    gzipper = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+
+    pending = []
+    size = 0
+    for chunk in chunks:
+        data = chunk.encode('utf-8')
+        pending.append(data)
+        size += len(data)
+        if size >= FLUSH_BYTES:
+            out = b''.join(pending)
+            pending, size = [], 0
+            out = gzipper.compress(out) if gzipper else out
+            if out:
+                yield out
+    out = b''.join(pending)
+    if gzipper:
+        out = gzipper.compress(out) + gzipper.flush()
+    if out:
+        yield out
+
+
+# ==============================================================================
+#  批量导入
+# ==============================================================================
+
+IMPORT_FORMATS = ('json', 'ndjson', 'csv')
+IMPORT_BATCH_SIZE = 1000
+READ_CHUNK_BYTES = 64 * 1024
+
+IMPORT_FIELDS = ('word', 'definition', 'example_sentence', 'image_path', 'segmented_image_path')
+_MAX_LENGTHS = {'word': 100, 'image_path': 255, 'segmented_image_path': 255}
+
+STATUS_INSERTED, STATUS_DUPLICATE, STATUS_INVALID = 0, 1, 2
+STATUS_NAMES = ('inserted', 'duplicate', 'invalid')
+
+
+class ImportFormatError(ValueError):
+    """输入本身无法继续解析（例如 JSON 数组中途格式错误），之前的批次已经提交"""
+    pass
+
+
+class _InvalidRow:
+    def __init__(self, error: str):
+        self.error = error
+
+
+def _iter_json_array(stream) -> Iterator[Any]:
+    """增量解析顶层 JSON 数组，一次只在内存里保留一小段文本"""
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    buf, pos, eof = '', 0, False
+    started, expect_comma = False, False
+
+    def more() -> bool:
+        nonlocal buf, pos, eof
+        chunk = stream.read(READ_CHUNK_BYTES)
+        if not chunk:
+            eof = True
+            buf = buf[pos:] + text_decoder.decode(b'', final=True)
+        else:
+            buf = buf[pos:] + text_decoder.decode(chunk)
+        pos = 0
+        return not eof
+
+    while True:
+        while pos < len(buf) and buf[pos].isspace():
+            pos += 1
+        if pos >= len(buf):
+            if eof:
+                raise ImportFormatError('Unexpected end of JSON input')
+            more()
+            continue
+        ch = buf[pos]
+        if not started:
+            if ch != '[':
+                raise ImportFormatError('JSON import must be an array of objects')
+            started = True
+            pos += 1
+            continue
+        if ch == ']':
+            return
+        if expect_comma:
+            if ch != ',':
+                raise ImportFormatError('Expected "," between array elements')
+            pos += 1
+            expect_comma = False
+            continue
+        try:
+            value, end = decoder.raw_decode(buf, pos)
+        except ValueError:
+            if eof:
+                raise ImportFormatError('Malformed JSON element')
+            more()
+            continue
+        if end >= len(buf) and not eof:
+            # 元素正好在缓冲区末尾结束时可能还没读完（例如数字），多读一些再解析
+            more()
+            continue
+        pos = end
+        expect_comma = True
+        yield value
+
+
+def _iter_lines(stream) -> Iterator[str]:
+    """按块读取并切分成行（保留换行符）；请求体流逐行 readline 会一个字节一个字节地读"""
+    text_decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    pending = ''
+    while True:
+        chunk = stream.read(READ_CHUNK_BYTES)
+        pending += text_decoder.decode(chunk or b'', final=not chunk)
+        *lines, pending = pending.split('\n')
+        for line in lines:
+            yield line + '\n'
+        if not chunk:
+            if pending:
+                yield pending
+            return
+
+
+def _iter_ndjson(stream) -> Iterator[Any]:
+    for raw in _iter_lines(stream):
+        line = raw.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            yield _InvalidRow(f'Malformed JSON line: {e}')
+
+
+def _iter_csv(stream) -> Iterator[Any]:
+    yield from csv.DictReader(_iter_lines(stream))
+
+
+def iter_import_rows(stream, fmt: str) -> Iterator[Any]:
+    """按格式逐行解析二进制输入流"""
+    return {'json': _iter_json_array, 'ndjson': _iter_ndjson, 'csv': _iter_csv}[fmt](stream)
+
+
+def _validate(row: Any) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    if isinstance(row, _InvalidRow):
+        return None, row.error
+    if not isinstance(row, dict):
+        return None, 'Row must be an object'
+    values = {}
+    for field in IMPORT_FIELDS:
+        value = row.get(field)
+        if isinstance(value, str):
+            value = value.strip() or None
+        elif value is not None:
+            return None, f'Field {field} must be a string'
+        if value is not None and field in _MAX_LENGTHS and len(value) > _MAX_LENGTHS[field]:
+            return None, f'Field {field} is longer than {_MAX_LENGTHS[field]} characters'
+        values[field] = value
+    for field in ('word', 'definition'):
+        if not values[field]:
+            return None, f'缺少必需字段: {field}'
+    return values, None
+
+
+class ImportReport:
+    """导入结果：每行一个字节的状态 + 无效行的错误信息"""
+
+    def __init__(self):
+        self.statuses = array('B')
+        self.errors: Dict[int, str] = {}
+        self.counts = [0, 0, 0]
+        self.error: Optional[str] = None
+
+    def add(self, status: int, error: Optional[str] = None):
+        self.statuses.append(status)
+        self.counts[status] += 1
+        if error:
+            self.errors[len(self.statuses)] = error
+
+    def set(self, row_number: int, status: int):
+        old = self.statuses[row_number - 1]
+        self.counts[old] -= 1
+        self.counts[status] += 1
+        self.statuses[row_number - 1] = status
+
+    def summary(self) -> Dict[str, int]:
+        return {'total': len(self.statuses), 'inserted': self.counts[STATUS_INSERTED],
+                'duplicate': self.counts[STATUS_DUPLICATE], 'invalid': self.counts[STATUS_INVALID]}
+
+    def iter_results(self, only_errors: bool = False) -> Iterator[Dict[str, Any]]:
+        for i, status in enumerate(self.statuses, start=1):
+            if only_errors and status == STATUS_INSERTED:
+                continue
+            result = {'row': i, 'status': STATUS_NAMES[status]}
+            if i in self.errors:
+                result['error'] = self.errors[i]
+            yield result
+
+
+def _supports_on_conflict_returning() -> bool:
+    dialect = db.engine.dialect
+    if dialect.name == 'postgresql':
+        return True
+    if dialect.name == 'sqlite':
+        return (dialect.dbapi.sqlite_version_info if dialect.dbapi else (0,)) >= (3, 35, 0)
+    return False
+
+
+def _insert_batch(batch: List[Tuple[int, Dict[str, Any]]], report: ImportReport, use_on_conflict: bool):
+    """插入一批已校验的行；batch 中每项为 (行号, 字段值)，同一批中重复的单词已经被剔除"""
+    now = datetime.utcnow()
+    table = VocabularyItem.__table__
+    rows = [dict(values, created_at=now, updated_at=now) for _, values in batch]
+
+    if use_on_conflict:
+        dialect_insert = postgresql.insert if db.engine.dialect.name == 'postgresql' else sqlite.insert
+        # executemany + RETURNING: SQLAlchemy 2.0 的 insertmanyvalues 会把它改写成多行 VALUES，
+        # 语句只编译一次（.values(rows) 每批都要重新编译 rows x 列数 个绑定参数，比执行本身还慢）
+        stmt = dialect_insert(table).on_conflict_do_nothing(index_elements=['word']).returning(table.c.word)
+        inserted = {r[0] for r in db.session.execute(stmt, rows)}
+    else:
+        words = [values['word'] for _, values in batch]
+        existing = {r[0] for r in db.session.execute(select(table.c.word).where(table.c.word.in_(words)))}
+        new_rows = [row for row in rows if row['word'] not in existing]
+        if new_rows:
+            db.session.execute(table.insert(), new_rows)
+        inserted = {row['word'] for row in new_rows}
+    db.session.commit()
+
+    for row_number, values in batch:
+        if values['word'] not in inserted:
+            report.set(row_number, STATUS_DUPLICATE)
+
+
+def import_vocabulary(rows: Iterable[Any], batch_size: int = IMPORT_BATCH_SIZE) -> ImportReport:
+    """逐批导入，每批一个短事务；输入中途无法解析时停止，已提交的批次保留"""
+    report = ImportReport()
+    use_on_conflict = _supports_on_conflict_returning()
+    batch: List[Tuple[int, Dict[str, Any]]] = []
+    batch_words = set()
+    try:
+        for row in rows:
+            values, error = _validate(row)
+            if error:
+                report.add(STATUS_INVALID, error)
+                continue
+            if values['word'] in batch_words:
+                report.add(STATUS_DUPLICATE)
+                continue
+            # 先记为 inserted，插入后再把没插进去的改成 duplicate
+            report.add(STATUS_INSERTED)
+            batch.append((len(report.statuses), values))
+            batch_words.add(values['word'])
+            if len(batch) >= batch_size:
+                _insert_batch(batch, report, use_on_conflict)
+                batch, batch_words = [], set()
+    except (ImportFormatError, UnicodeDecodeError, csv.Error) as e:
+        report.error = f'Import stopped after row {len(report.statuses)}: {e}'
+    if batch:
+        _insert_batch(batch, report, use_on_conflict)
+    return report
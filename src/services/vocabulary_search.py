@@ -0,0 +1,149 @@
+# vocabulary_search.py
+
+import os
+import re
+import time
+import threading
+from typing import Dict, Any, Optional, Tuple
+
+from sqlalchemy import text, select
+
+from ..models import db
+from ..models.vocabulary import VocabularyItem
+from ..models.serializers import VOCABULARY_COLUMNS
+from .fast_json import rows_to_dicts
+from ..database.migrations import VOCABULARY_TSVECTOR_SQL
+
+'''
+单词本全文检索。
+以前 /api/vocabulary/search 是对 word 和 definition 两列的 LIKE '%q%'，全表扫描并返回所有匹配。
+现在按数据库选择检索引擎（索引由迁移 0003 创建）:
+- postgres:   tsvector 表达式索引（词干匹配，单词权重高于释义）+ pg_trgm 三元组索引（拼写错误、前缀）
+- sqlite_fts: FTS5 外部内容表（porter 词干），bm25 排序，词前缀匹配（本地开发和测试）
+- like:       索引还没建好时退回原来的 LIKE（% 和 _ 转义后按字面匹配），同样限制候选条数
+
+为了让延迟不随表的大小增长，只对最新的 VOCABULARY_SEARCH_CANDIDATES 条匹配计算相关度
+（很常见的词可能匹配到几十万行，对全部匹配排序的代价和匹配数成正比）。
+代价是匹配数超过上限时，更早添加的单词即使更相关也不会出现在结果里；这时结果带 truncated=True，接口原样返回给客户端。
+完全匹配的单词通过唯一索引单独查出，总是排在第一位。结果用 limit/offset 分页。
+'''
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# 各引擎的候选查询: 先用索引取最新的 :candidates 条匹配，只对这些计算相关度
+_POSTGRES_SQL = f"""
+    SELECT c.id,
+           ts_rank_cd({VOCABULARY_TSVECTOR_SQL}, q.tsq) * 2 + similarity(c.word, :q) AS score
+    FROM (
+        SELECT v.id, v.word, v.definition
+        FROM vocabulary_items v, websearch_to_tsquery('english', :q) AS q(tsq)
+        WHERE {VOCABULARY_TSVECTOR_SQL} @@ q.tsq
+           OR v.word % :q
+           OR v.word ILIKE :prefix ESCAPE '\\'
+        ORDER BY v.id DESC
+        LIMIT :candidates
+    ) AS c, websearch_to_tsquery('english', :q) AS q(tsq)
+    ORDER BY score DESC, c.id DESC
+"""
+
+# FTS5 在同一次扫描里计算 bm25（越小越相关），扫描按 rowid 倒序、到 :candidates 条就停止
+_SQLITE_FTS_SQL = """
+    SELECT id, score FROM (
+        SELECT rowid AS id, bm25(vocabulary_fts, 10.0, 1.0) AS score
+        FROM vocabulary_fts
+        WHERE vocabulary_fts MATCH :match
+        ORDER BY rowid DESC
+        LIMIT :candidates
+    ) ORDER BY score, id DESC
+"""
+
+_LIKE_SQL = """
+    SELECT id, 0 AS score
+    FROM vocabulary_items
+    WHERE word LIKE :pattern ESCAPE '\\' OR definition LIKE :pattern ESCAPE '\\'
+    ORDER BY id DESC
+    LIMIT :candidates
+"""
+
+
+def _escape_like(value: str) -> str:
+    """LIKE 里的 % 和 _ 按字面匹配（查询里用 ESCAPE '\\'），和全文检索的行为一致"""
+    return value.replace('\\', '\\\\').replace('%', r'\%').replace('_', r'\_')
+
+
+class VocabularySearch:
+    """根据当前数据库和已执行的迁移选择检索引擎"""
+
+    # 没检测到索引时，隔一段时间再检测一次（迁移可能在进程运行期间执行）
+    RECHECK_SECONDS = 60
+
+    def __init__(self, candidates: Optional[int] = None):
+        self.candidates = candidates or int(os.getenv('VOCABULARY_SEARCH_CANDIDATES', 1000))
+        self._engines: Dict[str, Tuple[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def engine_name(self) -> str:
+        key = str(db.engine.url)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._engines.get(key)
+            if cached and (cached[0] != 'like' or now - cached[1] < self.RECHECK_SECONDS):
+                return cached[0]
+        name = self._detect()
+        with self._lock:
+            self._engines[key] = (name, now)
+        return name
+
+    def _detect(self) -> str:
+        dialect = db.engine.dialect.name
+        if dialect == 'postgresql':
+            found = db.session.execute(text(
+                "SELECT 1 FROM pg_indexes WHERE indexname = 'ix_vocabulary_items_fts'")).first()
+            return 'postgres' if found else 'like'
+        if dialect == 'sqlite':
+            found = db.session.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'vocabulary_fts'")).first()
+            return 'sqlite_fts' if found else 'like'
+        return 'like'
+
+    def search(self, query: str, limit: int = 20, offset: int = 0) -> Dict[str, Any]:
+        """
+        返回 {'items': [dict...], 'has_more': bool, 'engine': str, 'truncated': bool}，items 按相关度排序，字段同 VocabularyItem.to_dict()。
+        truncated 为 True 时只对最新的 candidates 条匹配排了序，更早的单词（除了完全匹配）不会出现在结果里
+        """
+        engine = self.engine_name()
+        params = {'q': query, 'candidates': self.candidates}
+        if engine == 'postgres':
+            sql = _POSTGRES_SQL
+            params['prefix'] = _escape_like(query) + '%'
+        elif engine == 'sqlite_fts':
+            tokens = _TOKEN_RE.findall(query.lower())
+            if not tokens:
+                return {'items': [], 'has_more': False, 'engine': engine, 'truncated': False}
+            # 每个词做前缀匹配，所有词都要出现（FTS5 查询语法里的特殊字符已被过滤掉）
+            params['match'] = ' '.join(f'"{t}"*' for t in tokens)
+            sql = _SQLITE_FTS_SQL
+        else:
+            params['pattern'] = f'%{_escape_like(query)}%'
+            sql = _LIKE_SQL
+
+        ranked = [row[0] for row in db.session.execute(text(sql), params)]
+        # 匹配数达到候选上限时，更早添加的匹配没有参与排序
+        truncated = len(ranked) >= self.candidates
+        exact = db.session.execute(text('SELECT id FROM vocabulary_items WHERE word = :q'), {'q': query}).first()
+        if exact:
+            ranked = [exact[0]] + [i for i in ranked if i != exact[0]]
+
+        ids = ranked[offset:offset + limit + 1]
+        has_more = len(ids) > limit
+        ids = ids[:limit]
+        if not ids:
+            return {'items': [], 'has_more': False, 'engine': engine, 'truncated': truncated}
+        rows = db.session.execute(select(*VOCABULARY_COLUMNS).where(VocabularyItem.id.in_(ids)))
+        by_id = {item['id']: item for item in rows_to_dicts(rows)}
+        return {'items': [by_id[i] for i in ids if i in by_id], 'has_more': has_more, 'engine': engine,
+                'truncated': truncated}
+
+
+# 创建全局实例
+vocabulary_search = VocabularySearch()
@@ -0,0 +1,79 @@
+# test_llm_client.py
+
+import os
+import sys
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.services import llm_client as llm_client_module  # noqa: E402
+from src.services.llm_client import LLMClient, CircuitOpenError, LLMUnavailableError  # noqa: E402
+from src.services.rate_limiter import RateLimitExceeded  # noqa: E402
+
+'''
+熔断器半开状态的探测许可: 请求没有真正发出（排队被拒、没有并发槽位、已过截止时间）时，
+许可必须交还给下一个请求，否则熔断器一直停在 half_open，所有 LLM 调用都被拒绝。
+上游用一个直接返回的假客户端代替，不访问网络。
+'''
+
+
+def _make_client():
+    client = LLMClient()
+    client.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(
+        create=lambda **kwargs: 'ok')))
+    client.hedge_enabled = False
+    return client
+
+
+def _half_open(client):
+    """把熔断器置为 open 且冷却期已过，下一次 allow_request 会进入 half_open 并发出探测许可"""
+    client.breaker.state = 'open'
+    client.breaker.opened_at = time.monotonic() - client.breaker.cooldown_seconds - 1
+
+
+class HalfOpenProbeTest(unittest.TestCase):
+    def setUp(self):
+        self.client = _make_client()
+        _half_open(self.client)
+
+    def call(self, timeout=None):
+        return self.client._chat_completion('test.probe', timeout, False, 'interactive', {'model': 'm'})
+
+    def test_scheduler_rejection_releases_probe(self):
+        with mock.patch.object(llm_client_module.llm_scheduler, 'acquire',
+                               side_effect=RateLimitExceeded('interactive', 1)):
+            with self.assertRaises(RateLimitExceeded):
+                self.call()
+        self.assertEqual(self.client.breaker.state, 'half_open')
+        self.assertFalse(self.client.breaker._probe_in_flight)
+
+        # 下一个请求拿到探测许可，成功后熔断器关闭
+        self.assertEqual(self.call(), 'ok')
+        self.assertEqual(self.client.breaker.state, 'closed')
+
+    def test_concurrency_limit_releases_probe(self):
+        with mock.patch.object(llm_client_module.llm_scheduler, 'acquire', return_value=0.0), \
+                mock.patch.object(self.client, '_semaphore', mock.Mock(**{'acquire.return_value': False})):
+            with self.assertRaises(LLMUnavailableError):
+                self.call()
+        self.assertFalse(self.client.breaker._probe_in_flight)
+        self.assertEqual(self.call(), 'ok')
+        self.assertEqual(self.client.breaker.state, 'closed')
+
+    def test_expired_deadline_does_not_take_probe(self):
+        with self.assertRaises(LLMUnavailableError):
+            self.call(timeout=-1)
+        self.assertFalse(self.client.breaker._probe_in_flight)
+        self.assertEqual(self.call(), 'ok')
+
+    def test_only_one_probe_while_in_flight(self):
+        self.assertTrue(self.client.breaker.allow_request())
+        with self.assertRaises(CircuitOpenError):
+            self.call()
+
+
+if __name__ == '__main__':
+    unittest.main()
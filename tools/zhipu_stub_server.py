@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+智普AI chat completions 本地替身服务器 (stub)
+用于在没有网络、也不消耗真实 API 额度的情况下对 conversation_ai.py / image_recognition2.py 做压测和延迟测试。
+
+支持我们用到的接口子集:
+- POST /api/paas/v4/chat/completions  (stream=False / stream=True, response_format={"type": "json_object"})
+- GET  /stats                          请求计数、注入错误数、回放命中率
+
+三种模式:
+- synthetic: 根据 prompt 生成合成回复（主题、单词释义、图片理解、物体识别、摘要、对话）
+- record:    把请求转发到真实的上游，并把响应写入 cassette 文件（JSON Lines）
+- replay:    按请求指纹从 cassette 回放；未命中时用合成回复（--strict 时返回 404）
+
+用法:
+    python tools/zhipu_stub_server.py --port 8001 --latency lognormal:0.8,0.5 --error-rate 0.02
+    ZHIPU_BASE_URL=http://127.0.0.1:8001/api/paas/v4 python run.py
+
+    # 录制一次真实响应，之后离线回放
+    python tools/zhipu_stub_server.py --mode record --cassette tools/cassettes/zhipu.jsonl
+    python tools/zhipu_stub_server.py --mode replay --cassette tools/cassettes/zhipu.jsonl
+"""
+
+import os
+import re
+import sys
+import json
+import math
+import time
+import uuid
+import random
+import hashlib
+import argparse
+import threading
+
+import requests
+from flask import Flask, Response, request, jsonify
+
+DEFAULT_UPSTREAM = "https://open.bigmodel.cn/api/paas/v4"
+
+
+# ==============================================================================
+#  延迟分布与错误注入
+# ==============================================================================
+
+def parse_latency(spec: str):
+    """
+    解析延迟分布，返回一个无参函数，每次调用返回一个延迟（秒）:
+    fixed:0.5 | uniform:0.2,1.5 | normal:0.8,0.2 | lognormal:0.8,0.5 (中位数, sigma) | none
+    """
+    if not spec or spec == 'none':
+        return lambda: 0.0
+    kind, _, args = spec.partition(':')
+    values = [float(v) for v in args.split(',')] if args else []
+    if kind == 'fixed':
+        return lambda: values[0]
+    if kind == 'uniform':
+        return lambda: random.uniform(values[0], values[1])
+    if kind == 'normal':
+        return lambda: max(0.0, random.gauss(values[0], values[1]))
+    if kind == 'lognormal':
+        mu = math.log(values[0])
+        return lambda: random.lognormvariate(mu, values[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+class StubState:
+    def __init__(self, args):
+        self.args = args
+        self.latency = parse_latency(args.latency)
+        self.error_statuses = [int(s) for s in args.error_status.split(',') if s]
+        self.cassette = {}
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'stream_requests': 0, 'injected_errors': 0, 'injected_timeouts': 0,
+                      'replay_hits': 0, 'replay_misses': 0, 'recorded': 0}
+        if args.cassette and os.path.exists(args.cassette):
+            with open(args.cassette, encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.cassette[entry['key']] = entry['response']
+            print(f"Loaded {len(self.cassette)} recorded responses from {args.cassette}")
+
+    def incr(self, key: str):
+        with self.lock:
+            self.stats[key] += 1
+
+    def record(self, key: str, body: dict, response: dict):
+        with self.lock:
+            self.cassette[key] = response
+            self.stats['recorded'] += 1
+            os.makedirs(os.path.dirname(os.path.abspath(self.args.cassette)), exist_ok=True)
+            with open(self.args.cassette, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'key': key, 'request': body, 'response': response}, ensure_ascii=False) + '\n')
+
+
+def request_fingerprint(body: dict) -> str:
+    """回放用的请求指纹：只取影响输出的字段，stream 不参与（流式回放由完整响应切分）"""
+    relevant = {k: body.get(k) for k in ('model', 'messages', 'response_format', 'max_tokens', 'temperature')}
+    return hashlib.sha256(json.dumps(relevant, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+# ==============================================================================
+#  合成回复
+# ==============================================================================
+
+def _prompt_text(messages) -> str:
+    parts = []
+    for m in messages or []:
+        content = m.get('content')
+        if isinstance(content, str):
+            parts.append(content)
+        elif isinstance(content, list):
+            parts.extend(c.get('text', '') for c in content if isinstance(c, dict) and c.get('type') == 'text')
+    return '\n'.join(parts)
+
+
+def synthetic_content(body: dict) -> str:
+    """根据 prompt 的特征生成与各服务期望格式一致的合成回复"""
+    messages = body.get('messages') or []
+    text = _prompt_text(messages)
+    last_user = _prompt_text([m for m in messages if m.get('role') == 'user'][-1:])
+
+    if 'conversation themes' in text:
+        roles = ['Chef', 'Nutritionist', 'Shopping Assistant', 'Cultural Guide']
+        themes = [{'id': i + 1, 'title': f'{role} Conversation', 'description': f'Talk with a {role}.',
+                   'role': role, 'background': f'You are chatting with a friendly {role}.',
+                   'scenario': f'Practice vocabulary with a {role}.'} for i, role in enumerate(roles)]
+        return json.dumps({'themes': themes})
+    match = re.search(r"for the word '([^']+)'", text)
+    if match:
+        word = match.group(1)
+        return json.dumps({'word': word, 'definition': f'A stub definition of {word}.',
+                           'example_sentence': f'This is a {word}.', 'pronunciation': f'/{word}/',
+                           'part_of_speech': 'noun'})
+    if 'Analyze the image' in text:
+        return json.dumps({'description': 'A room with a desk and a chair.', 'objects': ['desk', 'chair', 'book'],
+                           'scene': 'classroom', 'mood': 'calm'})
+    if 'single, primary object' in text:
+        return random.choice(['desk', 'chair', 'book', 'apple', 'cup'])
+    if 'Start the conversation' in text:
+        return "Hello and welcome! What would you like to talk about today?"
+    if 'running summary' in text:
+        return 'The user is practicing everyday vocabulary with the assistant.'
+    if (body.get('response_format') or {}).get('type') == 'json_object':
+        return json.dumps({'result': 'stub'})
+    return f"That's a great question about \"{last_user[:60]}\". Let's practice some useful words together!"
+
+
+def _usage(body: dict, content: str) -> dict:
+    prompt_tokens = max(1, len(_prompt_text(body.get('messages')).split()))
+    completion_tokens = max(1, len(content.split()))
+    return {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens}
+
+
+def completion_payload(body: dict, content: str) -> dict:
+    return {
+        'id': uuid.uuid4().hex,
+        'created': int(time.time()),
+        'model': body.get('model', 'stub'),
+        'choices': [{'index': 0, 'finish_reason': 'stop',
+                     'message': {'role': 'assistant', 'content': content}}],
+        'usage': _usage(body, content),
+    }
+
+
+def stream_chunks(body: dict, content: str, chunk_delay: float):
+    """把完整回复切成 SSE 增量块"""
+    completion_id = uuid.uuid4().hex
+    created = int(time.time())
+    pieces = re.findall(r'\S+\s*', content) or ['']
+    for i, piece in enumerate(pieces):
+        chunk = {'id': completion_id, 'created': created, 'model': body.get('model', 'stub'),
+                 'choices': [{'index': 0, 'delta': {'role': 'assistant', 'content': piece}}]}
+        if i == len(pieces) - 1:
+            chunk['choices'][0]['finish_reason'] = 'stop'
+            chunk['usage'] = _usage(body, content)
+        yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+        if chunk_delay:
+            time.sleep(chunk_delay)
+    yield "data: [DONE]\n\n"
+
+
+# ==============================================================================
+#  Flask app
+# ==============================================================================
+
+def create_app(args) -> Flask:
+    app = Flask(__name__)
+    state = StubState(args)
+    app.config['STUB_STATE'] = state
+
+    @app.route('/api/paas/v4/chat/completions', methods=['POST'])
+    def chat_completions():
+        body = request.get_json(force=True) or {}
+        state.incr('requests')
+        stream = bool(body.get('stream'))
+        if stream:
+            state.incr('stream_requests')
+
+        # 错误注入
+        roll = random.random()
+        if roll < args.timeout_rate:
+            state.incr('injected_timeouts')
+            time.sleep(args.timeout_seconds)
+        elif roll < args.timeout_rate + args.error_rate and state.error_statuses:
+            state.incr('injected_errors')
+            status = random.choice(state.error_statuses)
+            headers = {'Retry-After': '1'} if status == 429 else {}
+            return jsonify({'error': {'code': str(status), 'message': 'Injected error from stub server'}}), status, headers
+
+        key = request_fingerprint(body)
+        if args.mode == 'record':
+            upstream_body = dict(body, stream=False)
+            upstream = requests.post(f"{args.upstream.rstrip('/')}/chat/completions", json=upstream_body,
+                                     headers={'Authorization': request.headers.get('Authorization', '')},
+                                     timeout=120)
+            if upstream.status_code != 200:
+                return Response(upstream.content, status=upstream.status_code, content_type='application/json')
+            payload = upstream.json()
+            state.record(key, body, payload)
+        elif args.mode == 'replay' and key in state.cassette:
+            state.incr('replay_hits')
+            payload = dict(state.cassette[key], id=uuid.uuid4().hex, created=int(time.time()))
+        else:
+            if args.mode == 'replay':
+                state.incr('replay_misses')
+                if args.strict:
+                    return jsonify({'error': {'code': '404', 'message': 'No recorded response for this request'}}), 404
+            payload = completion_payload(body, synthetic_content(body))
+
+        # 模拟上游延迟（录制模式下已经是真实延迟）
+        if args.mode != 'record':
+            time.sleep(state.latency())
+
+        if stream:
+            content = payload['choices'][0]['message'].get('content') or ''
+            return Response(stream_chunks(body, content, args.chunk_delay), content_type='text/event-stream')
+        return jsonify(payload)
+
+    @app.route('/stats', methods=['GET'])
+    def stats():
+        with state.lock:
+            return jsonify(dict(state.stats, cassette_entries=len(state.cassette), mode=args.mode))
+
+    return app
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Local Zhipu AI chat completions stub server')
+    parser.add_argument('--host', default=os.getenv('ZHIPU_STUB_HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('ZHIPU_STUB_PORT', 8001)))
+    parser.add_argument('--mode', choices=['synthetic', 'record', 'replay'], default=os.getenv('ZHIPU_STUB_MODE', 'synthetic'))
+    parser.add_argument('--cassette', default=os.getenv('ZHIPU_STUB_CASSETTE', 'tools/cassettes/zhipu.jsonl'))
+    parser.add_argument('--upstream', default=os.getenv('ZHIPU_STUB_UPSTREAM', DEFAULT_UPSTREAM))
+    parser.add_argument('--strict', action='store_true', help='replay 模式下未命中时返回 404 而不是合成回复')
+    parser.add_argument('--latency', default=os.getenv('ZHIPU_STUB_LATENCY', 'lognormal:0.8,0.4'),
+                        help='fixed:S | uniform:A,B | normal:MEAN,STD | lognormal:MEDIAN,SIGMA | none')
+    parser.add_argument('--chunk-delay', type=float, default=0.02, help='流式输出每个块之间的延迟（秒）')
+    parser.add_argument('--error-rate', type=float, default=float(os.getenv('ZHIPU_STUB_ERROR_RATE', 0)))
+    parser.add_argument('--error-status', default='500,503,429', help='注入错误时随机使用的状态码')
+    parser.add_argument('--timeout-rate', type=float, default=0.0, help='模拟上游挂起的比例')
+    parser.add_argument('--timeout-seconds', type=float, default=60.0)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.mode in ('record', 'replay') and not args.cassette:
+        print("ERROR: --cassette is required in record/replay mode")
+        sys.exit(1)
+    print(f"🧪 Zhipu stub server ({args.mode}) on http://{args.host}:{args.port}/api/paas/v4")
+    print(f"   latency={args.latency} error_rate={args.error_rate} timeout_rate={args.timeout_rate}")
+    create_app(args).run(host=args.host, port=args.port, threaded=True)